@@ -0,0 +1,102 @@
+"""
+一次性初始化：建表、补建索引、旧格式事件迁移、默认管理员账户、默认 Google 跟踪设置。
+
+多 worker 部署时由启动进程在派生 worker 之前执行一次，并通过环境变量告知 worker 跳过；
+直接用 uvicorn --workers 启动时，各 worker 在 lifespan 中通过文件锁串行执行（操作本身幂等）。
+也可以单独执行：
+    python -m app.bootstrap
+"""
+import hashlib
+import logging
+import os
+
+from .config import settings
+from .database import Base, SessionLocal, engine
+from .event_store import migrate as migrate_events
+from .models import AdminUser, GoogleTrackingSettings
+from .rollup import check_dialect
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BOOTSTRAPPED_ENV = "APP_BOOTSTRAPPED"
+
+# 已被复合索引（session_id, created_at, id）取代的单列索引
+REDUNDANT_INDEXES = ("ix_events_session_id", "ix_conversions_session_id")
+
+def sync_indexes():
+    """create_all 不会给已存在的表补建索引：逐个检查创建，并删除已被取代的索引"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    with engine.begin() as connection:
+        for name in REDUNDANT_INDEXES:
+            connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+# 创建默认管理员账户
+def create_default_admin():
+    db = SessionLocal()
+    try:
+        # 从配置获取管理员账号密码
+        default_username = settings.ADMIN_USERNAME
+        default_password = settings.ADMIN_PASSWORD
+        
+        admin = db.query(AdminUser).filter(AdminUser.username == default_username).first()
+        if not admin:
+            password_hash = hashlib.sha256(default_password.encode()).hexdigest()
+            admin = AdminUser(username=default_username, password_hash=password_hash)
+            db.add(admin)
+            db.commit()
+            logger.info(f"Created default admin user: {default_username}")
+        else:
+            logger.info(f"Admin user already exists: {default_username}")
+    finally:
+        db.close()
+
+def create_default_google_settings():
+    db = SessionLocal()
+    try:
+        settings = db.query(GoogleTrackingSettings).first()
+        if not settings:
+            settings = GoogleTrackingSettings()
+            db.add(settings)
+            db.commit()
+            logger.info("Created default Google tracking settings")
+    finally:
+        db.close()
+
+def bootstrap():
+    check_dialect(engine.dialect.name)
+    # 创建表
+    Base.metadata.create_all(bind=engine)
+    sync_indexes()
+    migrate_events()
+    create_default_admin()
+    create_default_google_settings()
+
+def bootstrap_once():
+    """worker 启动时调用：启动进程已初始化则跳过，否则在文件锁内执行"""
+    if os.environ.get(BOOTSTRAPPED_ENV) == "1":
+        check_dialect(engine.dialect.name)
+        return
+    if fcntl is None:
+        bootstrap()
+        return
+
+    lock_dir = os.path.dirname(settings.BOOTSTRAP_LOCK_FILE)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+    with open(settings.BOOTSTRAP_LOCK_FILE, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            bootstrap()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    bootstrap()
@@ -0,0 +1,88 @@
+import time
+from typing import Any, Dict, Optional
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败 failure_threshold 次后断开（open），直接拒绝请求；
+    reset_timeout 秒后进入半开（half_open），放行少量探测请求，成功则恢复（closed），失败则重新断开。
+    只在事件循环中使用，不加锁。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_max_calls: int = 1):
+        """
+        :param failure_threshold: 触发断开的连续失败次数
+        :param reset_timeout: 断开后进入半开状态的等待时间（秒）
+        :param half_open_max_calls: 半开状态下同时放行的探测请求数
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started_at = 0.0
+
+        self.rejected = 0
+        self.opened_count = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """是否放行本次请求；放行后必须调用 record_success() 或 record_failure()"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            now = time.monotonic()
+            # 探测请求迟迟没有结果（如被取消）时，超时后允许新的探测
+            if self._probes < self.half_open_max_calls or now - self._probe_started_at >= self.reset_timeout:
+                if self._probes >= self.half_open_max_calls:
+                    self._probes = 0
+                self._probes += 1
+                self._probe_started_at = now
+                return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self) -> None:
+        if self._state != self.OPEN:
+            self.opened_count += 1
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+
+    def retry_after(self) -> Optional[float]:
+        """断开状态下距离进入半开的秒数"""
+        if self.state != self.OPEN:
+            return None
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+            "retry_after": self.retry_after(),
+            "opened_count": self.opened_count,
+            "rejected": self.rejected,
+        }
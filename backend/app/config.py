@@ -6,14 +6,38 @@ class Settings:
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+    # Token 校验模式：cached 信任 JWT 签名并缓存数据库校验结果，strict 每次查询数据库
+    TOKEN_VERIFY_MODE: str = os.getenv("TOKEN_VERIFY_MODE", "cached")
+    TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", "50000"))
+    TOKEN_CACHE_TTL: int = int(os.getenv("TOKEN_CACHE_TTL", "60"))
+    # 转换链接选择器缓存时间，多 worker 时其它 worker 的链接变更最多延迟这么久生效
+    LINK_CACHE_TTL: int = int(os.getenv("LINK_CACHE_TTL", "30"))
+    # Google 跟踪设置进程内缓存时间，以及公开接口返回的 Cache-Control max-age（秒）
+    GOOGLE_SETTINGS_CACHE_TTL: int = int(os.getenv("GOOGLE_SETTINGS_CACHE_TTL", "60"))
+    GOOGLE_SETTINGS_MAX_AGE: int = int(os.getenv("GOOGLE_SETTINGS_MAX_AGE", "300"))
     
     # 数据库配置
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./data/db.sqlite")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    # 公开接口数据库操作使用的线程数（每个 worker）
+    DB_THREADS: int = int(os.getenv("DB_THREADS", "5"))
+    
+    # SQLite 存储配置：performance（WAL 等调优参数）或 default（SQLite 默认行为）
+    SQLITE_PROFILE: str = os.getenv("SQLITE_PROFILE", "performance")
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_CACHE_SIZE: int = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # 负数单位为 KiB，即 64MB
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", "268435456"))  # 256MB
+    SQLITE_BUSY_TIMEOUT: int = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # 毫秒
     
     # 服务器配置
     HOST: str = os.getenv("BACKEND_HOST", "0.0.0.0")
     PORT: int = int(os.getenv("BACKEND_PORT", "8000"))
     RELOAD: bool = os.getenv("BACKEND_RELOAD", "false").lower() == "true"
+    # worker 进程数，大于 1 时 python -m app.main 以多进程模式启动
+    WORKERS: int = int(os.getenv("BACKEND_WORKERS", "1"))
+    BOOTSTRAP_LOCK_FILE: str = os.getenv("BOOTSTRAP_LOCK_FILE", "./data/.bootstrap.lock")
     
     # CORS 配置
     CORS_ORIGINS: List[str] = os.getenv("CORS_ORIGINS", "*").split(",")
@@ -29,14 +53,89 @@ class Settings:
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "info")
     LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
     
+    # /metrics 指标（Prometheus 文本格式）；设置 METRICS_TOKEN 后需携带 Authorization: Bearer <token>
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+    
     # 安全配置
     SECURE_HEADERS: bool = os.getenv("SECURE_HEADERS", "true").lower() == "true"
     RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
     RATE_LIMIT_REQUESTS: int = int(os.getenv("RATE_LIMIT_REQUESTS", "100"))
     RATE_LIMIT_WINDOW: int = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
     
+    # 事件写入队列配置
+    INGEST_QUEUE_MAX_SIZE: int = int(os.getenv("INGEST_QUEUE_MAX_SIZE", "10000"))
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+    INGEST_FLUSH_INTERVAL: float = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))
+    INGEST_OVERFLOW_POLICY: str = os.getenv("INGEST_OVERFLOW_POLICY", "reject")
+    # 转化队列遇到临时错误时一直重试；写不进去的转化和关闭时仍未写入的转化追加到该文件（NDJSON），
+    # 用 python -m app.ingest replay conversions 重新写入
+    CONVERSION_DEAD_LETTER_FILE: str = os.getenv("CONVERSION_DEAD_LETTER_FILE", "./data/conversions.dead-letter.ndjson")
+    # 事件类型名称的最大长度和最多登记的类型数，超出的类型记为 other
+    EVENT_TYPE_MAX_LENGTH: int = int(os.getenv("EVENT_TYPE_MAX_LENGTH", "64"))
+    EVENT_TYPE_MAX_COUNT: int = int(os.getenv("EVENT_TYPE_MAX_COUNT", "1000"))
+    TRACK_BATCH_MAX_EVENTS: int = int(os.getenv("TRACK_BATCH_MAX_EVENTS", "100"))
+    
+    # 数据保留：过期 token 的删除宽限期、事件/转化的在线保留天数（0 表示不清理），超出后归档到 ARCHIVE_DIR
+    RETENTION_ENABLED: bool = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+    RETENTION_INTERVAL: float = float(os.getenv("RETENTION_INTERVAL", "3600"))
+    RETENTION_LOCK_FILE: str = os.getenv("RETENTION_LOCK_FILE", "./data/.retention.lock")
+    TOKEN_RETENTION_GRACE_DAYS: int = int(os.getenv("TOKEN_RETENTION_GRACE_DAYS", "7"))
+    EVENT_RETENTION_DAYS: int = int(os.getenv("EVENT_RETENTION_DAYS", "90"))
+    CONVERSION_RETENTION_DAYS: int = int(os.getenv("CONVERSION_RETENTION_DAYS", "365"))
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", "./data/archive")
+    # 每个事务处理的行数和事务之间的间隔（秒），避免长时间占用写锁
+    RETENTION_CHUNK_SIZE: int = int(os.getenv("RETENTION_CHUNK_SIZE", "1000"))
+    RETENTION_CHUNK_PAUSE: float = float(os.getenv("RETENTION_CHUNK_PAUSE", "0.05"))
+    # 每次清理后增量回收的空闲页数（SQLite auto_vacuum=INCREMENTAL）
+    VACUUM_PAGES: int = int(os.getenv("VACUUM_PAGES", "2000"))
+    
+    # 数据导出：每次从游标读取的行数、每个响应块的字节数
+    EXPORT_YIELD_PER: int = int(os.getenv("EXPORT_YIELD_PER", "2000"))
+    EXPORT_CHUNK_BYTES: int = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+
     # 股票爬虫配置
     STOCK_CRAWLER_BASE_URL: str = os.getenv("STOCK_CRAWLER_BASE_URL", "http://stock-crawler:8080")
+    # kabutan 站点地址，基准测试时可指向本地替身服务（benchmarks/kabutan_stub.py）
+    CRAWLER_BASE_URL: str = os.getenv("CRAWLER_BASE_URL", "https://kabutan.jp")
+    CRAWLER_MAX_CONNECTIONS: int = int(os.getenv("CRAWLER_MAX_CONNECTIONS", "20"))
+    CRAWLER_MAX_KEEPALIVE: int = int(os.getenv("CRAWLER_MAX_KEEPALIVE", "10"))
+    CRAWLER_KEEPALIVE_EXPIRY: float = float(os.getenv("CRAWLER_KEEPALIVE_EXPIRY", "60"))
+    CRAWLER_CONNECT_TIMEOUT: float = float(os.getenv("CRAWLER_CONNECT_TIMEOUT", "3"))
+    CRAWLER_READ_TIMEOUT: float = float(os.getenv("CRAWLER_READ_TIMEOUT", "10"))
+    CRAWLER_WRITE_TIMEOUT: float = float(os.getenv("CRAWLER_WRITE_TIMEOUT", "5"))
+    CRAWLER_POOL_TIMEOUT: float = float(os.getenv("CRAWLER_POOL_TIMEOUT", "2"))
+    CRAWLER_HTTP2: bool = os.getenv("CRAWLER_HTTP2", "true").lower() == "true"
+    CRAWLER_USER_AGENT: str = os.getenv("CRAWLER_USER_AGENT", "Mozilla/5.0 (compatible; StockCrawler/1.0)")
+    # 页面解析方式：fast（lxml 只解析标题和价格表片段）、stream（边下载边解析，取到所需行后断开）、full（BeautifulSoup 全页解析）
+    CRAWLER_PARSE_MODE: str = os.getenv("CRAWLER_PARSE_MODE", "fast")
+    # 上游熔断：连续失败次数、断开后进入半开的时间（秒）、半开状态放行的探测请求数
+    CRAWLER_BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("CRAWLER_BREAKER_FAILURE_THRESHOLD", "5"))
+    CRAWLER_BREAKER_RESET_TIMEOUT: float = float(os.getenv("CRAWLER_BREAKER_RESET_TIMEOUT", "30"))
+    CRAWLER_BREAKER_HALF_OPEN_CALLS: int = int(os.getenv("CRAWLER_BREAKER_HALF_OPEN_CALLS", "1"))
+    # /api/stock 延迟预算（秒），超出时返回最近一次成功的数据或默认数据，0 表示不限制
+    STOCK_LATENCY_BUDGET: float = float(os.getenv("STOCK_LATENCY_BUDGET", "1.5"))
+    # /api/stock/batch 单次最多代码数、未命中代码的上游并发数
+    STOCK_BATCH_MAX_CODES: int = int(os.getenv("STOCK_BATCH_MAX_CODES", "50"))
+    STOCK_BATCH_CONCURRENCY: int = int(os.getenv("STOCK_BATCH_CONCURRENCY", "5"))
+    # 行情缓存：交易时段内/休市期间的有效期，以及过期后仍可返回旧数据的时间（秒）
+    QUOTE_CACHE_SIZE: int = int(os.getenv("QUOTE_CACHE_SIZE", "1000"))
+    QUOTE_TTL_MARKET_OPEN: int = int(os.getenv("QUOTE_TTL_MARKET_OPEN", "60"))
+    QUOTE_TTL_MARKET_CLOSED: int = int(os.getenv("QUOTE_TTL_MARKET_CLOSED", "21600"))
+    QUOTE_STALE_TTL: int = int(os.getenv("QUOTE_STALE_TTL", "86400"))
+    # 每次抓取解析并写入 stock_prices 的最近交易日数量
+    STOCK_HISTORY_ROWS: int = int(os.getenv("STOCK_HISTORY_ROWS", "30"))
+    # 热门代码后台刷新：统计半衰期、刷新数量、检查间隔、提前刷新时间（秒）、并发数、每秒请求数上限、随机抖动比例
+    STOCK_REFRESH_ENABLED: bool = os.getenv("STOCK_REFRESH_ENABLED", "true").lower() == "true"
+    STOCK_REFRESH_HALF_LIFE: float = float(os.getenv("STOCK_REFRESH_HALF_LIFE", "1800"))
+    STOCK_REFRESH_TOP_N: int = int(os.getenv("STOCK_REFRESH_TOP_N", "50"))
+    STOCK_REFRESH_INTERVAL: float = float(os.getenv("STOCK_REFRESH_INTERVAL", "5"))
+    STOCK_REFRESH_LEAD: float = float(os.getenv("STOCK_REFRESH_LEAD", "15"))
+    STOCK_REFRESH_CONCURRENCY: int = int(os.getenv("STOCK_REFRESH_CONCURRENCY", "4"))
+    STOCK_REFRESH_RATE_LIMIT: float = float(os.getenv("STOCK_REFRESH_RATE_LIMIT", "2"))
+    STOCK_REFRESH_JITTER: float = float(os.getenv("STOCK_REFRESH_JITTER", "0.2"))
+    # 多 worker 时只有持有该锁的进程执行刷新
+    STOCK_REFRESH_LOCK_FILE: str = os.getenv("STOCK_REFRESH_LOCK_FILE", "./data/.stock-refresh.lock")
     
     # 管理员账号配置
     ADMIN_USERNAME: str = os.getenv("ADMIN_USERNAME", "superadmin")
@@ -2,13 +2,48 @@ import json
 import asyncio
 import httpx
 from bs4 import BeautifulSoup
+from lxml import html as lxml_html
 import re
+import time
 from typing import List, Tuple, Optional, Dict, Any
 import logging
+from .config import settings
+from .circuit_breaker import CircuitBreaker
+from .metrics import crawler_upstream_requests, crawler_upstream_duration
+
+try:
+    import h2  # noqa: F401  HTTP/2 依赖（httpx[http2]）
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
-BASE_URL = 'https://kabutan.jp/stock/kabuka?code={code}'
+BASE_URL = settings.CRAWLER_BASE_URL.rstrip('/') + '/stock/kabuka?code={code}'
+
+# 上游熔断器：kabutan 连续失败时停止请求，所有抓取路径共用
+upstream_breaker = CircuitBreaker(
+    failure_threshold=settings.CRAWLER_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.CRAWLER_BREAKER_RESET_TIMEOUT,
+    half_open_max_calls=settings.CRAWLER_BREAKER_HALF_OPEN_CALLS
+)
+
+# 上游请求计数，所有抓取路径（单个查询、批量查询、后台刷新）都经过 get_price_data
+upstream_stats = {"requests_total": 0, "errors_total": 0, "in_flight": 0}
+
+PRICE_TABLE_CLASS = 'stock_kabuka0'
+PARSE_MODES = ("fast", "stream", "full")
+
+# 快速解析只截取页面中的第一个 h2 和价格表开头部分，不构建整页 DOM
+_H2_PATTERN = re.compile(r'<h2[\s>].*?</h2\s*>', re.S | re.I)
+_PRICE_TABLE_PATTERN = re.compile(
+    r'<table\b[^>]*\bclass\s*=\s*["\'][^"\']*(?<![\w-])' + PRICE_TABLE_CLASS + r'(?![\w-])', re.I
+)
+_ROW_END_PATTERN = re.compile(r'</tr\s*>', re.I)
+_TABLE_END_PATTERN = re.compile(r'</table\s*>', re.I)
+_PRICE_TABLE_XPATH = (
+    '//*[contains(concat(" ", normalize-space(@class), " "), " ' + PRICE_TABLE_CLASS + ' ")]//tr'
+)
 
 def _clean_text(text: str) -> str:
     return text.replace(' ', '').replace('\n', '').strip()
@@ -30,35 +65,181 @@ def _parse_table(soup: BeautifulSoup, table_class: str, skip_header: bool = Fals
         data.append([_clean_text(cell.text) for cell in cells])
     return data
 
-def _parse_title(soup: BeautifulSoup) -> Tuple[str, str]:
-    h2_tag = soup.find('h2')
-    if h2_tag and h2_tag.text:
-        match = re.match(r'(\d+)\s+(.+)', h2_tag.text.strip())
+def _match_title(text: str) -> Tuple[str, str]:
+    if text:
+        match = re.match(r'(\d+)\s+(.+)', text.strip())
         if match:
             return match.group(1), match.group(2)
     return "N/A", "N/A"
 
+def _parse_title(soup: BeautifulSoup) -> Tuple[str, str]:
+    h2_tag = soup.find('h2')
+    return _match_title(h2_tag.text if h2_tag else "")
+
 def _parse_company_image(soup: BeautifulSoup) -> str:
     image_tag = soup.select_one('div#chc_3_1.ch_sz1 img')
     if image_tag and image_tag.get('src'):
         return image_tag['src'].strip()
     return "N/A"
 
-async def get_price_data(code: str, client: httpx.AsyncClient) -> dict:
-    try:
-        response = await client.get(BASE_URL.format(code=code), timeout=10)
+def _row_cells(row) -> List[str]:
+    return [_clean_text(cell.text_content()) for cell in row.iter('td', 'th')]
+
+def _price_table_fragment(text: str, max_rows: int) -> Optional[str]:
+    """
+    截取价格表从开始到第 max_rows 个数据行（或表格结束）的 HTML 片段。
+    页面内容不完整（流式读取中）或找不到价格表时返回 None。
+    """
+    match = _PRICE_TABLE_PATTERN.search(text)
+    if not match:
+        return None
+    table_end = _TABLE_END_PATTERN.search(text, match.end())
+    limit = table_end.start() if table_end else len(text)
+
+    # 标题行 + max_rows 个数据行
+    row_end = None
+    for row_end in _ROW_END_PATTERN.finditer(text, match.end(), limit):
+        max_rows -= 1
+        if max_rows < 0:
+            return text[match.start():row_end.end()]
+    if table_end:
+        return text[match.start():table_end.end()]
+    return None
+
+def _parse_price_document(text: str) -> Tuple[str, str, List[List[str]]]:
+    root = lxml_html.document_fromstring(text)
+    h2_tag = root.find('.//h2')
+    symbol, name = _match_title(h2_tag.text_content() if h2_tag is not None else "")
+    rows = root.xpath(_PRICE_TABLE_XPATH)[1:]  # 跳过标题行
+    return symbol, name, [_row_cells(row) for row in rows]
+
+def parse_price_page(text: str, max_rows: Optional[int] = 1) -> Tuple[str, str, List[List[str]]]:
+    """
+    使用 lxml 解析股价页面，结果与 parse_price_page_soup 一致。
+    指定 max_rows 时只解析标题和价格表前几行的片段；页面结构不符合预期时退回整页解析。
+    :param text: 页面 HTML
+    :param max_rows: 最多返回的数据行数，None 表示全部
+    :return: (代码, 公司名, 价格数据行)
+    """
+    if max_rows is not None and text:
+        title = _H2_PATTERN.search(text)
+        fragment = _price_table_fragment(text, max_rows)
+        if title and fragment:
+            symbol, name = _match_title(lxml_html.fragment_fromstring(title.group(0)).text_content())
+            table = lxml_html.fragment_fromstring(fragment)
+            rows = list(table.iter('tr'))[1:]
+            return symbol, name, [_row_cells(row) for row in rows[:max_rows]]
+
+    symbol, name, rows = _parse_price_document(text)
+    return symbol, name, rows if max_rows is None else rows[:max_rows]
+
+def parse_price_page_soup(text: str, max_rows: Optional[int] = None) -> Tuple[str, str, List[List[str]]]:
+    """BeautifulSoup 整页解析（原实现），用于兼容和结果对照"""
+    soup = BeautifulSoup(text, 'html.parser')
+    rows = _parse_table(soup, PRICE_TABLE_CLASS, skip_header=True)
+    symbol, name = _parse_title(soup)
+    return symbol, name, rows if max_rows is None else rows[:max_rows]
+
+def create_http_client() -> httpx.AsyncClient:
+    """创建带连接池、keep-alive 和分阶段超时的 HTTP 客户端"""
+    limits = httpx.Limits(
+        max_connections=settings.CRAWLER_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.CRAWLER_MAX_KEEPALIVE,
+        keepalive_expiry=settings.CRAWLER_KEEPALIVE_EXPIRY
+    )
+    timeout = httpx.Timeout(
+        connect=settings.CRAWLER_CONNECT_TIMEOUT,
+        read=settings.CRAWLER_READ_TIMEOUT,
+        write=settings.CRAWLER_WRITE_TIMEOUT,
+        pool=settings.CRAWLER_POOL_TIMEOUT
+    )
+    return httpx.AsyncClient(
+        http2=settings.CRAWLER_HTTP2 and HTTP2_AVAILABLE,
+        limits=limits,
+        timeout=timeout,
+        headers={"User-Agent": settings.CRAWLER_USER_AGENT}
+    )
+
+async def _fetch_page_head(client: httpx.AsyncClient, url: str, max_rows: int) -> str:
+    """
+    流式读取页面，标题和所需的价格行都已到达时提前断开，不再下载页面剩余部分。
+    提前断开的连接不会放回连接池。
+    """
+    text = ""
+    async with client.stream("GET", url) as response:
         response.raise_for_status()
+        async for chunk in response.aiter_text():
+            text += chunk
+            if _H2_PATTERN.search(text) and _price_table_fragment(text, max_rows) is not None:
+                break
+    return text
+
+async def get_price_data(code: str, client: httpx.AsyncClient, max_rows: Optional[int] = 1,
+                         mode: Optional[str] = None) -> dict:
+    """
+    :param max_rows: 最多解析的价格行数（最新在前），None 表示全部
+    :param mode: 解析方式，默认取 CRAWLER_PARSE_MODE
+    """
+    upstream_stats["requests_total"] += 1
+    upstream_stats["in_flight"] += 1
+    try:
+        data = await _get_price_data(code, client, max_rows, mode)
+    except Exception:
+        upstream_stats["errors_total"] += 1
+        raise
+    finally:
+        upstream_stats["in_flight"] -= 1
+    if data.get("code") != 200:
+        upstream_stats["errors_total"] += 1
+    return data
+
+async def _get_price_data(code: str, client: httpx.AsyncClient, max_rows: Optional[int],
+                          mode: Optional[str]) -> dict:
+    if not upstream_breaker.allow():
+        crawler_upstream_requests.inc(("breaker_open",))
+        return {
+            "msg": "上流サービスが一時的に利用できません。",
+            "code": -2,
+            "data": {}
+        }
+    
+    mode = mode or settings.CRAWLER_PARSE_MODE
+    url = BASE_URL.format(code=code)
+    started = time.perf_counter()
+    try:
+        if mode == "stream" and max_rows is not None:
+            text = await _fetch_page_head(client, url, max_rows)
+        else:
+            response = await client.get(url)
+            response.raise_for_status()
+            text = response.text
     except (httpx.RequestError, httpx.HTTPStatusError) as e:
+        # 连接失败、超时、5xx 和限流计入熔断；其它 4xx 说明上游正常响应
+        if isinstance(e, httpx.HTTPStatusError):
+            status_code = e.response.status_code
+            outcome = "server_error" if status_code >= 500 else "rate_limited" if status_code == 429 else "client_error"
+        else:
+            outcome = "timeout" if isinstance(e, httpx.TimeoutException) else "network_error"
+        crawler_upstream_requests.inc((outcome,))
+        crawler_upstream_duration.observe(time.perf_counter() - started, (outcome,))
+        if outcome == "client_error":
+            upstream_breaker.record_success()
+        else:
+            upstream_breaker.record_failure()
         logger.error(f"Failed to fetch stock data for {code}: {e}")
         return {
             "msg": "リクエストに失敗しました。",
             "code": -1,
             "data": {}
         }
+    upstream_breaker.record_success()
+    crawler_upstream_requests.inc(("ok",))
+    crawler_upstream_duration.observe(time.perf_counter() - started, ("ok",))
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-    price_chart_data = _parse_table(soup, 'stock_kabuka0', skip_header=True)
-    symbol, name = _parse_title(soup)
+    if mode == "full":
+        symbol, name, price_chart_data = parse_price_page_soup(text, max_rows)
+    else:
+        symbol, name, price_chart_data = parse_price_page(text, max_rows)
 
     return {
         "msg": "success",
@@ -70,19 +251,59 @@ async def get_price_data(code: str, client: httpx.AsyncClient) -> dict:
         }
     }
 
-async def get_prices_for_codes(codes: List[str]) -> List[dict]:
-    async with httpx.AsyncClient() as client:
-        tasks = [get_price_data(code, client) for code in codes]
+async def get_prices_for_codes(codes: List[str], client: Optional[httpx.AsyncClient] = None,
+                               concurrency: Optional[int] = None, max_rows: Optional[int] = 1) -> List[dict]:
+    """
+    并发获取多个代码的数据，结果顺序与 codes 一致。
+    :param concurrency: 同时进行的请求数上限，None 表示不限制
+    :param max_rows: 每个代码解析的价格行数
+    """
+    semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+    async def fetch(code: str, client: httpx.AsyncClient) -> dict:
+        if semaphore is None:
+            return await get_price_data(code, client, max_rows)
+        async with semaphore:
+            return await get_price_data(code, client, max_rows)
+
+    if client is not None:
+        return await asyncio.gather(*[fetch(code, client) for code in codes])
+    async with create_http_client() as client:
+        tasks = [fetch(code, client) for code in codes]
         return await asyncio.gather(*tasks)
 
 async def get_today_price_data_json(code: str) -> str:
-    async with httpx.AsyncClient() as client:
-        data = await get_price_data(code, client)
+    async with create_http_client() as client:
+        data = await get_price_data(code, client, max_rows=None)
     return json.dumps(data, ensure_ascii=False, indent=4)
 
 class StockCrawler:
     """股票爬虫类，封装爬虫功能供API调用"""
     
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    async def start(self):
+        """创建共享 HTTP 客户端，由应用 lifespan 调用"""
+        if self._client is None:
+            self._client = create_http_client()
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 未经 lifespan 启动（如脚本中直接使用）时按需创建
+        if self._client is None:
+            self._client = create_http_client()
+        return self._client
+    
+    @property
+    def in_flight(self) -> int:
+        return upstream_stats["in_flight"]
+    
     async def get_stock_data(self, code: str) -> Optional[Dict[str, Any]]:
         """
         获取股票数据
@@ -90,16 +311,36 @@ class StockCrawler:
         :return: 股票数据字典或None
         """
         try:
-            async with httpx.AsyncClient() as client:
-                data = await get_price_data(code, client)
-                if data.get("code") == 200:
-                    return data
-                else:
-                    logger.warning(f"Crawler returned error for stock {code}: {data.get('msg')}")
-                    return None
+            data = await get_price_data(code, self.client, max_rows=settings.STOCK_HISTORY_ROWS)
+            if data.get("code") == 200:
+                return data
+            else:
+                logger.warning(f"Crawler returned error for stock {code}: {data.get('msg')}")
+                return None
         except Exception as e:
             logger.error(f"Error in stock crawler for {code}: {e}")
             return None
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """连接池使用情况"""
+        stats = {
+            "http2": settings.CRAWLER_HTTP2 and HTTP2_AVAILABLE,
+            "max_connections": settings.CRAWLER_MAX_CONNECTIONS,
+            "max_keepalive_connections": settings.CRAWLER_MAX_KEEPALIVE,
+            **upstream_stats,
+            "breaker": upstream_breaker.stats(),
+            "connections": 0,
+            "idle_connections": 0,
+            "active_connections": 0
+        }
+        # httpx 未公开连接池对象，取不到时只返回计数
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for connection in connections if connection.is_idle())
+            stats["active_connections"] = stats["connections"] - stats["idle_connections"]
+        return stats
 
 # 全局爬虫实例
-stock_crawler = StockCrawler()
\ No newline at end of file
+stock_crawler = StockCrawler()
@@ -0,0 +1,118 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from .config import settings
+
+T = TypeVar("T")
+
+# SQLite 存储配置：performance 为 WAL + 调优参数，default 保持 SQLite 默认行为（回滚日志、synchronous=FULL）
+SQLITE_PROFILES = {
+    "default": {},
+    "performance": {
+        # 只对新建数据库生效，且必须在切换 WAL 之前设置；已有数据库用 python -m app.retention vacuum --full 转换
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "cache_size": settings.SQLITE_CACHE_SIZE,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT,
+        "temp_store": "MEMORY",
+    },
+}
+
+def create_db_engine(database_url: str, profile: str = settings.SQLITE_PROFILE) -> Engine:
+    if not database_url.startswith("sqlite"):
+        return create_engine(
+            database_url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_pre_ping=True
+        )
+    
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLite profile: {profile}")
+    
+    connect_args = {"check_same_thread": False}
+    if profile != "default":
+        # sqlite3 模块自带的等待时间（秒），与 busy_timeout 保持一致
+        connect_args["timeout"] = settings.SQLITE_BUSY_TIMEOUT / 1000
+    
+    if ":memory:" in database_url or database_url.rstrip("/") == "sqlite:":
+        # 内存数据库只能单连接
+        engine = create_engine(database_url, connect_args=connect_args)
+    else:
+        # 每个 worker 一个连接池；SQLite 同时只有一个写者，连接数只需覆盖请求线程和后台写入线程
+        engine = create_engine(
+            database_url,
+            connect_args=connect_args,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW
+        )
+    
+    pragmas = SQLITE_PROFILES[profile]
+    if pragmas:
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+    
+    return engine
+
+# 数据库配置
+engine = create_db_engine(settings.DATABASE_URL)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base = declarative_base()
+
+# 数据库线程池：异步路由中的同步 SQLAlchemy 调用在这里执行，不阻塞事件循环
+db_executor = ThreadPoolExecutor(max_workers=settings.DB_THREADS, thread_name_prefix="db")
+
+# 已提交但还没有开始执行（等待空闲线程）的调用数
+_pending_lock = threading.Lock()
+_pending_calls = 0
+
+def pending_db_calls() -> int:
+    return _pending_calls
+
+def _leave_queue(state: dict) -> None:
+    """调用开始执行或在开始前被取消时各调用一次，只有先到的一次计数"""
+    global _pending_calls
+    with _pending_lock:
+        if state["left"]:
+            return
+        state["left"] = True
+        _pending_calls -= 1
+
+async def run_sync(func: Callable[..., T], *args: Any) -> T:
+    """在数据库线程池中执行同步函数（复制当前上下文，使 SQL 计时能归到所属请求）"""
+    global _pending_calls
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    state = {"left": False}
+
+    def call() -> T:
+        _leave_queue(state)
+        return context.run(func, *args)
+
+    with _pending_lock:
+        _pending_calls += 1
+    try:
+        return await loop.run_in_executor(db_executor, call)
+    finally:
+        _leave_queue(state)
+
+async def run_db(func: Callable[..., T], *args: Any) -> T:
+    """在数据库线程池中打开会话并执行 func(db, *args)"""
+    def call():
+        db = SessionLocal()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+    return await run_sync(call)
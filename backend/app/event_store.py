@@ -0,0 +1,299 @@
+"""
+事件的紧凑存储：事件类型存为 event_types 中的编号，滚动位置和元素单独成列，
+设备信息（user_agent、IP）每个会话只在 session_devices 中存一次，meta 只保留其余字段。
+
+旧格式（event_type 字符串列 + 含 user_agent / client_ip / timestamp 的 meta JSON）在启动初始化时迁移，
+也可以单独执行（迁移后用 python -m app.retention vacuum --full 回收空间）：
+    python -m app.event_store migrate
+"""
+import argparse
+import json
+import logging
+import math
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import String, inspect, insert, literal_column, select, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import Base, SessionLocal, engine
+from .models import Event, EventType, SessionDevice
+from .rollup import upsert
+
+logger = logging.getLogger(__name__)
+
+DEVICE_FIELDS = ("user_agent", "client_ip")
+# 旧格式中与 created_at 重复的字段
+LEGACY_FIELDS = ("timestamp",)
+UNKNOWN_EVENT_TYPE = "unknown"
+# 名称过长或类型数已达上限时使用的类型
+OTHER_EVENT_TYPE = "other"
+# scroll_y 列（INTEGER）的取值范围
+SCROLL_Y_LIMIT = 2 ** 31 - 1
+
+# 事件类型编号缓存：编号一经登记不再变化，各 worker 未命中时从数据库重新加载
+_type_codes: Dict[str, int] = {}
+_type_names: Dict[int, str] = {}
+_type_lock = threading.Lock()
+
+
+def _load_event_types(db: Session) -> None:
+    rows = db.execute(select(EventType.id, EventType.name)).all()
+    with _type_lock:
+        for code, name in rows:
+            _type_codes[name] = code
+            _type_names[code] = name
+
+
+def event_type_codes(names: Iterable[str]) -> Dict[str, int]:
+    """
+    返回事件类型名称到编号的映射，未登记的类型在独立的短事务中登记。
+    超过 EVENT_TYPE_MAX_LENGTH 的名称、以及类型数达到 EVENT_TYPE_MAX_COUNT 后新出现的名称映射到 other。
+    :raises TypeError: 名称不是字符串
+    """
+    names = set(names)
+    if any(not isinstance(name, str) for name in names):
+        raise TypeError("Event type names must be strings")
+    accepted = {name for name in names if len(name) <= settings.EVENT_TYPE_MAX_LENGTH}
+    if (accepted | {OTHER_EVENT_TYPE}) - _type_codes.keys():
+        db = SessionLocal()
+        try:
+            _load_event_types(db)
+            missing = accepted - _type_codes.keys()
+            # other 不占用上限
+            room = max(settings.EVENT_TYPE_MAX_COUNT - len(_type_codes.keys() - {OTHER_EVENT_TYPE}), 0)
+            new_names = sorted(missing - {OTHER_EVENT_TYPE})[:room]
+            if OTHER_EVENT_TYPE not in _type_codes:
+                new_names.append(OTHER_EVENT_TYPE)
+            if new_names:
+                stmt = upsert(db, EventType).on_conflict_do_nothing(index_elements=[EventType.name])
+                db.execute(stmt, [{"name": name} for name in new_names])
+                db.commit()
+                _load_event_types(db)
+        finally:
+            db.close()
+    other = _type_codes[OTHER_EVENT_TYPE]
+    return {name: _type_codes.get(name, other) for name in names}
+
+
+def event_type_names(db: Session, codes: Iterable[Optional[int]]) -> Dict[Optional[int], str]:
+    """返回事件类型编号到名称的映射，未知编号对应 unknown"""
+    codes = set(codes)
+    if codes - _type_names.keys() - {None}:
+        _load_event_types(db)
+    return {code: _type_names.get(code, UNKNOWN_EVENT_TYPE) for code in codes}
+
+
+def split_meta(meta: Dict[str, Any]) -> Tuple[Optional[int], Optional[str], Dict[str, Any]]:
+    """拆出滚动位置和元素，返回 (scroll_y, element, 其余字段)；设备信息和时间戳由服务端记录，丢弃客户端的值"""
+    extra = {key: value for key, value in meta.items() if key not in DEVICE_FIELDS + LEGACY_FIELDS}
+    scroll_y = extra.get("scrollY")
+    if isinstance(scroll_y, (int, float)) and not isinstance(scroll_y, bool) and math.isfinite(scroll_y):
+        scroll_y = min(max(round(extra.pop("scrollY")), -SCROLL_Y_LIMIT), SCROLL_Y_LIMIT)
+    else:
+        # 非有限数值等留在 meta 中
+        scroll_y = None
+    element = extra.pop("element") if isinstance(extra.get("element"), str) else None
+    return scroll_y, element, extra
+
+
+def _dump_meta(extra: Dict[str, Any]) -> Optional[str]:
+    return json.dumps(extra) if extra else None
+
+
+def pack_event(session_id: str, event_type: Optional[str], meta: Dict[str, Any], user_agent: str,
+               client_ip: Optional[str], created_at: datetime) -> Dict[str, Any]:
+    """
+    把上报的事件转成写入队列的记录。
+    event_type 保留名称（会话汇总按名称计数），写入时换成编号；user_agent / client_ip 写入 session_devices。
+    """
+    scroll_y, element, extra = split_meta(meta if isinstance(meta, dict) else {})
+    return {
+        "session_id": session_id,
+        "event_type": event_type if isinstance(event_type, str) and event_type else UNKNOWN_EVENT_TYPE,
+        "scroll_y": scroll_y,
+        "element": element,
+        "meta": _dump_meta(extra),
+        "created_at": created_at,
+        "user_agent": user_agent,
+        "client_ip": client_ip,
+    }
+
+
+def save_devices(db: Session, devices: Dict[str, Dict[str, Any]]) -> None:
+    """登记会话设备信息，已有记录的会话跳过，不提交事务"""
+    if devices:
+        stmt = upsert(db, SessionDevice).on_conflict_do_nothing(index_elements=[SessionDevice.session_id])
+        db.execute(stmt, list(devices.values()))
+
+
+def insert_events(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """写入一批 pack_event 生成的事件及其会话设备信息，不提交事务"""
+    if not rows:
+        return
+    # 先登记类型（独立事务），再在调用方事务中写入；映射到 other 的记录按 other 汇总
+    codes = event_type_codes(row["event_type"] for row in rows)
+    row_codes = [codes[row["event_type"]] for row in rows]
+    for row, code in zip(rows, row_codes):
+        if _type_names.get(code) == OTHER_EVENT_TYPE:
+            row["event_type"] = OTHER_EVENT_TYPE
+    devices: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        devices.setdefault(row["session_id"], {
+            "session_id": row["session_id"],
+            "user_agent": row["user_agent"],
+            "client_ip": row["client_ip"],
+            "created_at": row["created_at"],
+        })
+    save_devices(db, devices)
+    db.execute(insert(Event), [
+        {
+            "session_id": row["session_id"],
+            "event_code": code,
+            "scroll_y": row["scroll_y"],
+            "element": row["element"],
+            "meta": row["meta"],
+            "created_at": row["created_at"],
+        }
+        for row, code in zip(rows, row_codes)
+    ])
+
+
+def event_meta(event: Event, device: Optional[SessionDevice]) -> Dict[str, Any]:
+    """还原为旧格式的 meta（含设备信息和时间戳），供管理后台展示"""
+    meta = json.loads(event.meta) if event.meta else {}
+    if event.scroll_y is not None:
+        meta["scrollY"] = event.scroll_y
+    if event.element is not None:
+        meta["element"] = event.element
+    if device is not None:
+        meta["user_agent"] = device.user_agent
+        meta["client_ip"] = device.client_ip
+    meta["timestamp"] = event.created_at.isoformat()
+    return meta
+
+
+def _parse_legacy_meta(value: Optional[str]) -> Dict[str, Any]:
+    if not value:
+        return {}
+    try:
+        meta = json.loads(value)
+    except ValueError:
+        return {"raw": value}
+    return meta if isinstance(meta, dict) else {"raw": meta}
+
+
+def convert_legacy_events(db: Session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    把旧格式事件（含 event_type 名称和完整 meta）转换为紧凑格式的列值，并登记设备信息（不提交事务）。
+    已是紧凑格式的记录原样返回。
+    """
+    legacy = [row for row in rows if "event_type" in row]
+    if not legacy:
+        return rows
+    codes = event_type_codes(row["event_type"] or UNKNOWN_EVENT_TYPE for row in legacy)
+    devices: Dict[str, Dict[str, Any]] = {}
+    converted = []
+    for row in rows:
+        if "event_type" not in row:
+            converted.append(row)
+            continue
+        meta = _parse_legacy_meta(row.get("meta"))
+        if row["session_id"] not in devices and any(field in meta for field in DEVICE_FIELDS):
+            devices[row["session_id"]] = {
+                "session_id": row["session_id"],
+                "user_agent": meta.get("user_agent"),
+                "client_ip": meta.get("client_ip"),
+                "created_at": row["created_at"],
+            }
+        scroll_y, element, extra = split_meta(meta)
+        values = {key: value for key, value in row.items() if key not in ("event_type", "meta")}
+        converted.append({
+            **values,
+            "event_code": codes[row["event_type"] or UNKNOWN_EVENT_TYPE],
+            "scroll_y": scroll_y,
+            "element": element,
+            "meta": _dump_meta(extra),
+        })
+    save_devices(db, devices)
+    return converted
+
+
+def migrate(chunk_size: int = 1000) -> int:
+    """
+    把旧格式的 events 表迁移为紧凑格式：补充新列，分批转换旧记录，最后删除 event_type 列。
+    已迁移或新建的数据库直接返回 0。
+    :return: 转换的事件数
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns("events")}
+    if "event_type" not in columns:
+        return 0
+
+    with engine.begin() as connection:
+        for column in Event.__table__.columns:
+            if column.name not in columns:
+                ddl = column.type.compile(dialect=engine.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE events ADD COLUMN {column.name} {ddl}")
+
+    # event_type 已不在模型中，按字符串列读取
+    legacy_type = literal_column("event_type", String).label("event_type")
+    update_event = text(
+        "UPDATE events SET event_code = :event_code, scroll_y = :scroll_y, element = :element, "
+        "meta = :meta, event_type = NULL WHERE id = :id"
+    )
+    total, last_id = 0, 0
+    while True:
+        # 读取和写入分开，写入只持有一个分批的短事务
+        db = SessionLocal()
+        try:
+            rows = [
+                dict(row)
+                for row in db.execute(
+                    select(Event.id, Event.session_id, legacy_type, Event.meta, Event.created_at)
+                    .where(Event.event_code.is_(None), Event.id > last_id)
+                    .order_by(Event.id)
+                    .limit(chunk_size)
+                ).mappings()
+            ]
+        finally:
+            db.close()
+        if not rows:
+            break
+
+        db = SessionLocal()
+        try:
+            converted = convert_legacy_events(db, rows)
+            db.execute(update_event, [
+                {key: row[key] for key in ("id", "event_code", "scroll_y", "element", "meta")}
+                for row in converted
+            ])
+            db.commit()
+        finally:
+            db.close()
+        total += len(rows)
+        last_id = rows[-1]["id"]
+
+    try:
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ALTER TABLE events DROP COLUMN event_type")
+    except (OperationalError, ProgrammingError) as e:
+        # SQLite 3.35 以下不支持 DROP COLUMN，保留已清空的旧列
+        logger.warning(f"Could not drop events.event_type, leaving the emptied column in place: {e}")
+
+    if total:
+        logger.info(f"Migrated {total} events to the compact format")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="事件存储维护")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    Base.metadata.create_all(bind=engine)
+    logger.info(f"Migrated {migrate(args.chunk_size)} events")
@@ -0,0 +1,150 @@
+"""
+会话、事件、转化的流式导出（CSV / NDJSON，可选 gzip）。
+
+按索引顺序用 yield_per 分批读取（PostgreSQL 下为服务端游标），编码成约 EXPORT_CHUNK_BYTES 的块后交给
+StreamingResponse，内存占用只与分批大小有关，与导出行数无关。
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Any, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.sql import Select
+
+from .database import SessionLocal
+from .models import Conversion, Event, EventType, SessionDevice, SessionStats
+
+EXPORT_TABLES = ("sessions", "events", "conversions")
+EXPORT_FORMATS = ("csv", "ndjson")
+# text/* 由 Starlette 自动补充 charset=utf-8
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_statement(table: str, start_date: Optional[datetime], end_date: Optional[datetime],
+                     utm_source: Optional[str]) -> Select:
+    """构造导出查询：日期按会话开始/事件/转化时间过滤（结束日期当天包含在内），utm_source 取会话来源"""
+    if table == "sessions":
+        stmt = select(
+            SessionStats.session_id,
+            SessionStats.gclid,
+            SessionStats.utm_source,
+            SessionStats.session_start,
+            SessionStats.event_count,
+            SessionStats.page_visit_count,
+            SessionStats.scroll_count,
+            SessionStats.click_count,
+            SessionStats.stock_prefill_count,
+            SessionStats.conversion_count,
+            SessionStats.first_activity,
+            SessionStats.last_activity,
+        ).order_by(SessionStats.session_start, SessionStats.session_id)
+        time_column = SessionStats.session_start
+    elif table == "events":
+        stmt = (
+            select(
+                Event.id,
+                Event.session_id,
+                EventType.name.label("event_type"),
+                Event.scroll_y,
+                Event.element,
+                Event.meta,
+                Event.created_at,
+                SessionStats.utm_source,
+                SessionStats.gclid,
+                SessionDevice.user_agent,
+                SessionDevice.client_ip,
+            )
+            .outerjoin(EventType, EventType.id == Event.event_code)
+            .outerjoin(SessionStats, SessionStats.session_id == Event.session_id)
+            .outerjoin(SessionDevice, SessionDevice.session_id == Event.session_id)
+            .order_by(Event.id)
+        )
+        time_column = Event.created_at
+    elif table == "conversions":
+        stmt = (
+            select(
+                Conversion.id,
+                Conversion.session_id,
+                Conversion.input_value,
+                Conversion.target_url,
+                Conversion.created_at,
+                SessionStats.utm_source,
+                SessionStats.gclid,
+            )
+            .outerjoin(SessionStats, SessionStats.session_id == Conversion.session_id)
+            .order_by(Conversion.id)
+        )
+        time_column = Conversion.created_at
+    else:
+        raise ValueError(f"Unknown export table: {table}")
+
+    if start_date:
+        stmt = stmt.where(time_column >= start_date)
+    if end_date:
+        stmt = stmt.where(time_column < end_date + timedelta(days=1))
+    if utm_source:
+        stmt = stmt.where(SessionStats.utm_source == utm_source)
+    return stmt
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def stream_export(table: str, fmt: str, compress: bool, start_date: Optional[datetime], end_date: Optional[datetime],
+                  utm_source: Optional[str], yield_per: int, chunk_bytes: int) -> Iterator[bytes]:
+    """
+    逐块生成导出内容。CSV 的 meta 保留 JSON 字符串，NDJSON 中解码为对象。
+    同步生成器，由 StreamingResponse 在线程池中迭代；客户端断开时关闭会话。
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(export_statement(table, start_date, end_date, utm_source).execution_options(yield_per=yield_per))
+        columns = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == "csv" else None
+        # wbits=31：输出带 gzip 头的流
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+        def take() -> bytes:
+            data = buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            return compressor.compress(data) if compressor else data
+
+        if writer:
+            writer.writerow(columns)
+        has_meta = "meta" in columns
+        for row in result:
+            if writer:
+                writer.writerow([_csv_value(value) for value in row])
+            else:
+                item = dict(zip(columns, row))
+                if has_meta:
+                    item["meta"] = json.loads(item["meta"]) if item["meta"] else {}
+                buffer.write(json.dumps(item, ensure_ascii=False, default=_json_default) + "\n")
+            if buffer.tell() >= chunk_bytes:
+                data = take()
+                if data:
+                    yield data
+
+        data = take()
+        if compressor:
+            data += compressor.flush()
+        if data:
+            yield data
+    finally:
+        db.close()
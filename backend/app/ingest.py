@@ -0,0 +1,359 @@
+"""
+进程内写后队列（事件、转化的批量落库）。
+
+转化队列写不进去的记录追加到死信文件（CONVERSION_DEAD_LETTER_FILE），排除原因后重新写入：
+    python -m app.ingest replay conversions [--file PATH]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_REJECT = "reject"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+
+# 不限重试次数的队列在关闭时最多再尝试的次数，之后剩余记录写入死信文件
+SHUTDOWN_FLUSH_RETRIES = 3
+
+
+class QueueFullError(Exception):
+    """队列已满且溢出策略为 reject 时抛出"""
+
+
+class WriteBehindQueue:
+    """
+    进程内写后队列：请求路径只负责入队，后台任务按批量大小或时间窗口批量落库。
+    flush_func 为同步函数（例如 SQLAlchemy 批量插入），在线程池中执行，不阻塞事件循环。
+    批量写入因临时错误（如数据库被锁）失败时整批重试；其它错误视为批内有坏记录，改为逐条写入，
+    只丢弃（或写入死信文件）写不进去的记录。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_func: Callable[[List[Dict[str, Any]]], None],
+        max_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow: str = OVERFLOW_REJECT,
+        max_retries: Optional[int] = 3,
+        max_backoff: float = 30.0,
+        dead_letter_file: Optional[str] = None,
+        transient_errors: Tuple[Type[BaseException], ...] = (),
+    ):
+        """
+        :param name: 队列名称，用于日志和指标
+        :param flush_func: 批量写入函数，接收一批记录
+        :param max_size: 队列最大长度，超过后按溢出策略处理
+        :param batch_size: 单次批量写入的最大记录数，达到后立即触发写入
+        :param flush_interval: 最长攒批时间（秒）
+        :param overflow: 溢出策略，reject 拒绝新记录 / drop_oldest 丢弃最旧记录
+        :param max_retries: 单批写入失败后的最大重试次数，超过后丢弃该批；None 表示一直重试，不丢弃
+        :param max_backoff: 连续失败时重试间隔（按 flush_interval 指数增长）的上限（秒）
+        :param dead_letter_file: 写不进去的坏记录和关闭时仍未写入的记录以 NDJSON 追加到该文件，None 时丢弃并记录日志
+        :param transient_errors: 视为临时错误、整批重试的异常类型
+        """
+        if overflow not in (OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.name = name
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.dead_letter_file = dead_letter_file
+        self.transient_errors = transient_errors
+        self._flush_func = flush_func
+        self._items: Deque[Dict[str, Any]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._failures = 0
+
+        # 指标
+        self.enqueued = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.flush_count = 0
+        self.flush_errors = 0
+        self.dead_lettered = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, item: Dict[str, Any]) -> None:
+        """
+        非阻塞入队。
+        :raises QueueFullError: 队列已满且溢出策略为 reject
+        """
+        if len(self._items) >= self.max_size:
+            if self.overflow == OVERFLOW_REJECT:
+                self.rejected += 1
+                raise QueueFullError(f"{self.name} queue is full")
+            self._items.popleft()
+            self.dropped += 1
+
+        self._items.append(item)
+        self.enqueued += 1
+        # 写入失败退避期间不提前唤醒
+        if len(self._items) >= self.batch_size and self._wakeup is not None and not self._failures:
+            self._wakeup.set()
+
+    def put_many(self, items: List[Dict[str, Any]]) -> None:
+        """
+        批量入队。reject 策略下整批要么全部入队，要么全部拒绝。
+        :raises QueueFullError: 队列剩余空间不足且溢出策略为 reject
+        """
+        if self.overflow == OVERFLOW_REJECT and len(self._items) + len(items) > self.max_size:
+            self.rejected += len(items)
+            raise QueueFullError(f"{self.name} queue is full")
+        for item in items:
+            self.put(item)
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name=f"write-behind-{self.name}")
+        logger.info(f"Write-behind queue '{self.name}' started")
+
+    async def stop(self) -> None:
+        """停止后台任务并把剩余记录全部写入"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush(max_failures=SHUTDOWN_FLUSH_RETRIES if self.max_retries is None else None)
+        if self._items:
+            items = list(self._items)
+            self._items.clear()
+            self._discard(items, "unflushed on shutdown")
+        logger.info(f"Write-behind queue '{self.name}' stopped")
+
+    async def flush(self, max_failures: Optional[int] = None) -> None:
+        """
+        立即写入队列中的全部记录，写入失败时在重试次数内继续尝试
+        :param max_failures: 连续失败达到该次数后放弃（记录保留在队列中），None 表示不限
+        """
+        while self._items:
+            if not await self._flush_batch():
+                if self._failures == 0:
+                    # 该批已达重试上限被丢弃，继续写剩余记录
+                    continue
+                if max_failures is not None and self._failures >= max_failures:
+                    return
+                await asyncio.sleep(min(self.flush_interval, 0.1))
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._retry_delay())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._items and not self._stopping:
+                if not await self._flush_batch():
+                    break
+
+    async def _flush_batch(self) -> bool:
+        batch = [self._items.popleft() for _ in range(min(self.batch_size, len(self._items)))]
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._flush_func, batch)
+        except self.transient_errors as e:
+            return self._retry_later(batch, e)
+        except Exception as e:
+            self.flush_errors += 1
+            if len(batch) == 1:
+                self._failures = 0
+                self._discard(batch, f"rejected by flush: {e}")
+                return True
+            logger.warning(f"Write-behind queue '{self.name}' batch flush failed, writing items one by one: {e}")
+            return await self._flush_rows(batch)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._failures = 0
+        self.flushed += len(batch)
+        self.flush_count += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+        return True
+
+    def _retry_later(self, batch: List[Dict[str, Any]], error: BaseException) -> bool:
+        """临时错误：整批放回队首等待重试，超过重试次数时丢弃"""
+        self.flush_errors += 1
+        self._failures += 1
+        if self.max_retries is not None and self._failures > self.max_retries:
+            self._failures = 0
+            self.dropped += len(batch)
+            logger.error(f"Write-behind queue '{self.name}' dropped {len(batch)} items after retries: {error}")
+        else:
+            self._items.extendleft(reversed(batch))
+            logger.warning(f"Write-behind queue '{self.name}' flush failed, will retry: {error}")
+        return False
+
+    async def _flush_rows(self, batch: List[Dict[str, Any]]) -> bool:
+        """逐条写入，只舍弃写不进去的记录；中途遇到临时错误时剩余记录放回队列"""
+        written = 0
+        bad: List[Dict[str, Any]] = []
+        result = True
+        for index, item in enumerate(batch):
+            try:
+                await asyncio.to_thread(self._flush_func, [item])
+            except self.transient_errors as e:
+                result = self._retry_later(batch[index:], e)
+                break
+            except Exception as e:
+                bad.append(item)
+                logger.error(f"Write-behind queue '{self.name}' rejected item: {e}")
+            else:
+                written += 1
+        else:
+            self._failures = 0
+        self.flushed += written
+        if written:
+            self.flush_count += 1
+        if bad:
+            self._discard(bad, "rejected by flush")
+        return result
+
+    def _discard(self, items: List[Dict[str, Any]], reason: str) -> None:
+        """无法写入的记录：配置了死信文件时追加写入，否则丢弃"""
+        if self.dead_letter_file is not None and self._write_dead_letter(items):
+            self.dead_lettered += len(items)
+            logger.error(f"Write-behind queue '{self.name}' wrote {len(items)} items to {self.dead_letter_file} ({reason})")
+            return
+        self.dropped += len(items)
+        logger.error(f"Write-behind queue '{self.name}' dropped {len(items)} items ({reason})")
+
+    def _retry_delay(self) -> float:
+        """下一次写入前的等待时间：正常时为 flush_interval，连续失败时指数退避"""
+        if not self._failures:
+            return self.flush_interval
+        return min(self.flush_interval * 2 ** self._failures, self.max_backoff)
+
+    def _write_dead_letter(self, items: List[Dict[str, Any]]) -> bool:
+        try:
+            _write_lines(self.dead_letter_file, [_dump_item(item) for item in items])
+        except OSError as e:
+            logger.error(f"Write-behind queue '{self.name}' could not write dead-letter file: {e}")
+            return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "depth": len(self._items),
+            "max_size": self.max_size,
+            "overflow": self.overflow,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "flush_count": self.flush_count,
+            "flush_errors": self.flush_errors,
+            "dead_lettered": self.dead_lettered,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flush_count, 3) if self.flush_count else 0.0,
+        }
+
+
+def _dump_item(item: Dict[str, Any]) -> str:
+    return json.dumps(item, ensure_ascii=False, default=str)
+
+
+def _write_lines(path: str, lines: List[str]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as output:
+        for line in lines:
+            output.write(line + "\n")
+        output.flush()
+        os.fsync(output.fileno())
+
+
+def replay_dead_letter(path: str, flush_func: Callable[[List[Dict[str, Any]]], None], batch_size: int = 500,
+                       datetime_fields: Tuple[str, ...] = ("created_at",)) -> Tuple[int, int]:
+    """
+    把死信文件中的记录重新写入。文件先改名再处理（运行中的应用继续追加到新文件），
+    仍然写不进去的记录追加回原路径，其余记录写入后删除改名后的文件。
+    :return: (写入数, 仍失败数)
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    replaying = f"{path}.replaying"
+    os.replace(path, replaying)
+
+    items: List[Dict[str, Any]] = []
+    failed: List[str] = []
+    with open(replaying, encoding="utf-8") as source:
+        for line in source:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                for field in datetime_fields:
+                    if isinstance(item.get(field), str):
+                        item[field] = datetime.fromisoformat(item[field])
+            except ValueError as e:
+                logger.error(f"Skipping unreadable dead-letter line: {e}")
+                failed.append(line)
+                continue
+            items.append(item)
+
+    written = 0
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        try:
+            flush_func(batch)
+            written += len(batch)
+            continue
+        except Exception as e:
+            logger.warning(f"Dead-letter batch failed, replaying items one by one: {e}")
+        for item in batch:
+            try:
+                flush_func([item])
+                written += 1
+            except Exception as e:
+                logger.error(f"Dead-letter item still fails: {e}")
+                failed.append(_dump_item(item))
+
+    if failed:
+        _write_lines(path, failed)
+    os.remove(replaying)
+    return written, len(failed)
+
+
+if __name__ == "__main__":
+    from .config import settings
+
+    parser = argparse.ArgumentParser(description="写后队列维护")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subparsers.add_parser("replay", help="把死信文件中的记录重新写入数据库")
+    replay_parser.add_argument("queue", choices=["conversions"])
+    replay_parser.add_argument("--file", default=settings.CONVERSION_DEAD_LETTER_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # 写入函数（含会话汇总和时间桶更新）与应用内的转化队列相同
+    from .main import write_conversions
+    written, failed = replay_dead_letter(args.file, write_conversions, settings.INGEST_BATCH_SIZE)
+    logger.info(f"Replayed {written} {args.queue} from {args.file}, {failed} still failing")
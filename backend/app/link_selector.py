@@ -0,0 +1,71 @@
+import bisect
+import itertools
+import random
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+
+class WeightedLinkSelector:
+    """
+    转换链接加权随机选择器。
+    缓存活跃链接的累积权重表，选择时二分查找（O(log n)），不访问数据库；
+    链接变更后调用 invalidate()，下次选择时通过 loader 重新加载；
+    设置 ttl 后到期也会重新加载，用于多进程部署时感知其它进程的变更。
+    """
+
+    def __init__(self, loader: Callable[[], List[Tuple[str, float]]], ttl: Optional[float] = None):
+        """
+        :param loader: 返回活跃链接 [(target_url, weight), ...] 的函数
+        :param ttl: 缓存有效期（秒），None 表示只在 invalidate() 时失效
+        """
+        self._loader = loader
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._table: Optional[Tuple[List[str], List[float]]] = None
+        self._expires_at = 0.0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._table = None
+
+    def is_stale(self) -> bool:
+        return self._table is None or (self._ttl is not None and time.monotonic() >= self._expires_at)
+
+    def refresh(self) -> None:
+        """立即重新加载（可在线程池中调用，避免 choose() 在事件循环里查询数据库）"""
+        with self._lock:
+            self._reload()
+
+    def _reload(self) -> None:
+        self._table = self._build()
+        if self._ttl is not None:
+            self._expires_at = time.monotonic() + self._ttl
+
+    def _build(self) -> Tuple[List[str], List[float]]:
+        # 权重为 0 或负数的链接永远不会被选中，直接排除
+        links = [(url, weight) for url, weight in self._loader() if weight and weight > 0]
+        urls = [url for url, _ in links]
+        cumulative = list(itertools.accumulate(weight for _, weight in links))
+        return urls, cumulative
+
+    def choose(self) -> Optional[str]:
+        """
+        :return: 选中的目标链接，没有可用链接时返回 None
+        """
+        table = self._table
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    self._reload()
+                table = self._table
+
+        urls, cumulative = table
+        if not urls:
+            return None
+        index = bisect.bisect_right(cumulative, random.random() * cumulative[-1])
+        return urls[min(index, len(urls) - 1)]
+
+    def __len__(self) -> int:
+        table = self._table
+        return len(table[0]) if table else 0
@@ -2,25 +2,42 @@ from fastapi import FastAPI, HTTPException, Depends, status, Query, Request, For
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float, Boolean
-from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from datetime import datetime, timedelta
+from sqlalchemy import insert, func
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from contextlib import asynccontextmanager
 from .config import settings
 import jwt
 import json
 import uuid
-from typing import Optional, List
-import random
+from typing import Optional, List, Tuple
 import logging
 import hashlib
 import secrets
 import asyncio
 import os
-import os
+import re
+from collections import Counter
 from .crawler import stock_crawler
+from .database import engine, SessionLocal, run_db, run_sync, pending_db_calls
+from .models import Token, Event, Conversion, ConversionLink, AdminUser, GoogleTrackingSettings, SessionStats, MetricBucket, SessionDevice
+from . import rollup
+from . import event_store
+from .ingest import WriteBehindQueue, QueueFullError
+from .cache import TTLCache
+from .link_selector import WeightedLinkSelector
+from .bootstrap import bootstrap, bootstrap_once, BOOTSTRAPPED_ENV
+from .quote_cache import QuoteCache, quote_ttl
+from . import price_store
+from .refresher import HotCodeRefresher
+from .retention import RetentionJob, ARCHIVE_MODELS, read_archive
+from .export import EXPORT_TABLES, EXPORT_FORMATS, MEDIA_TYPES, stream_export
+from .pagination import Cursor, decode_cursor, fetch_session_page
+from .metrics import registry, GaugeFunc, CounterFunc, MetricsMiddleware, instrument_engine, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 # 配置日志
 logging.basicConfig(
@@ -29,111 +46,149 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 数据库配置
-engine = create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# 数据库模型
-class Token(Base):
-    __tablename__ = "tokens"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    token = Column(String, unique=True, index=True)
-    session_id = Column(String, index=True)
-    expires_at = Column(DateTime)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    gclid = Column(String)
-    utm_source = Column(String)
-
-class Event(Base):
-    __tablename__ = "events"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, index=True)
-    event_type = Column(String)
-    meta = Column(Text)  # JSON 字符串
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class Conversion(Base):
-    __tablename__ = "conversions"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, index=True)
-    input_value = Column(String)
-    target_url = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class ConversionLink(Base):
-    __tablename__ = "conversion_links"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String)
-    target_url = Column(String)
-    weight = Column(Float, default=1.0)
-    is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class AdminUser(Base):
-    __tablename__ = "admin_users"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
-    password_hash = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class GoogleTrackingSettings(Base):
-    __tablename__ = "google_tracking_settings"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    ga4_measurement_id = Column(String, default="")
-    google_ads_conversion_id = Column(String, default="")
-    google_ads_conversion_label = Column(String, default="")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-# 创建表
-Base.metadata.create_all(bind=engine)
-
-# 创建默认管理员账户
-def create_default_admin():
+# 事件/转化批量写入
+def write_events(rows: List[dict]):
     db = SessionLocal()
     try:
-        # 从配置获取管理员账号密码
-        default_username = settings.ADMIN_USERNAME
-        default_password = settings.ADMIN_PASSWORD
-        
-        admin = db.query(AdminUser).filter(AdminUser.username == default_username).first()
-        if not admin:
-            password_hash = hashlib.sha256(default_password.encode()).hexdigest()
-            admin = AdminUser(username=default_username, password_hash=password_hash)
-            db.add(admin)
-            db.commit()
-            logger.info(f"Created default admin user: {default_username}")
-        else:
-            logger.info(f"Admin user already exists: {default_username}")
+        event_store.insert_events(db, rows)
+        rollup.apply_events(db, rows)
+        db.commit()
     finally:
         db.close()
 
-def create_default_google_settings():
+def write_conversions(rows: List[dict]):
     db = SessionLocal()
     try:
-        settings = db.query(GoogleTrackingSettings).first()
-        if not settings:
-            settings = GoogleTrackingSettings()
-            db.add(settings)
-            db.commit()
-            logger.info("Created default Google tracking settings")
+        db.execute(insert(Conversion), rows)
+        rollup.apply_conversions(db, rows)
+        db.commit()
     finally:
         db.close()
 
-create_default_admin()
-create_default_google_settings()
+# 数据库被锁、连接/连接池超时等临时错误整批重试，其它写入错误按坏记录逐条隔离
+TRANSIENT_DB_ERRORS = (OperationalError, PoolTimeoutError)
+
+event_queue = WriteBehindQueue(
+    "events",
+    write_events,
+    max_size=settings.INGEST_QUEUE_MAX_SIZE,
+    batch_size=settings.INGEST_BATCH_SIZE,
+    flush_interval=settings.INGEST_FLUSH_INTERVAL,
+    overflow=settings.INGEST_OVERFLOW_POLICY,
+    transient_errors=TRANSIENT_DB_ERRORS
+)
+
+conversion_queue = WriteBehindQueue(
+    "conversions",
+    write_conversions,
+    max_size=settings.INGEST_QUEUE_MAX_SIZE,
+    batch_size=settings.INGEST_BATCH_SIZE,
+    flush_interval=settings.INGEST_FLUSH_INTERVAL,
+    # 转化记录不能丢：写入失败时退避重试，不丢弃
+    max_retries=None,
+    dead_letter_file=settings.CONVERSION_DEAD_LETTER_FILE,
+    transient_errors=TRANSIENT_DB_ERRORS
+)
+
+write_queues = [event_queue, conversion_queue]
+
+# 转换链接选择器，链接变更时失效
+def load_active_links():
+    db = SessionLocal()
+    try:
+        links = db.query(ConversionLink.target_url, ConversionLink.weight).filter(ConversionLink.is_active == True).all()
+        return [(link.target_url, link.weight) for link in links]
+    finally:
+        db.close()
+
+# 每个 worker 各自缓存，通过 TTL 收敛其它 worker 上的链接变更
+link_selector = WeightedLinkSelector(load_active_links, ttl=settings.LINK_CACHE_TTL)
+
+async def fetch_quote(code: str) -> Optional[dict]:
+    """
+    行情缓存未命中时的获取顺序：本地存储（有效期内，可能由其它 worker 写入）→ 上游爬虫（结果写入存储）。
+    上游失败时返回 None，由缓存计为失败并保留旧数据；本地存储中的旧数据由调用方按需降级读取，不作为新数据缓存
+    """
+    stored = await run_db(price_store.load_quote, code, quote_ttl())
+    if stored:
+        return stored
+    
+    data = await stock_crawler.get_stock_data(code)
+    if data:
+        await save_quotes({code: data})
+        return data
+    return None
+
+async def save_quotes(quotes: dict):
+    try:
+        await run_db(price_store.save_quotes, quotes)
+    except Exception as e:
+        logger.error(f"Failed to save stock prices: {e}")
+
+# 行情缓存（每个 worker 独立）
+quote_cache = QuoteCache(
+    fetch_quote,
+    max_size=settings.QUOTE_CACHE_SIZE,
+    stale_ttl=settings.QUOTE_STALE_TTL
+)
+
+# /api/stock 请求数、超出延迟预算次数和各数据来源的响应数
+stock_metrics = Counter()
+
+def stock_metrics_stats() -> dict:
+    requests = stock_metrics["requests"]
+    return {
+        "requests": requests,
+        "budget_exceeded": stock_metrics["budget_exceeded"],
+        "sources": {key[len("source:"):]: value for key, value in stock_metrics.items() if key.startswith("source:")},
+        "fallback_rate": stock_metrics["source:fallback"] / requests if requests else 0.0
+    }
+
+# 热门代码后台刷新，使 /api/stock 的常用代码始终命中缓存
+hot_code_refresher = HotCodeRefresher(
+    quote_cache,
+    lambda: stock_crawler.client,
+    top_n=settings.STOCK_REFRESH_TOP_N,
+    interval=settings.STOCK_REFRESH_INTERVAL,
+    lead=settings.STOCK_REFRESH_LEAD,
+    concurrency=settings.STOCK_REFRESH_CONCURRENCY,
+    rate_limit=settings.STOCK_REFRESH_RATE_LIMIT,
+    jitter=settings.STOCK_REFRESH_JITTER,
+    half_life=settings.STOCK_REFRESH_HALF_LIFE,
+    max_rows=settings.STOCK_HISTORY_ROWS,
+    on_refresh=save_quotes,
+    lock_file=settings.STOCK_REFRESH_LOCK_FILE
+)
+
+# 过期 token 清理、事件/转化归档
+retention_job = RetentionJob(settings.RETENTION_INTERVAL, settings.RETENTION_LOCK_FILE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(bootstrap_once)
+    for queue in write_queues:
+        await queue.start()
+    await stock_crawler.start()
+    if settings.STOCK_REFRESH_ENABLED:
+        await hot_code_refresher.start()
+    if settings.RETENTION_ENABLED:
+        await retention_job.start()
+    try:
+        yield
+    finally:
+        await retention_job.stop()
+        await hot_code_refresher.stop()
+        await quote_cache.close()
+        await stock_crawler.close()
+        # 关闭前把队列中的事件和转化全部落库
+        for queue in write_queues:
+            await queue.stop()
 
 app = FastAPI(
     title="Landing Page API", 
     version="1.0.0",
-    debug=settings.DEBUG
+    debug=settings.DEBUG,
+    lifespan=lifespan
 )
 
 # CORS 配置
@@ -145,6 +200,11 @@ app.add_middleware(
     allow_headers=settings.CORS_HEADERS,
 )
 
+# 请求指标（最后添加的中间件在最外层，延迟包含 CORS 处理）
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine)
+
 # 模板配置
 templates = Jinja2Templates(directory="app/templates")
 
@@ -157,23 +217,44 @@ def get_db():
         db.close()
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Token 校验缓存：已确认有效的 token 以及已吊销/不存在的 token（每个进程独立，依赖 TTL 收敛）
+known_tokens = TTLCache(max_size=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+revoked_tokens = TTLCache(max_size=settings.TOKEN_CACHE_SIZE, ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    token = credentials.credentials
+def find_token_expiry(db: Session, token: str) -> Optional[datetime]:
+    return db.query(Token.expires_at).filter(Token.token == token).scalar()
+
+async def decode_session_token(token: str) -> str:
     try:
+        # 签名和 exp 由 JWT 本身保证
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        session_id: str = payload.get("session_id")
-        if session_id is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        
-        # 检查 token 是否在数据库中且未过期
-        db_token = db.query(Token).filter(Token.token == token).first()
-        if not db_token or db_token.expires_at < datetime.utcnow():
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
-        
-        return session_id
     except jwt.PyJWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    
+    session_id: str = payload.get("session_id")
+    if session_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    
+    if revoked_tokens.get(token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
+    if settings.TOKEN_VERIFY_MODE != "strict" and known_tokens.get(token) == session_id:
+        return session_id
+    
+    # 缓存未命中或严格模式：检查 token 是否在数据库中且未过期
+    now = datetime.utcnow()
+    expires_at = await run_db(find_token_expiry, token)
+    if not expires_at or expires_at < now:
+        revoked_tokens.set(token, True)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
+    
+    remaining = (expires_at - now).total_seconds()
+    known_tokens.set(token, session_id, ttl=min(settings.TOKEN_CACHE_TTL, remaining))
+    return session_id
+
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await decode_session_token(credentials.credentials)
 
 def verify_admin_session(request: Request):
     admin_token = request.cookies.get("admin_token")
@@ -190,17 +271,35 @@ def verify_admin_session(request: Request):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
 # API 路由
+def create_session_token(db: Session, token: str, session_id: str, expires_at: datetime,
+                         gclid: Optional[str], utm_source: Optional[str]):
+    # 保存到数据库，包含更多信息
+    created_at = datetime.utcnow()
+    db_token = Token(
+        token=token, 
+        session_id=session_id,
+        expires_at=expires_at,
+        created_at=created_at,
+        gclid=gclid,
+        utm_source=utm_source
+    )
+    db.add(db_token)
+    rollup.apply_session(db, session_id, gclid, utm_source, created_at)
+    db.commit()
+
 @app.get("/api/get_token")
 async def get_token(
     request: Request,
     gclid: Optional[str] = Query(None),
-    utm_source: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    utm_source: Optional[str] = Query(None)
 ):
     # 检查是否有必要的参数
     if not gclid and not utm_source:
         raise HTTPException(status_code=403, detail="Access denied: missing required parameters")
     
+    return await issue_session_token(gclid, utm_source)
+
+async def issue_session_token(gclid: Optional[str], utm_source: Optional[str]) -> dict:
     # 生成 session_id 和 token
     session_id = str(uuid.uuid4())
     expires_at = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -211,73 +310,159 @@ async def get_token(
     }
     token = jwt.encode(token_data, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     
-    # 保存到数据库，包含更多信息
-    db_token = Token(
-        token=token, 
-        session_id=session_id,
-        expires_at=expires_at,
-        gclid=gclid,
-        utm_source=utm_source
-    )
-    db.add(db_token)
-    db.commit()
+    await run_db(create_session_token, token, session_id, expires_at, gclid, utm_source)
+    known_tokens.set(token, session_id)
     
     return {"token": token, "session_id": session_id}
 
+def parse_event(event_data: dict) -> Tuple[str, dict]:
+    """
+    校验上报的事件，返回 (event_type, meta)
+    :raises ValueError: event_type 不是不超过 EVENT_TYPE_MAX_LENGTH 的非空字符串，或 meta 不是对象
+    """
+    event_type = event_data.get("event_type", "unknown")
+    if not isinstance(event_type, str) or not event_type or len(event_type) > settings.EVENT_TYPE_MAX_LENGTH:
+        raise ValueError(f"event_type must be a non-empty string of at most {settings.EVENT_TYPE_MAX_LENGTH} characters")
+    meta = event_data.get("meta")
+    if meta is None:
+        meta = {}
+    if not isinstance(meta, dict):
+        raise ValueError("meta must be an object")
+    return event_type, meta
+
+def build_event_row(session_id: str, event_type: str, meta: dict, request: Request, now: datetime) -> dict:
+    # 设备信息按会话单独存储，不再写入每条事件的 meta
+    return event_store.pack_event(
+        session_id,
+        event_type,
+        meta,
+        request.headers.get("user-agent", ""),
+        request.client.host if request.client else None,
+        now
+    )
+
+def record_stock_prefill(event_type: str, meta: dict):
+    # 预填充事件中的股票代码计入热门代码统计
+    if event_type == "stock_prefill" and isinstance(meta.get("stock_code"), str):
+        hot_code_refresher.record(meta["stock_code"])
+
+def event_queue_full():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Event queue is full",
+        headers={"Retry-After": "1"}
+    )
+
 @app.post("/api/track")
 async def track_event(
     event_data: dict,
     request: Request,
-    session_id: str = Depends(verify_token),
-    db: Session = Depends(get_db)
+    session_id: str = Depends(verify_token)
 ):
-    # 获取设备信息
-    user_agent = request.headers.get("user-agent", "")
-    client_ip = request.client.host
-    
-    # 合并设备信息到 meta 中
-    meta = event_data.get("meta", {})
-    meta.update({
-        "user_agent": user_agent,
-        "client_ip": client_ip,
-        "timestamp": datetime.utcnow().isoformat()
-    })
+    try:
+        event_type, meta = parse_event(event_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    row = build_event_row(session_id, event_type, meta, request, datetime.utcnow())
+    record_stock_prefill(event_type, meta)
     
-    event = Event(
-        session_id=session_id,
-        event_type=event_data.get("event_type", "unknown"),
-        meta=json.dumps(meta)
-    )
-    db.add(event)
-    db.commit()
+    # 入队后立即返回，由后台任务批量写入
+    try:
+        event_queue.put(row)
+    except QueueFullError:
+        raise event_queue_full()
     
     return {"status": "success", "message": "Event tracked"}
 
+@app.post("/api/track/batch")
+async def track_events_batch(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """
+    批量上报事件，每批只校验一次 token。
+    请求体为事件数组，或 {"token": ..., "events": [...]}；
+    后者兼容 navigator.sendBeacon（无法设置 Authorization 头，Content-Type 可能为 text/plain）。
+    """
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    
+    body_token = None
+    if isinstance(payload, dict):
+        body_token = payload.get("token")
+        events = payload.get("events")
+    else:
+        events = payload
+    
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail="events must be a list")
+    if len(events) > settings.TRACK_BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Too many events, max {settings.TRACK_BATCH_MAX_EVENTS}")
+    
+    token = credentials.credentials if credentials else body_token
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    session_id = await decode_session_token(token)
+    
+    # 与单条上报相同的校验，不合法的事件跳过，不影响同批其它事件
+    valid = []
+    for event_data in events:
+        if not isinstance(event_data, dict):
+            continue
+        try:
+            valid.append(parse_event(event_data))
+        except ValueError:
+            continue
+    
+    now = datetime.utcnow()
+    rows = [build_event_row(session_id, event_type, meta, request, now) for event_type, meta in valid]
+    
+    try:
+        event_queue.put_many(rows)
+    except QueueFullError:
+        raise event_queue_full()
+    
+    for event_type, meta in valid:
+        record_stock_prefill(event_type, meta)
+    
+    return {"status": "success", "accepted": len(rows), "rejected": len(events) - len(rows)}
+
+def conversion_input(value) -> str:
+    """input_value 存为字符串列：非字符串的值转成 JSON 文本，不因客户端传入的类型拒绝转化"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
 @app.post("/api/convert")
 async def convert(
     convert_data: dict,
-    session_id: str = Depends(verify_token),
-    db: Session = Depends(get_db)
+    session_id: str = Depends(verify_token)
 ):
-    # 获取可用的转换链接
-    conversion_links = db.query(ConversionLink).filter(ConversionLink.is_active == True).all()
-    if not conversion_links:
+    # 基于权重随机选择转换链接，缓存失效时在数据库线程池中重新加载
+    if link_selector.is_stale():
+        await run_sync(link_selector.refresh)
+    target_url = link_selector.choose()
+    if not target_url:
         raise HTTPException(status_code=404, detail="No conversion links available")
     
-    # 基于权重随机选择
-    weights = [link.weight for link in conversion_links]
-    selected_link = random.choices(conversion_links, weights=weights, k=1)[0]
-    
-    # 保存转化记录
-    conversion = Conversion(
-        session_id=session_id,
-        input_value=convert_data.get("input_value", ""),
-        target_url=selected_link.target_url
-    )
-    db.add(conversion)
-    db.commit()
+    # 保存转化记录，入队后立即返回跳转链接
+    row = {
+        "session_id": session_id,
+        "input_value": conversion_input(convert_data.get("input_value")),
+        "target_url": target_url,
+        "created_at": datetime.utcnow()
+    }
+    try:
+        conversion_queue.put(row)
+    except QueueFullError:
+        # 转化记录不能丢，队列满时直接写库
+        await run_sync(write_conversions, [row])
     
-    return {"redirect_url": selected_link.target_url}
+    return {"redirect_url": target_url}
 
 # 管理员登录
 @app.get("/admin/login", response_class=HTMLResponse)
@@ -403,49 +588,110 @@ async def admin_tokens_page(request: Request, username: str = Depends(verify_adm
         })
 
 # 统计分析页面
+ANALYTICS_SORT_COLUMNS = ("session_start", "event_count", "scroll_events", "conversions", "last_activity")
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return None
+
+def query_session_summaries(
+    db: Session,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    sort: str,
+    order: str,
+    page: int,
+    page_size: int
+):
+    """
+    从会话汇总表分页读取，固定两条查询（总数 + 当前页），与事件量无关。
+    :return: (当前页会话列表, 会话总数)
+    """
+    filters = []
+    if start_date:
+        filters.append(SessionStats.session_start >= start_date)
+    if end_date:
+        filters.append(SessionStats.session_start < end_date + timedelta(days=1))
+    
+    columns = {
+        "session_start": SessionStats.session_start,
+        "event_count": SessionStats.event_count,
+        "scroll_events": SessionStats.scroll_count,
+        "conversions": SessionStats.conversion_count,
+        "last_activity": SessionStats.last_activity
+    }
+    sort_column = columns[sort]
+    sort_column = sort_column.asc() if order == "asc" else sort_column.desc()
+    
+    total = db.query(func.count(SessionStats.session_id)).filter(*filters).scalar()
+    rows = (
+        db.query(SessionStats)
+        .filter(*filters)
+        .order_by(sort_column, SessionStats.session_id)
+        .offset((page - 1) * page_size)
+        .limit(page_size)
+        .all()
+    )
+    
+    sessions = [
+        {
+            'session_id': row.session_id,
+            'gclid': row.gclid or '',
+            'utm_source': row.utm_source or '',
+            'session_start': row.session_start,
+            'event_count': row.event_count,
+            'scroll_events': row.scroll_count,
+            'conversions': row.conversion_count,
+            'last_activity': row.last_activity
+        }
+        for row in rows
+    ]
+    return sessions, total
+
 @app.get("/admin/analytics", response_class=HTMLResponse)
-async def admin_analytics_page(request: Request, username: str = Depends(verify_admin_session), db: Session = Depends(get_db)):
+async def admin_analytics_page(
+    request: Request,
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    sort: str = Query("session_start"),
+    order: str = Query("desc"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=200),
+    username: str = Depends(verify_admin_session),
+    db: Session = Depends(get_db)
+):
+    if sort not in ANALYTICS_SORT_COLUMNS:
+        sort = "session_start"
+    if order not in ("asc", "desc"):
+        order = "desc"
+    
     try:
-        # 获取最近的 50 个 tokens
-        tokens = db.query(Token).order_by(Token.created_at.desc()).limit(50).all()
-        
-        sessions = []
-        for token in tokens:
-            try:
-                # 获取该会话的事件数量
-                event_count = db.query(Event).filter(Event.session_id == token.session_id).count()
-                scroll_events = db.query(Event).filter(
-                    Event.session_id == token.session_id,
-                    Event.event_type == 'scroll'
-                ).count()
-                conversions = db.query(Conversion).filter(Conversion.session_id == token.session_id).count()
-                
-                # 获取最后活动时间
-                last_event = db.query(Event).filter(Event.session_id == token.session_id).order_by(Event.created_at.desc()).first()
-                last_activity = last_event.created_at if last_event else None
-                
-                sessions.append({
-                    'session_id': token.session_id,
-                    'gclid': token.gclid or '',
-                    'utm_source': token.utm_source or '',
-                    'session_start': token.created_at,
-                    'event_count': event_count,
-                    'scroll_events': scroll_events,
-                    'conversions': conversions,
-                    'last_activity': last_activity
-                })
-            except Exception as session_error:
-                logger.error(f"Error processing session {token.session_id}: {session_error}")
-                continue
-                
+        sessions, total = query_session_summaries(
+            db, parse_date(start_date), parse_date(end_date), sort, order, page, page_size
+        )
     except Exception as e:
         logger.error(f"Error in analytics page: {e}")
-        sessions = []
+        sessions, total = [], 0
     
     return templates.TemplateResponse("analytics.html", {
         "request": request,
         "username": username,
-        "sessions": sessions
+        "sessions": sessions,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": max(1, (total + page_size - 1) // page_size),
+        "filters": {
+            "start_date": start_date or "",
+            "end_date": end_date or "",
+            "sort": sort,
+            "order": order,
+            "page_size": page_size
+        }
     })
 
 # API 端点用于管理界面
@@ -483,6 +729,7 @@ async def create_admin_link(
     db.add(link)
     db.commit()
     db.refresh(link)
+    link_selector.invalidate()
     
     return {
         "id": link.id,
@@ -509,6 +756,7 @@ async def update_admin_link(
     link.is_active = link_data.get("is_active", link.is_active)
     
     db.commit()
+    link_selector.invalidate()
     return {"status": "success"}
 
 @app.delete("/api/admin/links/{link_id}")
@@ -523,53 +771,123 @@ async def delete_admin_link(
     
     db.delete(link)
     db.commit()
+    link_selector.invalidate()
+    return {"status": "success"}
+
+# 吊销 token
+@app.post("/api/admin/tokens/{token_id}/revoke")
+async def revoke_admin_token(
+    token_id: int,
+    username: str = Depends(verify_admin_session),
+    db: Session = Depends(get_db)
+):
+    token = db.query(Token).filter(Token.id == token_id).first()
+    if not token:
+        raise HTTPException(status_code=404, detail="Token not found")
+    
+    token.expires_at = datetime.utcnow()
+    db.commit()
+    known_tokens.discard(token.token)
+    revoked_tokens.set(token.token, True)
     return {"status": "success"}
 
 # 会话详情 API
+def session_summary(stats: Optional[SessionStats]) -> dict:
+    if not stats:
+        return {}
+    return {
+        "event_count": stats.event_count,
+        "page_visit_count": stats.page_visit_count,
+        "scroll_count": stats.scroll_count,
+        "click_count": stats.click_count,
+        "stock_prefill_count": stats.stock_prefill_count,
+        "conversion_count": stats.conversion_count,
+        "first_activity": stats.first_activity.isoformat() if stats.first_activity else None,
+        "last_activity": stats.last_activity.isoformat() if stats.last_activity else None
+    }
+
+def token_info(token: Optional[Token], stats: Optional[SessionStats]) -> dict:
+    if token:
+        return {
+            "gclid": token.gclid or '',
+            "utm_source": token.utm_source or '',
+            "created_at": token.created_at.isoformat(),
+            "expires_at": token.expires_at.isoformat()
+        }
+    return {
+        "gclid": stats.gclid or '',
+        "utm_source": stats.utm_source or '',
+        "created_at": stats.session_start.isoformat() if stats.session_start else None,
+        "expires_at": None
+    }
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def serialize_events(db: Session, events: List[Event], device: Optional[SessionDevice], decode_meta: bool) -> List[dict]:
+    # meta 按需解码：默认只返回类型化字段，decode_meta=true 时还原旧格式的完整 meta
+    type_names = event_store.event_type_names(db, (event.event_code for event in events))
+    items = []
+    for event in events:
+        item = {
+            "id": event.id,
+            "event_type": type_names[event.event_code],
+            "scroll_y": event.scroll_y,
+            "element": event.element,
+            "created_at": event.created_at.isoformat()
+        }
+        if decode_meta:
+            item["meta"] = event_store.event_meta(event, device)
+        items.append(item)
+    return items
+
+def serialize_conversions(conversions: List[Conversion]) -> List[dict]:
+    return [
+        {
+            "id": conv.id,
+            "input_value": conv.input_value,
+            "target_url": conv.target_url,
+            "created_at": conv.created_at.isoformat()
+        }
+        for conv in conversions
+    ]
+
 @app.get("/api/admin/sessions/{session_id}")
 async def get_session_details(
     session_id: str,
+    limit: int = Query(200, ge=1, le=1000, description="事件/转化的首页条数"),
+    decode_meta: bool = Query(False, description="是否解码并返回完整 meta"),
     username: str = Depends(verify_admin_session),
     db: Session = Depends(get_db)
 ):
+    """会话信息及事件、转化的第一页，后续页通过 events / conversions 接口按游标读取"""
     try:
-        # 获取 token 信息
+        # 获取 token 信息；token 被保留任务删除后改用会话汇总中的来源信息
         token = db.query(Token).filter(Token.session_id == session_id).first()
-        if not token:
-            raise HTTPException(status_code=404, detail="Session not found")
         
-        # 获取事件
-        events = db.query(Event).filter(Event.session_id == session_id).order_by(Event.created_at).all()
+        # 会话汇总、设备信息（主键查询）
+        stats = db.query(SessionStats).filter(SessionStats.session_id == session_id).first()
+        if not token and not stats:
+            raise HTTPException(status_code=404, detail="Session not found")
+        device = db.query(SessionDevice).filter(SessionDevice.session_id == session_id).first()
         
-        # 获取转化
-        conversions = db.query(Conversion).filter(Conversion.session_id == session_id).all()
+        events, events_cursor = fetch_session_page(db, Event, session_id, None, limit)
+        conversions, conversions_cursor = fetch_session_page(db, Conversion, session_id, None, limit)
         
         return {
             "session_id": session_id,
-            "token_info": {
-                "gclid": token.gclid or '',
-                "utm_source": token.utm_source or '',
-                "created_at": token.created_at.isoformat(),
-                "expires_at": token.expires_at.isoformat()
-            },
-            "events": [
-                {
-                    "id": event.id,
-                    "event_type": event.event_type,
-                    "meta": json.loads(event.meta) if event.meta else {},
-                    "created_at": event.created_at.isoformat()
-                }
-                for event in events
-            ],
-            "conversions": [
-                {
-                    "id": conv.id,
-                    "input_value": conv.input_value,
-                    "target_url": conv.target_url,
-                    "created_at": conv.created_at.isoformat()
-                }
-                for conv in conversions
-            ]
+            "token_info": token_info(token, stats),
+            "summary": session_summary(stats),
+            "device": {"user_agent": device.user_agent, "client_ip": device.client_ip} if device else None,
+            "events": serialize_events(db, events, device, decode_meta),
+            "events_next_cursor": events_cursor,
+            "conversions": serialize_conversions(conversions),
+            "conversions_next_cursor": conversions_cursor
         }
     except HTTPException:
         raise
@@ -577,6 +895,236 @@ async def get_session_details(
         logger.error(f"Error getting session details for {session_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/admin/sessions/{session_id}/events")
+async def get_session_events(
+    session_id: str,
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(200, ge=1, le=1000),
+    decode_meta: bool = Query(False, description="是否解码并返回完整 meta"),
+    username: str = Depends(verify_admin_session),
+    db: Session = Depends(get_db)
+):
+    events, next_cursor = fetch_session_page(db, Event, session_id, parse_cursor(cursor), limit)
+    device = None
+    if decode_meta:
+        device = db.query(SessionDevice).filter(SessionDevice.session_id == session_id).first()
+    return {"items": serialize_events(db, events, device, decode_meta), "next_cursor": next_cursor}
+
+@app.get("/api/admin/sessions/{session_id}/conversions")
+async def get_session_conversions(
+    session_id: str,
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(200, ge=1, le=1000),
+    username: str = Depends(verify_admin_session),
+    db: Session = Depends(get_db)
+):
+    conversions, next_cursor = fetch_session_page(db, Conversion, session_id, parse_cursor(cursor), limit)
+    return {"items": serialize_conversions(conversions), "next_cursor": next_cursor}
+
+# 时间序列指标 API（从预聚合时间桶读取）
+METRICS_GROUP_COLUMNS = {
+    "dimension": MetricBucket.dimension,
+    "utm_source": MetricBucket.utm_source,
+    "has_gclid": MetricBucket.has_gclid
+}
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        # Python 3.11 之前的 fromisoformat 不接受 "Z" 后缀
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid datetime: {value}")
+    # 时间桶以 naive UTC 存储，带时区的输入统一换算为 naive UTC
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+@app.get("/api/admin/metrics")
+async def get_admin_metrics(
+    metric: str = Query("sessions"),
+    granularity: str = Query("auto"),
+    start: Optional[str] = Query(None, description="开始时间（UTC，ISO 格式），默认 7 天前"),
+    end: Optional[str] = Query(None, description="结束时间（UTC，ISO 格式，不含），默认当前时间"),
+    group_by: Optional[str] = Query(None, description="dimension / utm_source / has_gclid"),
+    username: str = Depends(verify_admin_session),
+    db: Session = Depends(get_db)
+):
+    if metric not in rollup.METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(rollup.METRICS)}")
+    if group_by and group_by not in METRICS_GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(METRICS_GROUP_COLUMNS)}")
+    
+    end_at = parse_datetime(end) or datetime.utcnow()
+    start_at = parse_datetime(start) or end_at - timedelta(days=7)
+    if granularity == "auto":
+        granularity = "hour" if end_at - start_at <= timedelta(days=3) else "day"
+    if granularity not in rollup.BUCKET_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be hour, day or auto")
+    
+    columns = [MetricBucket.bucket_start]
+    if group_by:
+        columns.append(METRICS_GROUP_COLUMNS[group_by].label("group"))
+    rows = (
+        db.query(*columns, func.sum(MetricBucket.count).label("count"))
+        .filter(
+            MetricBucket.granularity == granularity,
+            MetricBucket.metric == metric,
+            MetricBucket.bucket_start >= rollup.bucket_start(start_at, granularity),
+            MetricBucket.bucket_start < end_at
+        )
+        .group_by(*columns)
+        .order_by(MetricBucket.bucket_start)
+        .all()
+    )
+    
+    return {
+        "metric": metric,
+        "granularity": granularity,
+        "start": start_at.isoformat(),
+        "end": end_at.isoformat(),
+        "group_by": group_by,
+        "series": [
+            {
+                "bucket": row.bucket_start.isoformat(),
+                **({"group": row.group} if group_by else {}),
+                "count": row.count
+            }
+            for row in rows
+        ]
+    }
+
+# 事件/转化写入队列指标
+@app.get("/api/admin/ingest/stats")
+async def get_ingest_stats(username: str = Depends(verify_admin_session)):
+    return {queue.name: queue.stats() for queue in write_queues}
+
+# 爬虫连接池指标
+@app.get("/api/admin/crawler/stats")
+async def get_crawler_stats(username: str = Depends(verify_admin_session)):
+    return {
+        **stock_crawler.pool_stats(),
+        "quote_cache": quote_cache.stats(),
+        "refresher": hot_code_refresher.stats(),
+        "stock_api": stock_metrics_stats()
+    }
+
+# 数据保留任务指标
+@app.get("/api/admin/retention/stats")
+async def get_retention_stats(username: str = Depends(verify_admin_session)):
+    return retention_job.stats()
+
+# Prometheus 指标：队列、缓存等内部状态在抓取时读取，与上面各 stats 接口同源
+def _queue_values(key: str) -> dict:
+    return {(queue.name,): queue.stats()[key] for queue in write_queues}
+
+def _cache_values(key: str) -> dict:
+    caches = {"known_tokens": known_tokens, "revoked_tokens": revoked_tokens, "tracking_settings": tracking_settings_cache}
+    values = {(name,): cache.stats()[key] for name, cache in caches.items()}
+    values[("quote",)] = quote_cache.stats()[key]
+    return values
+
+BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+for name, doc, key in (
+    ("ingest_queue_depth", "Items waiting in the write-behind queue", "depth"),
+    ("ingest_queue_max_size", "Write-behind queue capacity", "max_size"),
+):
+    registry.register(GaugeFunc(name, doc, lambda key=key: _queue_values(key), ("queue",)))
+for name, doc, key in (
+    ("ingest_queue_enqueued_total", "Items accepted by the write-behind queue", "enqueued"),
+    ("ingest_queue_rejected_total", "Items rejected because the queue was full", "rejected"),
+    ("ingest_queue_dropped_total", "Items dropped after repeated flush failures or rejected by the database", "dropped"),
+    ("ingest_queue_flushed_total", "Items written to the database", "flushed"),
+    ("ingest_queue_flush_errors_total", "Failed batch flushes", "flush_errors"),
+    ("ingest_queue_dead_lettered_total", "Items written to the dead-letter file", "dead_lettered"),
+):
+    registry.register(CounterFunc(name, doc, lambda key=key: _queue_values(key), ("queue",)))
+registry.register(GaugeFunc("cache_entries", "Entries held by in-process caches", lambda: _cache_values("size"), ("cache",)))
+registry.register(CounterFunc("cache_hits_total", "In-process cache hits", lambda: _cache_values("hits"), ("cache",)))
+registry.register(CounterFunc("cache_misses_total", "In-process cache misses", lambda: _cache_values("misses"), ("cache",)))
+registry.register(GaugeFunc("link_selector_links", "Active conversion links held by the selector", lambda: len(link_selector)))
+registry.register(GaugeFunc("quote_cache_in_flight", "Quote fetches in progress", lambda: quote_cache.stats()["in_flight"]))
+registry.register(GaugeFunc("stock_refresher_tracked_codes", "Stock codes tracked by the hot code refresher",
+                            lambda: hot_code_refresher.stats()["tracked"]))
+registry.register(GaugeFunc("crawler_in_flight", "Stock crawler requests in progress", lambda: stock_crawler.in_flight))
+registry.register(GaugeFunc("crawler_breaker_state", "Upstream circuit breaker state (0 closed, 1 half_open, 2 open)",
+                            lambda: BREAKER_STATE_VALUES.get(stock_crawler.pool_stats()["breaker"]["state"])))
+registry.register(GaugeFunc("db_executor_queue_depth", "Database calls waiting for a db thread",
+                            pending_db_calls))
+registry.register(GaugeFunc("db_pool_checked_out", "Database connections currently checked out",
+                            lambda: engine.pool.checkedout() if hasattr(engine.pool, "checkedout") else None))
+registry.register(CounterFunc("retention_runs_total", "Completed retention job runs", lambda: retention_job.stats()["runs"]))
+registry.register(CounterFunc("retention_errors_total", "Failed retention job runs", lambda: retention_job.stats()["errors"]))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if settings.METRICS_TOKEN and (
+        credentials is None or not secrets.compare_digest(credentials.credentials, settings.METRICS_TOKEN)
+    ):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+# 查询已归档的事件/转化
+@app.get("/api/admin/archive/{table}")
+async def get_archived_rows(
+    table: str,
+    start_date: str = Query(..., description="开始日期 YYYY-MM-DD"),
+    end_date: str = Query(..., description="结束日期 YYYY-MM-DD"),
+    session_id: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    username: str = Depends(verify_admin_session)
+):
+    if table not in ARCHIVE_MODELS:
+        raise HTTPException(status_code=404, detail="Unknown archive table")
+    start, end = parse_date(start_date), parse_date(end_date)
+    if start is None or end is None:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+
+    def read_rows():
+        rows = []
+        for row in read_archive(table, start.date(), end.date(), session_id=session_id):
+            rows.append(row)
+            if len(rows) >= limit:
+                break
+        return rows
+
+    rows = await asyncio.to_thread(read_rows)
+    return {"table": table, "count": len(rows), "rows": rows}
+
+# 流式导出会话/事件/转化
+@app.get("/api/admin/export/{table}")
+async def export_table(
+    table: str,
+    format: str = Query("csv", description="csv 或 ndjson"),
+    start_date: Optional[str] = Query(None, description="开始日期 YYYY-MM-DD"),
+    end_date: Optional[str] = Query(None, description="结束日期 YYYY-MM-DD（包含当天）"),
+    utm_source: Optional[str] = None,
+    gzip: bool = Query(False, description="以 gzip 压缩文件下载"),
+    username: str = Depends(verify_admin_session)
+):
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail="Unknown export table")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    start, end = parse_date(start_date), parse_date(end_date)
+    if (start_date and start is None) or (end_date and end is None):
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    
+    filename = f"{table}-{datetime.utcnow():%Y%m%d%H%M%S}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        stream_export(table, format, gzip, start, end, utm_source, settings.EXPORT_YIELD_PER, settings.EXPORT_CHUNK_BYTES),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            # 不经 nginx 缓冲，边读边发
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 # Google 跟踪设置 API
 @app.get("/api/admin/settings/google-tracking")
 async def get_google_tracking_settings(username: str = Depends(verify_admin_session), db: Session = Depends(get_db)):
@@ -615,35 +1163,110 @@ async def update_google_tracking_settings(
         settings.updated_at = datetime.utcnow()
         
         db.commit()
+        tracking_settings_cache.clear()
         return {"status": "success", "message": "Google tracking settings updated"}
     except Exception as e:
         logger.error(f"Error updating Google tracking settings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# 公开的 Google 跟踪设置 API（供前端使用）
+# Google 跟踪设置进程内缓存，更新时清除；多 worker 时其它 worker 通过 TTL 收敛
+tracking_settings_cache = TTLCache(max_size=1, ttl=settings.GOOGLE_SETTINGS_CACHE_TTL)
+EMPTY_TRACKING_SETTINGS = {
+    "ga4_measurement_id": "",
+    "google_ads_conversion_id": "",
+    "google_ads_conversion_label": ""
+}
+
+def load_tracking_settings(db: Session) -> dict:
+    """返回 {"settings": 公开字段, "updated_at": 最后修改时间}"""
+    row = db.query(GoogleTrackingSettings).first()
+    if not row:
+        return {"settings": dict(EMPTY_TRACKING_SETTINGS), "updated_at": None}
+    return {
+        "settings": {
+            "ga4_measurement_id": row.ga4_measurement_id or "",
+            "google_ads_conversion_id": row.google_ads_conversion_id or "",
+            "google_ads_conversion_label": row.google_ads_conversion_label or ""
+        },
+        "updated_at": row.updated_at or row.created_at
+    }
+
+async def get_tracking_settings() -> dict:
+    cached = tracking_settings_cache.get("google")
+    if cached is None:
+        cached = await run_db(load_tracking_settings)
+        settings_json = json.dumps(cached["settings"], sort_keys=True)
+        cached["etag"] = '"' + hashlib.sha256(f"{cached['updated_at']}|{settings_json}".encode()).hexdigest()[:32] + '"'
+        tracking_settings_cache.set("google", cached)
+    return cached
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    # If-None-Match 优先于 If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+# 公开的 Google 跟踪设置 API（供前端使用），支持 ETag / Last-Modified 条件请求
 @app.get("/api/google-tracking-settings")
-async def get_public_google_tracking_settings(db: Session = Depends(get_db)):
+async def get_public_google_tracking_settings(request: Request):
     try:
-        settings = db.query(GoogleTrackingSettings).first()
-        if not settings:
-            return {
-                "ga4_measurement_id": "",
-                "google_ads_conversion_id": "",
-                "google_ads_conversion_label": ""
-            }
-        
-        return {
-            "ga4_measurement_id": settings.ga4_measurement_id or "",
-            "google_ads_conversion_id": settings.google_ads_conversion_id or "",
-            "google_ads_conversion_label": settings.google_ads_conversion_label or ""
-        }
+        cached = await get_tracking_settings()
     except Exception as e:
         logger.error(f"Error getting public Google tracking settings: {e}")
-        return {
-            "ga4_measurement_id": "",
-            "google_ads_conversion_id": "",
-            "google_ads_conversion_label": ""
-        }
+        return EMPTY_TRACKING_SETTINGS
+    
+    last_modified = cached["updated_at"].replace(tzinfo=timezone.utc) if cached["updated_at"] else None
+    headers = {
+        "ETag": cached["etag"],
+        "Cache-Control": f"public, max-age={settings.GOOGLE_SETTINGS_MAX_AGE}"
+    }
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    
+    if not_modified(request, cached["etag"], last_modified):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(cached["settings"], headers=headers)
+
+def format_stock_data(code: str, crawler_data: Optional[dict]) -> Optional[dict]:
+    """
+    把爬虫/存储格式的行情转换为接口返回格式，取最新一行
+    :return: 格式化后的数据，没有数据时返回 None；数据不完整时抛出 ValueError
+    """
+    if not crawler_data or crawler_data.get("code") != 200:
+        return None
+    stock_info = crawler_data["data"]
+    company_name = stock_info.get("companyName", "N/A")
+    symbol = stock_info.get("symbol", code)
+    
+    # 解析股票数据数组
+    if not stock_info.get("data"):
+        return None
+    stock_data = stock_info["data"][0]  # 取第一条数据
+    
+    # 解析数据格式: [日期, 开盘, 最高, 最低, 收盘, 涨跌, 涨跌幅, 成交量]
+    if len(stock_data) < 8:
+        raise ValueError("Stock data incomplete")
+    date = stock_data[0]
+    return {
+        "companyName": company_name,
+        "symbol": symbol,
+        "date": date,
+        "open": stock_data[1].replace(",", ""),
+        "high": stock_data[2].replace(",", ""),
+        "low": stock_data[3].replace(",", ""),
+        "close": stock_data[4].replace(",", ""),
+        "change": stock_data[5],
+        "changePercent": stock_data[6],
+        "volume": stock_data[7].replace(",", ""),
+        "timestamp": f"{date} {datetime.now().strftime('%H:%M')}"
+    }
 
 # 股票数据API
 @app.get("/api/stock")
@@ -651,53 +1274,30 @@ async def get_stock_data(code: str = Query(..., description="股票代码")):
     """
     获取股票数据，调用爬虫脚本
     """
+    stock_metrics["requests"] += 1
     try:
-        # 调用爬虫获取股票数据
-        crawler_data = await stock_crawler.get_stock_data(code)
+        # 优先从行情缓存获取，未命中时调用爬虫；热门代码由后台提前刷新
+        hot_code_refresher.record(code)
+        try:
+            crawler_data = await asyncio.wait_for(quote_cache.get(code), settings.STOCK_LATENCY_BUDGET or None)
+        except asyncio.TimeoutError:
+            # 超出延迟预算：上游请求在后台继续并写入缓存，本次返回最近一次成功的数据
+            stock_metrics["budget_exceeded"] += 1
+            crawler_data = quote_cache.peek(code)
+        if crawler_data is None:
+            # 缓存中没有可用数据（上游失败）：返回本地存储中最近一次成功的数据
+            crawler_data = await run_db(price_store.load_quote, code)
         
-        if crawler_data and crawler_data.get("code") == 200:
-            stock_info = crawler_data["data"]
-            company_name = stock_info.get("companyName", "N/A")
-            symbol = stock_info.get("symbol", code)
-            
-            # 解析股票数据数组
-            if stock_info.get("data") and len(stock_info["data"]) > 0:
-                stock_data = stock_info["data"][0]  # 取第一条数据
-                
-                # 解析数据格式: [日期, 开盘, 最高, 最低, 收盘, 涨跌, 涨跌幅, 成交量]
-                if len(stock_data) >= 8:
-                    date = stock_data[0]
-                    open_price = stock_data[1].replace(",", "")
-                    high_price = stock_data[2].replace(",", "")
-                    low_price = stock_data[3].replace(",", "")
-                    close_price = stock_data[4].replace(",", "")
-                    change = stock_data[5]
-                    change_percent = stock_data[6]
-                    volume = stock_data[7].replace(",", "")
-                else:
-                    # 数据不完整，使用默认值
-                    raise ValueError("Stock data incomplete")
-                
-                formatted_data = {
-                    "companyName": company_name,
-                    "symbol": symbol,
-                    "date": date,
-                    "open": open_price,
-                    "high": high_price,
-                    "low": low_price,
-                    "close": close_price,
-                    "change": change,
-                    "changePercent": change_percent,
-                    "volume": volume,
-                    "timestamp": f"{date} {datetime.now().strftime('%H:%M')}"
-                }
-                
-                logger.info(f"Successfully fetched stock data for {code}")
-                return {
-                    "success": True,
-                    "data": formatted_data,
-                    "source": "kabutan_crawler"
-                }
+        formatted_data = format_stock_data(code, crawler_data)
+        if formatted_data:
+            source = crawler_data.get("source", "kabutan_crawler")
+            stock_metrics[f"source:{source}"] += 1
+            logger.info(f"Successfully fetched stock data for {code}")
+            return {
+                "success": True,
+                "data": formatted_data,
+                "source": source
+            }
         
         logger.warning(f"No valid data from crawler for stock {code}, using fallback")
         
@@ -705,6 +1305,7 @@ async def get_stock_data(code: str = Query(..., description="股票代码")):
         logger.error(f"Error getting stock data for {code}: {e}")
     
     # 降级到默认数据（当爬虫失败时）
+    stock_metrics["source:fallback"] += 1
     logger.info(f"Using fallback data for stock {code}")
     default_data = {
         "companyName": f"株式会社{code}",
@@ -727,12 +1328,233 @@ async def get_stock_data(code: str = Query(..., description="股票代码")):
         "fallback": True
     }
 
+# 股票历史行情（本地存储）
+@app.get("/api/stock/history")
+async def get_stock_history(
+    code: str = Query(..., description="股票代码"),
+    start_date: Optional[str] = Query(None, description="开始日期 YYYY-MM-DD"),
+    end_date: Optional[str] = Query(None, description="结束日期 YYYY-MM-DD"),
+    limit: int = Query(250, ge=1, le=2000)
+):
+    start, end = parse_date(start_date), parse_date(end_date)
+    if (start_date and start is None) or (end_date and end is None):
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    
+    history = await run_db(
+        price_store.price_history,
+        code,
+        start.date() if start else None,
+        end.date() if end else None,
+        limit
+    )
+    return {"success": True, "code": code, "data": history}
+
+STOCK_CODE_PATTERN = re.compile(r"^[0-9A-Za-z]{1,10}$")
+
+# 批量查询超出延迟预算后仍在后台执行的上游请求
+batch_fetches = set()
+
+def parse_stock_codes(raw: str) -> List[str]:
+    # 逗号或空白分隔，去重并保持顺序
+    codes = list(dict.fromkeys(code for code in re.split(r"[,\s]+", raw) if code))
+    if not codes:
+        raise HTTPException(status_code=400, detail="codes is required")
+    if len(codes) > settings.STOCK_BATCH_MAX_CODES:
+        raise HTTPException(status_code=413, detail=f"Too many codes, max {settings.STOCK_BATCH_MAX_CODES}")
+    return codes
+
+async def fetch_and_cache_quotes(codes: List[str]) -> dict:
+    """
+    限制并发获取多个代码。每个代码通过行情缓存的单飞请求获取（与 /api/stock、其它批量请求共用，
+    同一代码同时最多一个上游请求），成功的结果由 fetch_quote 写入行情缓存和本地存储
+    :return: {code: data}，只包含获取到最新数据的代码
+    """
+    semaphore = asyncio.Semaphore(settings.STOCK_BATCH_CONCURRENCY) if settings.STOCK_BATCH_CONCURRENCY else None
+    
+    async def fetch(code: str) -> Optional[dict]:
+        # shield：批量请求被取消时不影响其它等待同一次上游请求的调用方
+        if semaphore is None:
+            return await asyncio.shield(quote_cache.refresh(code))
+        async with semaphore:
+            return await asyncio.shield(quote_cache.refresh(code))
+    
+    results = await asyncio.gather(*[fetch(code) for code in codes])
+    # 获取失败时缓存返回的是旧数据（已过期），不算作本次获取到的数据
+    return {
+        code: data
+        for code, data in zip(codes, results)
+        if data is not None and (quote_cache.expires_in(code) or 0) > 0
+    }
+
+async def resolve_stock_batch(codes: List[str]) -> dict:
+    """
+    批量查询：行情缓存 → 本地存储 → 上游（在延迟预算内），返回每个代码的状态：
+    ok（最新数据）、stale（上游未及时返回或失败时的旧数据）、pending（仍在获取）、
+    error（获取失败且无旧数据）、not_found（页面无行情）、invalid（代码格式错误）
+    """
+    quotes = {}
+    stale = {}
+    statuses = {}
+    misses = []
+    for code in codes:
+        if not STOCK_CODE_PATTERN.match(code):
+            statuses[code] = "invalid"
+            continue
+        hot_code_refresher.record(code)
+        data = quote_cache.peek(code)
+        if data is not None and quote_cache.expires_in(code) > 0:
+            quotes[code] = data
+        else:
+            if data is not None:
+                stale[code] = data
+            misses.append(code)
+    
+    if misses:
+        stored = await run_db(price_store.load_quotes, misses, quote_ttl())
+        for code, data in stored.items():
+            quote_cache.put(code, data)
+        quotes.update(stored)
+        misses = [code for code in misses if code not in stored]
+    
+    if misses:
+        task = asyncio.create_task(fetch_and_cache_quotes(misses))
+        batch_fetches.add(task)
+        task.add_done_callback(batch_fetches.discard)
+        done, _ = await asyncio.wait({task}, timeout=settings.STOCK_LATENCY_BUDGET or None)
+        if task in done and task.exception() is None:
+            quotes.update(task.result())
+        elif task in done:
+            logger.error(f"Batch stock fetch failed: {task.exception()}")
+        
+        unresolved = [code for code in misses if code not in quotes]
+        missing_stale = [code for code in unresolved if code not in stale]
+        if missing_stale:
+            stale.update(await run_db(price_store.load_quotes, missing_stale))
+        for code in unresolved:
+            if code in stale:
+                quotes[code] = stale[code]
+                statuses[code] = "stale"
+            else:
+                statuses[code] = "error" if task.done() else "pending"
+    
+    results = []
+    for code in codes:
+        item = {"code": code, "status": statuses.get(code, "ok"), "source": None, "data": None}
+        data = quotes.get(code)
+        if data is not None:
+            try:
+                item["data"] = format_stock_data(code, data)
+            except ValueError:
+                item["data"] = None
+            if item["data"] is None:
+                item["status"] = "not_found"
+            else:
+                item["source"] = data.get("source", "kabutan_crawler")
+        results.append(item)
+    return {"success": True, "results": results}
+
+# 批量股票数据API，供包含多个代码的页面一次获取
+@app.get("/api/stock/batch")
+async def get_stock_batch(codes: str = Query(..., description="股票代码，逗号分隔")):
+    return await resolve_stock_batch(parse_stock_codes(codes))
+
+@app.post("/api/stock/batch")
+async def post_stock_batch(codes: str = Form(..., description="股票代码，逗号或空白分隔")):
+    return await resolve_stock_batch(parse_stock_codes(codes))
+
+async def cached_stock_prefill(code: str) -> Optional[dict]:
+    """
+    只从行情缓存和本地存储读取预填充数据，不等待上游；
+    没有可用数据或数据已过期时在后台刷新，前端随后请求 /api/stock 即可命中缓存
+    """
+    if not STOCK_CODE_PATTERN.match(code):
+        return None
+    hot_code_refresher.record(code)
+    
+    crawler_data = quote_cache.peek(code)
+    remaining = quote_cache.expires_in(code)
+    if remaining is None or remaining <= 0:
+        quote_cache.refresh(code)
+    if crawler_data is None:
+        crawler_data = await run_db(price_store.load_quote, code)
+    
+    try:
+        formatted_data = format_stock_data(code, crawler_data)
+    except ValueError:
+        formatted_data = None
+    if not formatted_data:
+        return None
+    return {
+        "success": True,
+        "data": formatted_data,
+        "source": crawler_data.get("source", "kabutan_crawler")
+    }
+
+# 落地页初始化：一次请求完成签发 token、记录访问、返回跟踪设置和股票预填充数据
+@app.get("/api/bootstrap")
+async def bootstrap_page(
+    request: Request,
+    gclid: Optional[str] = Query(None),
+    utm_source: Optional[str] = Query(None),
+    code: Optional[str] = Query(None, description="预填充的股票代码")
+):
+    if not gclid and not utm_source:
+        raise HTTPException(status_code=403, detail="Access denied: missing required parameters")
+    
+    async def load_tracking_settings_safe():
+        try:
+            return (await get_tracking_settings())["settings"]
+        except Exception as e:
+            logger.error(f"Error getting Google tracking settings for bootstrap: {e}")
+            return EMPTY_TRACKING_SETTINGS
+    
+    async def load_stock_safe():
+        if not code:
+            return None
+        try:
+            return await cached_stock_prefill(code)
+        except Exception as e:
+            logger.error(f"Error getting stock prefill for {code}: {e}")
+            return None
+    
+    # 三项互不依赖，并发执行
+    session, tracking_settings, stock = await asyncio.gather(
+        issue_session_token(gclid, utm_source),
+        load_tracking_settings_safe(),
+        load_stock_safe()
+    )
+    
+    # 服务端记录页面访问，前端不再单独上报 page_visit
+    row = build_event_row(session["session_id"], "page_visit", {"gclid": gclid, "utm_source": utm_source}, request, datetime.utcnow())
+    try:
+        event_queue.put(row)
+    except QueueFullError:
+        logger.warning(f"Event queue full, page_visit dropped for session {session['session_id']}")
+    
+    return {
+        **session,
+        "tracking_settings": tracking_settings,
+        "stock": stock
+    }
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(
-        app, 
-        host=settings.HOST, 
-        port=settings.PORT, 
-        reload=settings.RELOAD,
-        log_level=settings.LOG_LEVEL
-    )
\ No newline at end of file
+    if settings.WORKERS > 1:
+        # 多 worker 模式：派生 worker 前完成一次性初始化
+        bootstrap()
+        os.environ[BOOTSTRAPPED_ENV] = "1"
+        uvicorn.run(
+            "app.main:app",
+            host=settings.HOST,
+            port=settings.PORT,
+            workers=settings.WORKERS,
+            log_level=settings.LOG_LEVEL
+        )
+    else:
+        uvicorn.run(
+            app, 
+            host=settings.HOST, 
+            port=settings.PORT, 
+            reload=settings.RELOAD,
+            log_level=settings.LOG_LEVEL
+        )
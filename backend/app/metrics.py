@@ -0,0 +1,265 @@
+"""
+进程内指标与 Prometheus 文本格式输出（/metrics），不依赖 prometheus_client。
+
+- MetricsMiddleware：按路由模板记录请求数（含状态码）和延迟直方图；
+- instrument_engine：SQLAlchemy 事件钩子，记录每条 SQL 的耗时，并按请求汇总查询数和耗时；
+- 爬虫上游请求的结果和延迟由 crawler.get_price_data 记录；
+- 队列、缓存等内部状态通过 GaugeFunc / CounterFunc 在输出时读取。
+
+指标保存在各 worker 进程内，多 worker 时 /metrics 返回处理该请求的 worker 的数据。
+"""
+import bisect
+import math
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Starlette 对 text/* 自动补充 charset=utf-8
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# 请求延迟（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 单条 SQL 耗时（秒）
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# 每个请求的 SQL 条数
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+Labels = Tuple[str, ...]
+SampleValues = Union[float, Dict[Labels, float]]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values
+        ]
+
+
+class Histogram(_Metric):
+    """分桶计数，输出累计桶、总和与次数"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各桶计数（不累计，最后一个为 +Inf）, 总和, 次数]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (le,))} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class GaugeFunc(_Metric):
+    """输出时调用 func 读取当前值；func 返回数值，或 {标签值元组: 数值}"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], SampleValues],
+                 labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def render(self) -> List[str]:
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values.items()
+            if value is not None
+        ]
+
+
+class CounterFunc(GaugeFunc):
+    """由已有的累计计数（如各组件 stats() 中的计数）提供的计数器"""
+    type_name = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # 同名指标以最后注册的为准，便于重复导入或重新注册回调
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by method, route template and status code", ("method", "route", "status")
+))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route template", ("method", "route")
+))
+http_request_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request", ("route",), QUERY_COUNT_BUCKETS
+))
+http_request_db_duration = registry.register(Histogram(
+    "http_request_db_duration_seconds", "Total SQL time per HTTP request", ("route",)
+))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement latency; source is request or background", ("source",), QUERY_BUCKETS
+))
+crawler_upstream_requests = registry.register(Counter(
+    "crawler_upstream_requests_total", "Stock crawler upstream requests by outcome", ("outcome",)
+))
+crawler_upstream_duration = registry.register(Histogram(
+    "crawler_upstream_duration_seconds", "Stock crawler upstream request latency", ("outcome",)
+))
+
+
+class _RequestDbStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# 当前请求的 SQL 统计；数据库线程池通过复制的上下文共享同一个对象
+_request_db_stats: ContextVar[Optional[_RequestDbStats]] = ContextVar("request_db_stats", default=None)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    注册 SQL 计时钩子，开始时间记在本次执行的 context 上。
+    引擎有事件监听时 SQLAlchemy 会对每条语句做事件分发，固定开销见 benchmarks/metrics.py。
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.metrics_query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "metrics_query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        stats = _request_db_stats.get()
+        if stats is None:
+            db_query_duration.observe(elapsed, ("background",))
+            return
+        db_query_duration.observe(elapsed, ("request",))
+        stats.queries += 1
+        stats.seconds += elapsed
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件（不使用 BaseHTTPMiddleware，避免额外的任务和流包装）。
+    路由取匹配到的路径模板（如 /api/admin/sessions/{session_id}），未匹配的请求记为 unmatched，控制标签数量。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        stats = _RequestDbStats()
+        token = _request_db_stats.set(stats)
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_db_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc((method, route, str(status_code)))
+            http_request_duration.observe(elapsed, (method, route))
+            if stats.queries:
+                http_request_db_queries.observe(stats.queries, (route,))
+                http_request_db_duration.observe(stats.seconds, (route,))
@@ -0,0 +1,149 @@
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, String, Date, DateTime, Text, Float, Boolean, Index, UniqueConstraint
+from datetime import datetime
+from .database import Base
+
+# 数据库模型
+class Token(Base):
+    __tablename__ = "tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    token = Column(String, unique=True, index=True)
+    session_id = Column(String, index=True)
+    expires_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    gclid = Column(String)
+    utm_source = Column(String)
+
+class Event(Base):
+    """事件：类型存为 event_types 中的编号，常用字段单独成列，设备信息按会话存于 session_devices"""
+    __tablename__ = "events"
+    __table_args__ = (
+        # 会话时间线的键集分页；也覆盖只按 session_id 的查询
+        Index("ix_events_session_created", "session_id", "created_at", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String)
+    event_code = Column(SmallInteger)  # event_types.id
+    scroll_y = Column(Integer)
+    element = Column(String)
+    meta = Column(Text)  # 其余字段的 JSON 字符串，没有时为空
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class EventType(Base):
+    """事件类型字典，首次出现时登记"""
+    __tablename__ = "event_types"
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+class SessionDevice(Base):
+    """会话的设备信息，取会话首个事件的 user_agent 和 IP"""
+    __tablename__ = "session_devices"
+    
+    session_id = Column(String, primary_key=True)
+    user_agent = Column(String)
+    client_ip = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Conversion(Base):
+    __tablename__ = "conversions"
+    __table_args__ = (
+        Index("ix_conversions_session_created", "session_id", "created_at", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String)
+    input_value = Column(String)
+    target_url = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ConversionLink(Base):
+    __tablename__ = "conversion_links"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String)
+    target_url = Column(String)
+    weight = Column(Float, default=1.0)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class AdminUser(Base):
+    __tablename__ = "admin_users"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, unique=True, index=True)
+    password_hash = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class GoogleTrackingSettings(Base):
+    __tablename__ = "google_tracking_settings"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    ga4_measurement_id = Column(String, default="")
+    google_ads_conversion_id = Column(String, default="")
+    google_ads_conversion_label = Column(String, default="")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SessionStats(Base):
+    """会话汇总表，随事件/转化写入增量更新"""
+    __tablename__ = "session_stats"
+    
+    session_id = Column(String, primary_key=True)
+    gclid = Column(String)
+    utm_source = Column(String)
+    session_start = Column(DateTime, index=True)
+    event_count = Column(Integer, default=0, nullable=False)
+    page_visit_count = Column(Integer, default=0, nullable=False)
+    scroll_count = Column(Integer, default=0, nullable=False)
+    click_count = Column(Integer, default=0, nullable=False)
+    stock_prefill_count = Column(Integer, default=0, nullable=False)
+    conversion_count = Column(Integer, default=0, nullable=False)
+    first_activity = Column(DateTime)
+    last_activity = Column(DateTime, index=True)
+
+class MetricBucket(Base):
+    """按小时/天预聚合的计数，随数据写入增量更新"""
+    __tablename__ = "metric_buckets"
+    __table_args__ = (
+        UniqueConstraint(
+            "granularity", "metric", "bucket_start", "dimension", "utm_source", "has_gclid",
+            name="uq_metric_buckets_key"
+        ),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String, nullable=False)  # hour / day
+    metric = Column(String, nullable=False)  # sessions / events / conversions
+    bucket_start = Column(DateTime, nullable=False)
+    dimension = Column(String, nullable=False, default="")  # 事件类型 / 转化链接
+    utm_source = Column(String, nullable=False, default="")
+    has_gclid = Column(Boolean, nullable=False, default=False)
+    count = Column(Integer, nullable=False, default=0)
+
+class Stock(Base):
+    """股票基本信息，updated_at 为最近一次从上游获取行情的时间"""
+    __tablename__ = "stocks"
+    
+    code = Column(String, primary_key=True)
+    company_name = Column(String)
+    updated_at = Column(DateTime, nullable=False)
+
+class StockPrice(Base):
+    """爬虫获取的日线行情，每个代码每天一行；(code, trade_date) 唯一索引同时用于区间查询"""
+    __tablename__ = "stock_prices"
+    __table_args__ = (
+        UniqueConstraint("code", "trade_date", name="uq_stock_prices_code_date"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    code = Column(String, nullable=False)
+    trade_date = Column(Date, nullable=False)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    change = Column(Float)
+    change_percent = Column(Float)
+    volume = Column(BigInteger)
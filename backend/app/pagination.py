@@ -0,0 +1,51 @@
+"""
+会话事件/转化的键集分页：按 (session_id, created_at, id) 顺序读取，
+与 events / conversions 上的同名复合索引一致，翻页成本与页码无关。
+
+游标为上一页最后一条记录的 (created_at, id)，编码为 URL 安全的 base64 字符串。
+"""
+import base64
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+Cursor = Tuple[datetime, int]
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(value: str) -> Cursor:
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {value}") from e
+
+
+def session_page_query(model, session_id: str, after: Optional[Cursor], limit: int) -> Select:
+    """会话的一页记录（多取一条用于判断是否还有下一页）"""
+    stmt = select(model).where(model.session_id == session_id)
+    if after is not None:
+        stmt = stmt.where(tuple_(model.created_at, model.id) > tuple_(*after))
+    return stmt.order_by(model.created_at, model.id).limit(limit + 1)
+
+
+def fetch_session_page(db: Session, model, session_id: str, after: Optional[Cursor],
+                       limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    读取会话的一页事件或转化
+    :return: (当前页记录, 下一页游标；没有下一页时为 None)
+    """
+    rows = list(db.scalars(session_page_query(model, session_id, after, limit)))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
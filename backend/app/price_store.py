@@ -0,0 +1,221 @@
+"""
+股价本地存储：把爬虫解析出的日线行情写入 stock_prices 表，
+重启或上游故障时可以直接从数据库返回最近行情，并提供历史区间查询。
+"""
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from .models import Stock, StockPrice
+from .rollup import upsert
+
+logger = logging.getLogger(__name__)
+
+PRICE_COLUMNS = ("open", "high", "low", "close", "change", "change_percent", "volume")
+
+# 页面中表示无数据的符号
+MISSING_VALUES = {"", "-", "－", "―", "N/A"}
+
+
+def _parse_number(text: str) -> Optional[float]:
+    text = text.replace(",", "").replace("+", "").replace("％", "").replace("%", "")
+    if text in MISSING_VALUES:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse_price_row(row: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    把页面行 [日付, 始値, 高値, 安値, 終値, 前日比, 前日比％, 売買高] 转为数值
+    :return: 字段字典，日期无法解析或列数不足时返回 None
+    """
+    if len(row) < 8:
+        return None
+    try:
+        trade_date = datetime.strptime(row[0], "%y/%m/%d").date()
+    except ValueError:
+        return None
+    values = [_parse_number(cell) for cell in row[1:8]]
+    volume = values[6]
+    return {
+        "trade_date": trade_date,
+        **dict(zip(PRICE_COLUMNS[:6], values[:6])),
+        "volume": int(volume) if volume is not None else None,
+    }
+
+
+def _format_number(value: Optional[float], sign: bool = False) -> str:
+    if value is None:
+        return "－"
+    if sign and value == 0:
+        return "0"
+    spec = "+," if sign else ","
+    return f"{value:{spec}.0f}" if float(value).is_integer() else f"{value:{spec}}"
+
+
+def format_price_row(price: StockPrice) -> List[str]:
+    """转回与页面一致的字符串行，供 /api/stock 沿用原有格式化逻辑"""
+    return [
+        price.trade_date.strftime("%y/%m/%d"),
+        _format_number(price.open),
+        _format_number(price.high),
+        _format_number(price.low),
+        _format_number(price.close),
+        _format_number(price.change, sign=True),
+        "0.00" if price.change_percent == 0 else
+        (f"{price.change_percent:+.2f}" if price.change_percent is not None else "－"),
+        _format_number(price.volume),
+    ]
+
+
+def save_quote(db: Session, code: str, data: Dict[str, Any]) -> int:
+    """
+    保存一次爬虫结果并提交：只插入新的交易日，已有交易日只在数值变化时更新（通常只有当天一行）。
+    :param data: get_price_data 的返回值
+    :return: 插入和更新的行数
+    """
+    stock_info = data.get("data") or {}
+    prices = {}
+    for row in stock_info.get("data") or []:
+        price = parse_price_row(row)
+        if price is not None:
+            prices[price["trade_date"]] = price
+
+    now = datetime.utcnow()
+    stmt = upsert(db, Stock)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[Stock.code],
+            set_={"company_name": stmt.excluded.company_name, "updated_at": stmt.excluded.updated_at},
+        ),
+        {"code": code, "company_name": stock_info.get("companyName"), "updated_at": now},
+    )
+
+    written = 0
+    if prices:
+        existing = {
+            price.trade_date: price
+            for price in db.scalars(
+                select(StockPrice).where(StockPrice.code == code, StockPrice.trade_date.in_(list(prices)))
+            )
+        }
+        new_rows = [{"code": code, **price} for trade_date, price in prices.items() if trade_date not in existing]
+        if new_rows:
+            # 多个 worker 可能同时写入同一天，冲突时忽略
+            db.execute(upsert(db, StockPrice).on_conflict_do_nothing(
+                index_elements=[StockPrice.code, StockPrice.trade_date]
+            ), new_rows)
+            written += len(new_rows)
+        for trade_date, row in existing.items():
+            price = prices[trade_date]
+            if any(getattr(row, column) != price[column] for column in PRICE_COLUMNS):
+                for column in PRICE_COLUMNS:
+                    setattr(row, column, price[column])
+                written += 1
+
+    db.commit()
+    return written
+
+
+def save_quotes(db: Session, quotes: Dict[str, Dict[str, Any]]) -> int:
+    return sum(save_quote(db, code, data) for code, data in quotes.items())
+
+
+def load_quote(db: Session, code: str, max_age: Optional[float] = None, rows: int = 1) -> Optional[Dict[str, Any]]:
+    """
+    从本地存储读取最近行情，格式与 get_price_data 一致。
+    :param max_age: 距上次从上游更新的最长时间（秒），超过时返回 None；None 表示不限制
+    :param rows: 返回的最近交易日数量
+    """
+    stock = db.get(Stock, code)
+    if stock is None or not _is_fresh(stock, max_age):
+        return None
+
+    prices = db.scalars(
+        select(StockPrice)
+        .where(StockPrice.code == code)
+        .order_by(StockPrice.trade_date.desc())
+        .limit(rows)
+    ).all()
+    return _build_quote(stock, prices)
+
+
+def load_quotes(db: Session, codes: List[str], max_age: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    批量读取多个代码的最近一个交易日，共两次查询
+    :return: {code: 与 load_quote 相同格式的数据}，没有数据的代码不包含在内
+    """
+    stocks = {
+        stock.code: stock
+        for stock in db.scalars(select(Stock).where(Stock.code.in_(codes)))
+        if _is_fresh(stock, max_age)
+    }
+    if not stocks:
+        return {}
+
+    latest = (
+        select(StockPrice.code, func.max(StockPrice.trade_date).label("trade_date"))
+        .where(StockPrice.code.in_(list(stocks)))
+        .group_by(StockPrice.code)
+        .subquery()
+    )
+    prices = db.scalars(
+        select(StockPrice).join(
+            latest, and_(StockPrice.code == latest.c.code, StockPrice.trade_date == latest.c.trade_date)
+        )
+    )
+    quotes = {}
+    for price in prices:
+        quotes[price.code] = _build_quote(stocks[price.code], [price])
+    return quotes
+
+
+def _is_fresh(stock: Stock, max_age: Optional[float]) -> bool:
+    return max_age is None or stock.updated_at >= datetime.utcnow() - timedelta(seconds=max_age)
+
+
+def _build_quote(stock: Stock, prices: List[StockPrice]) -> Optional[Dict[str, Any]]:
+    if not prices:
+        return None
+    return {
+        "msg": "success",
+        "code": 200,
+        "source": "price_store",
+        "data": {
+            "companyName": stock.company_name or "N/A",
+            "symbol": stock.code,
+            "data": [format_price_row(price) for price in prices],
+        },
+    }
+
+
+def price_history(db: Session, code: str, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                  limit: int = 250) -> List[Dict[str, Any]]:
+    """
+    查询历史行情，按日期升序返回区间内最近的 limit 个交易日
+    """
+    query = select(StockPrice).where(StockPrice.code == code)
+    if start_date:
+        query = query.where(StockPrice.trade_date >= start_date)
+    if end_date:
+        query = query.where(StockPrice.trade_date <= end_date)
+    prices = db.scalars(query.order_by(StockPrice.trade_date.desc()).limit(limit)).all()
+    return [
+        {
+            "date": price.trade_date.isoformat(),
+            "open": price.open,
+            "high": price.high,
+            "low": price.low,
+            "close": price.close,
+            "change": price.change,
+            "changePercent": price.change_percent,
+            "volume": price.volume,
+        }
+        for price in reversed(prices)
+    ]
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, time as dtime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from .cache import TTLCache
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+# 东京证券交易所交易时段（前场、后场），未考虑节假日
+MARKET_SESSIONS = ((dtime(9, 0), dtime(11, 30)), (dtime(12, 30), dtime(15, 30)))
+
+
+def is_market_open(now: Optional[datetime] = None) -> bool:
+    now = now or datetime.now(JST)
+    if now.weekday() >= 5:
+        return False
+    current = now.time()
+    return any(start <= current < end for start, end in MARKET_SESSIONS)
+
+
+def next_market_open(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now(JST)
+    for days in range(8):
+        day = (now + timedelta(days=days)).date()
+        if day.weekday() >= 5:
+            continue
+        for start, _ in MARKET_SESSIONS:
+            candidate = datetime.combine(day, start, tzinfo=JST)
+            if candidate > now:
+                return candidate
+    return now + timedelta(days=1)
+
+
+def quote_ttl(now: Optional[datetime] = None) -> float:
+    """
+    行情缓存有效期：交易时段内较短；休市期间缓存到下次开盘，但不超过 QUOTE_TTL_MARKET_CLOSED。
+    """
+    now = now or datetime.now(JST)
+    if is_market_open(now):
+        return settings.QUOTE_TTL_MARKET_OPEN
+    until_open = (next_market_open(now) - now).total_seconds()
+    return max(settings.QUOTE_TTL_MARKET_OPEN, min(settings.QUOTE_TTL_MARKET_CLOSED, until_open))
+
+
+class QuoteCache:
+    """
+    按股票代码缓存爬虫结果：
+    - 有效期内直接返回；
+    - 过期但仍在 stale_ttl 窗口内时先返回旧数据，同时在后台刷新（stale-while-revalidate）；
+    - 同一代码的并发未命中共享一次上游请求（single-flight）。
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+        max_size: int = 1000,
+        stale_ttl: float = 86400,
+        ttl_func: Callable[[], float] = quote_ttl,
+    ):
+        """
+        :param fetch: 上游获取函数，失败时返回 None
+        :param max_size: 最多缓存的代码数量
+        :param stale_ttl: 过期后仍可作为旧数据返回的时间（秒）
+        :param ttl_func: 返回当前有效期（秒）的函数
+        """
+        self._fetch = fetch
+        self._ttl_func = ttl_func
+        self.stale_ttl = stale_ttl
+        self._entries = TTLCache(max_size=max_size)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+
+    def peek(self, code: str) -> Optional[Dict[str, Any]]:
+        """只读缓存（包括过期的旧数据），不触发上游请求"""
+        entry = self._entries.get(code)
+        return entry[0] if entry else None
+
+    def expires_in(self, code: str) -> Optional[float]:
+        """距离缓存过期的秒数（已过期为负数），未缓存时返回 None"""
+        entry = self._entries.get(code)
+        return entry[1] - time.monotonic() if entry else None
+
+    def is_fetching(self, code: str) -> bool:
+        return code in self._inflight
+
+    def put(self, code: str, data: Dict[str, Any]) -> None:
+        """写入外部获取的数据（如后台批量刷新），按当前有效期缓存"""
+        ttl = self._ttl_func()
+        self._entries.set(code, (data, time.monotonic() + ttl), ttl=ttl + self.stale_ttl)
+
+    async def get(self, code: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(code)
+        if entry is not None:
+            data, fresh_until = entry
+            if time.monotonic() < fresh_until:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                self.refresh(code)
+            return data
+
+        self.misses += 1
+        # shield：单个请求被取消时不影响其它等待同一次上游请求的调用方
+        return await asyncio.shield(self._shared_fetch(code))
+
+    def refresh(self, code: str) -> asyncio.Task:
+        """在后台刷新指定代码（已有进行中的请求时复用）"""
+        task = self._shared_fetch(code)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def _shared_fetch(self, code: str) -> asyncio.Task:
+        task = self._inflight.get(code)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        task = asyncio.create_task(self._fetch_and_store(code))
+        self._inflight[code] = task
+        task.add_done_callback(lambda _: self._inflight.pop(code, None))
+        return task
+
+    async def _fetch_and_store(self, code: str) -> Optional[Dict[str, Any]]:
+        self.fetches += 1
+        try:
+            data = await self._fetch(code)
+        except Exception as e:
+            logger.error(f"Quote fetch failed for {code}: {e}")
+            data = None
+
+        if data is None:
+            # 失败时保留已有旧数据，直到 stale 窗口结束
+            self.fetch_errors += 1
+            return self.peek(code)
+
+        self.put(code, data)
+        return data
+
+    async def close(self) -> None:
+        """取消仍在进行的后台刷新"""
+        tasks = list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self._entries.max_size,
+            "ttl": self._ttl_func(),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "fetches": self.fetches,
+            "fetch_errors": self.fetch_errors,
+            "in_flight": len(self._inflight),
+        }
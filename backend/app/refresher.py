@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from .crawler import get_prices_for_codes
+from .quote_cache import QuoteCache
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 衰减后低于该分数的代码不再统计
+MIN_SCORE = 0.05
+
+
+class HotCodeRefresher:
+    """
+    热门股票代码后台刷新：
+    - record() 统计各代码的访问次数，按半衰期指数衰减，取分数最高的 top_n 个作为热门代码；
+    - 后台任务每隔 interval 秒检查一次，热门代码未缓存或距过期不足 lead 秒时提前刷新；
+    - 刷新通过 get_prices_for_codes 限制并发，按 rate_limit 控制每秒请求数，等待时间加随机抖动；
+    - 多 worker 时通过非阻塞文件锁只由持有锁的一个进程刷新（热门代码按该进程的访问统计），
+      刷新结果写入本地存储，其它 worker 缓存未命中时从存储读取，rate_limit 即为整体的上游请求速率。
+      持有锁的进程退出后，其它进程在下一轮检查时接管。
+    """
+
+    def __init__(
+        self,
+        quote_cache: QuoteCache,
+        client: Callable[[], httpx.AsyncClient],
+        top_n: int = 50,
+        interval: float = 5.0,
+        lead: float = 15.0,
+        concurrency: int = 4,
+        rate_limit: float = 2.0,
+        jitter: float = 0.2,
+        half_life: float = 1800.0,
+        max_tracked: int = 10000,
+        max_rows: Optional[int] = 1,
+        on_refresh: Optional[Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]]] = None,
+        lock_file: Optional[str] = None,
+    ):
+        """
+        :param quote_cache: 刷新结果写入的行情缓存
+        :param client: 返回共享 HTTP 客户端的函数
+        :param top_n: 每轮最多刷新的热门代码数
+        :param interval: 检查间隔（秒）
+        :param lead: 提前刷新时间（秒）
+        :param concurrency: 同时进行的上游请求数上限
+        :param rate_limit: 每秒上游请求数上限
+        :param jitter: 随机抖动比例
+        :param half_life: 访问计数的半衰期（秒）
+        :param max_tracked: 最多统计的代码数量
+        :param max_rows: 每个代码解析的价格行数
+        :param on_refresh: 每批刷新成功后的回调，参数为 {code: data}（如写入本地存储）
+        :param lock_file: 多进程间选出刷新进程的锁文件，None 表示不加锁（每个进程都刷新）
+        """
+        self._quote_cache = quote_cache
+        self._client = client
+        self.top_n = top_n
+        self.interval = interval
+        self.lead = lead
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.jitter = jitter
+        self.half_life = half_life
+        self.max_tracked = max_tracked
+        self.max_rows = max_rows
+        self._on_refresh = on_refresh
+        self.lock_file = lock_file
+        self._lock = None
+        self.leader = False
+        self._scores: Counter = Counter()
+        self._decayed_at = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+        self.cycles = 0
+        self.skipped = 0
+        self.refreshed = 0
+        self.errors = 0
+        self.last_cycle_ms = 0.0
+
+    def record(self, code: str) -> None:
+        if not code:
+            return
+        self._scores[code] += 1
+        if len(self._scores) > self.max_tracked:
+            self._scores = Counter(dict(self._scores.most_common(self.max_tracked // 2)))
+
+    def hot_codes(self) -> List[str]:
+        return [code for code, _ in self._scores.most_common(self.top_n)]
+
+    def _decay(self) -> None:
+        now = time.monotonic()
+        factor = 0.5 ** ((now - self._decayed_at) / self.half_life)
+        self._decayed_at = now
+        self._scores = Counter({code: score * factor for code, score in self._scores.items()
+                                if score * factor >= MIN_SCORE})
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def due_codes(self) -> List[str]:
+        """未缓存或即将过期、且没有正在进行的请求的热门代码"""
+        due = []
+        for code in self.hot_codes():
+            if self._quote_cache.is_fetching(code):
+                continue
+            remaining = self._quote_cache.expires_in(code)
+            if remaining is None or remaining <= self._jittered(self.lead):
+                due.append(code)
+        return due
+
+    async def refresh_due(self) -> int:
+        """
+        刷新一轮到期的热门代码
+        :return: 成功刷新的代码数
+        """
+        loop = asyncio.get_running_loop()
+        due = self.due_codes()
+        refreshed = 0
+        batch_size = max(1, int(self.rate_limit))
+        for start in range(0, len(due), batch_size):
+            batch = due[start:start + batch_size]
+            started = loop.time()
+            results = await get_prices_for_codes(
+                batch, self._client(), concurrency=self.concurrency, max_rows=self.max_rows
+            )
+            succeeded = {}
+            for code, result in zip(batch, results):
+                if result.get("code") == 200:
+                    self._quote_cache.put(code, result)
+                    succeeded[code] = result
+                else:
+                    self.errors += 1
+            refreshed += len(succeeded)
+            if succeeded and self._on_refresh is not None:
+                await self._on_refresh(succeeded)
+
+            # 每批至少间隔 len(batch) / rate_limit 秒
+            delay = len(batch) / self.rate_limit - (loop.time() - started)
+            if start + batch_size < len(due) and delay > 0:
+                await asyncio.sleep(self._jittered(delay))
+
+        self.refreshed += refreshed
+        return refreshed
+
+    def _acquire_lock(self) -> bool:
+        """持有（或取得）刷新锁时返回 True；取得后一直持有到 stop()"""
+        if self.leader:
+            return True
+        if self.lock_file is None or fcntl is None:
+            self.leader = True
+            return True
+        lock_dir = os.path.dirname(self.lock_file)
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        lock = open(self.lock_file, "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self._lock = lock
+        self.leader = True
+        logger.info("Hot code refresher acquired refresh lock")
+        return True
+
+    def _release_lock(self) -> None:
+        self.leader = False
+        if self._lock is not None:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+            self._lock.close()
+            self._lock = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._jittered(self.interval))
+            started = time.perf_counter()
+            try:
+                self._decay()
+                if not self._acquire_lock():
+                    # 其它 worker 正在刷新
+                    self.skipped += 1
+                    continue
+                await self.refresh_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Hot code refresh failed: {e}")
+            self.cycles += 1
+            self.last_cycle_ms = (time.perf_counter() - started) * 1000
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="hot-code-refresher")
+            logger.info("Hot code refresher started")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._release_lock()
+            logger.info("Hot code refresher stopped")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "leader": self.leader,
+            "tracked": len(self._scores),
+            "hot_codes": self.hot_codes()[:10],
+            "cycles": self.cycles,
+            "skipped": self.skipped,
+            "refreshed": self.refreshed,
+            "errors": self.errors,
+            "last_cycle_ms": round(self.last_cycle_ms, 2),
+        }
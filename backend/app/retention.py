@@ -0,0 +1,358 @@
+"""
+数据保留：删除过期 token，把超过保留期的事件/转化归档为按日期分区的 gzip NDJSON 文件，并增量回收 SQLite 空间。
+
+归档文件：{ARCHIVE_DIR}/{表名}/{表名}-YYYY-MM-DD.ndjson.gz，每行一条记录（原表全部列）。
+每批先写文件再在独立的短事务中删除，进程中断时可能重复归档同一批，恢复时按 id 去重。
+会话汇总表和时间桶不随归档变化；归档后再执行 rollup backfill 只会统计在线数据。
+
+定时任务在应用 lifespan 中运行（多 worker 时通过文件锁只由一个进程执行），也可以手动执行：
+    python -m app.retention run
+    python -m app.retention query events --start 2025-01-01 --end 2025-01-31 [--session-id ...]
+    python -m app.retention restore events --start 2025-01-01 --end 2025-01-31
+    python -m app.retention vacuum [--full]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import Date, DateTime, delete, select
+from sqlalchemy.orm import Session
+
+from . import event_store
+from .config import settings
+from .database import Base, SessionLocal, engine
+from .models import Conversion, Event, Token
+from .rollup import upsert
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MODELS = {"events": Event, "conversions": Conversion}
+
+
+def archive_path(archive_dir: str, table: str, day: date) -> Path:
+    return Path(archive_dir) / table / f"{table}-{day.isoformat()}.ndjson.gz"
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _from_json(model, row: Dict[str, Any]) -> Dict[str, Any]:
+    """按列类型还原归档记录，忽略当前表中已不存在的列"""
+    values = {}
+    for column in model.__table__.columns:
+        if column.name not in row:
+            continue
+        value = row[column.name]
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, Date):
+            value = date.fromisoformat(value)
+        values[column.name] = value
+    return values
+
+
+def write_archive(archive_dir: str, table: str, rows: List[Dict[str, Any]]) -> None:
+    """按 created_at 的日期追加写入分区文件（每次追加一个 gzip member），写完后 fsync"""
+    partitions: Dict[date, List[Dict[str, Any]]] = {}
+    for row in rows:
+        partitions.setdefault(row["created_at"].date(), []).append(row)
+
+    for day, items in partitions.items():
+        path = archive_path(archive_dir, table, day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+                for item in items:
+                    line = json.dumps({key: _to_json(value) for key, value in item.items()}, ensure_ascii=False)
+                    archive.write(line.encode("utf-8") + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def archive_table(model, cutoff: datetime, archive_dir: str, chunk_size: int, pause: float) -> int:
+    """
+    把 created_at 早于 cutoff 的记录分批归档并删除
+    :return: 归档的记录数
+    """
+    table = model.__tablename__
+    total = 0
+    while True:
+        # 读取和删除分开：读取不持有写锁，删除是只按 id 进行的短事务
+        db = SessionLocal()
+        try:
+            rows = [
+                dict(row)
+                for row in db.execute(
+                    select(model.__table__).where(model.created_at < cutoff).order_by(model.id).limit(chunk_size)
+                ).mappings()
+            ]
+        finally:
+            db.close()
+        if not rows:
+            break
+
+        write_archive(archive_dir, table, rows)
+        db = SessionLocal()
+        try:
+            db.execute(delete(model).where(model.id.in_([row["id"] for row in rows])))
+            db.commit()
+        finally:
+            db.close()
+
+        total += len(rows)
+        if len(rows) < chunk_size:
+            break
+        time.sleep(pause)
+
+    if total:
+        logger.info(f"Archived {total} rows from {table} older than {cutoff.date()}")
+    return total
+
+
+def prune_tokens(cutoff: datetime, chunk_size: int, pause: float) -> int:
+    """
+    分批删除 expires_at 早于 cutoff 的 token
+    :return: 删除的 token 数
+    """
+    expired = select(Token.id).where(Token.expires_at < cutoff).limit(chunk_size).scalar_subquery()
+    stmt = delete(Token).where(Token.id.in_(expired))
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            deleted = connection.execute(stmt).rowcount
+        total += deleted
+        if deleted < chunk_size:
+            break
+        time.sleep(pause)
+
+    if total:
+        logger.info(f"Deleted {total} tokens expired before {cutoff}")
+    return total
+
+
+def incremental_vacuum(pages: int) -> Optional[Dict[str, int]]:
+    """
+    回收最多 pages 个空闲页，仅 SQLite 且 auto_vacuum=INCREMENTAL 时执行
+    :return: 回收前后的空闲页数，未执行时返回 None
+    """
+    if engine.dialect.name != "sqlite":
+        return None
+    with engine.connect() as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            logger.info("auto_vacuum is not INCREMENTAL, run 'python -m app.retention vacuum --full' once to enable it")
+            return None
+        before = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        # sqlite3 模块的 execute 对不返回列的 PRAGMA 只执行一步（只回收一页），executescript 会执行到底
+        connection.connection.dbapi_connection.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        after = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return {"freelist_before": before, "freelist_after": after}
+
+
+def full_vacuum() -> None:
+    """切换为 auto_vacuum=INCREMENTAL 并整理整个数据库（会锁库，只在维护时执行）"""
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+
+
+def run_retention(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """执行一轮清理和归档，返回各步骤的处理数量"""
+    now = now or datetime.utcnow()
+    chunk_size, pause = settings.RETENTION_CHUNK_SIZE, settings.RETENTION_CHUNK_PAUSE
+    result: Dict[str, Any] = {"tokens_deleted": 0, "events_archived": 0, "conversions_archived": 0}
+
+    result["tokens_deleted"] = prune_tokens(
+        now - timedelta(days=settings.TOKEN_RETENTION_GRACE_DAYS), chunk_size, pause
+    )
+    for table, days in (("events", settings.EVENT_RETENTION_DAYS), ("conversions", settings.CONVERSION_RETENTION_DAYS)):
+        if days > 0:
+            result[f"{table}_archived"] = archive_table(
+                ARCHIVE_MODELS[table], now - timedelta(days=days), settings.ARCHIVE_DIR, chunk_size, pause
+            )
+    result["vacuum"] = incremental_vacuum(settings.VACUUM_PAGES)
+    return result
+
+
+def read_archive(table: str, start_date: date, end_date: date, archive_dir: Optional[str] = None,
+                 session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """按日期顺序读取归档记录（原始 JSON 字段），可按 session_id 过滤"""
+    archive_dir = archive_dir or settings.ARCHIVE_DIR
+    day = start_date
+    while day <= end_date:
+        path = archive_path(archive_dir, table, day)
+        if path.exists():
+            with gzip.open(path, "rt", encoding="utf-8") as archive:
+                for line in archive:
+                    row = json.loads(line)
+                    if session_id is None or row.get("session_id") == session_id:
+                        yield row
+        day += timedelta(days=1)
+
+
+def restore_archive(db: Session, table: str, start_date: date, end_date: date,
+                    archive_dir: Optional[str] = None, chunk_size: int = 1000) -> int:
+    """
+    把归档记录写回在线表并提交（保留原 id，已存在的 id 跳过）。归档文件保持不变。
+    :return: 处理的归档记录数
+    """
+    model = ARCHIVE_MODELS[table]
+    stmt = upsert(db, model).on_conflict_do_nothing(index_elements=[model.id])
+
+    def flush(batch: List[Dict[str, Any]]) -> None:
+        if model is Event:
+            batch = event_store.convert_legacy_events(db, batch)
+        db.execute(stmt, batch)
+        db.commit()
+
+    total = 0
+    batch: List[Dict[str, Any]] = []
+    for row in read_archive(table, start_date, end_date, archive_dir):
+        values = _from_json(model, row)
+        if model is Event and "event_type" in row:
+            # 紧凑存储之前的归档，写入前转换
+            values["event_type"] = row["event_type"]
+        batch.append(values)
+        if len(batch) >= chunk_size:
+            flush(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        total += len(batch)
+    return total
+
+
+class RetentionJob:
+    """
+    定时执行 run_retention。多 worker 时通过非阻塞文件锁保证同一时间只有一个进程执行，
+    其它进程本轮直接跳过。
+    """
+
+    def __init__(self, interval: float, lock_file: str):
+        self.interval = interval
+        self.lock_file = lock_file
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_run: Optional[datetime] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_duration_ms = 0.0
+
+    def run_locked(self) -> Optional[Dict[str, Any]]:
+        """持有文件锁时执行一轮，锁被其它进程占用时返回 None"""
+        if fcntl is None:
+            return run_retention()
+        lock_dir = os.path.dirname(self.lock_file)
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        with open(self.lock_file, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                return run_retention()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    async def run_once(self) -> None:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(self.run_locked)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Retention run failed: {e}")
+            return
+        if result is None:
+            self.skipped += 1
+            return
+        self.runs += 1
+        self.last_run = datetime.utcnow()
+        self.last_result = result
+        self.last_duration_ms = (time.perf_counter() - started) * 1000
+
+    async def _run(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="retention")
+            logger.info("Retention job started")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Retention job stopped")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "interval": self.interval,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_duration_ms": round(self.last_duration_ms, 2),
+            "last_result": self.last_result,
+        }
+
+
+def _parse_day(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据保留与归档")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("run", help="执行一轮清理和归档")
+    for name in ("query", "restore"):
+        sub = subparsers.add_parser(name, help="查询归档（输出 NDJSON）" if name == "query" else "把归档写回在线表")
+        sub.add_argument("table", choices=sorted(ARCHIVE_MODELS))
+        sub.add_argument("--start", type=_parse_day, required=True)
+        sub.add_argument("--end", type=_parse_day, required=True)
+        if name == "query":
+            sub.add_argument("--session-id")
+    vacuum_parser = subparsers.add_parser("vacuum", help="增量回收空闲页")
+    vacuum_parser.add_argument("--full", action="store_true", help="启用 auto_vacuum=INCREMENTAL 并执行完整 VACUUM")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    Base.metadata.create_all(bind=engine)
+    if args.command == "run":
+        logger.info(f"Retention result: {run_retention()}")
+    elif args.command == "query":
+        for row in read_archive(args.table, args.start, args.end, session_id=args.session_id):
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+    elif args.command == "restore":
+        db = SessionLocal()
+        try:
+            count = restore_archive(db, args.table, args.start, args.end)
+            logger.info(f"Restored {count} archived rows into {args.table}")
+        finally:
+            db.close()
+    elif args.command == "vacuum":
+        if args.full:
+            full_vacuum()
+        logger.info(f"Incremental vacuum: {incremental_vacuum(settings.VACUUM_PAGES)}")
@@ -0,0 +1,301 @@
+"""
+会话汇总表（session_stats）与时间桶（metric_buckets）的增量维护与回填。
+
+增量更新与会话/事件/转化写入在同一事务中执行；历史数据用回填命令一次性重建：
+    python -m app.rollup backfill
+"""
+import argparse
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, delete, func, select, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .database import Base, SessionLocal, engine
+from .models import Conversion, Event, EventType, MetricBucket, SessionStats, Token
+
+logger = logging.getLogger(__name__)
+
+# 单独计数的事件类型及其对应列，其它类型只计入 event_count
+EVENT_TYPE_COLUMNS = {
+    "page_visit": "page_visit_count",
+    "scroll": "scroll_count",
+    "click": "click_count",
+    "stock_prefill": "stock_prefill_count",
+}
+
+BUCKET_GRANULARITIES = ("hour", "day")
+METRICS = ("sessions", "events", "conversions")
+
+
+# 支持 INSERT ... ON CONFLICT 的方言；事件/转化写入、token 签发和汇总维护都依赖 upsert
+UPSERT_DIALECTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def check_dialect(dialect: str) -> None:
+    """
+    启动时检查数据库方言，不支持时立即失败，而不是在运行时每次写入都报错
+    :raises RuntimeError: DATABASE_URL 指向不支持的数据库
+    """
+    if dialect not in UPSERT_DIALECTS:
+        raise RuntimeError(
+            f"Unsupported database '{dialect}': DATABASE_URL must point to one of {', '.join(UPSERT_DIALECTS)}"
+        )
+
+
+def upsert(db: Session, model):
+    """返回当前数据库方言的 INSERT ... ON CONFLICT 语句构造器"""
+    dialect = db.get_bind().dialect.name
+    check_dialect(dialect)
+    return UPSERT_DIALECTS[dialect](model)
+
+
+def _earliest(column, value):
+    return case((column.is_(None) | (value < column), value), else_=column)
+
+
+def _latest(column, value):
+    return case((column.is_(None) | (value > column), value), else_=column)
+
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def count_buckets(counts: Counter, metric: str, created_at: datetime, dimension: Optional[str],
+                  utm_source: Optional[str], has_gclid: bool) -> None:
+    for granularity in BUCKET_GRANULARITIES:
+        key = (granularity, metric, bucket_start(created_at, granularity), dimension or "", utm_source or "", bool(has_gclid))
+        counts[key] += 1
+
+
+def apply_bucket_counts(db: Session, counts: Counter) -> None:
+    """把计数累加到时间桶，不提交事务"""
+    if not counts:
+        return
+    stmt = upsert(db, MetricBucket)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            MetricBucket.granularity, MetricBucket.metric, MetricBucket.bucket_start,
+            MetricBucket.dimension, MetricBucket.utm_source, MetricBucket.has_gclid,
+        ],
+        set_={"count": MetricBucket.count + stmt.excluded.count},
+    )
+    db.execute(stmt, [
+        {
+            "granularity": granularity,
+            "metric": metric,
+            "bucket_start": start,
+            "dimension": dimension,
+            "utm_source": utm_source,
+            "has_gclid": has_gclid,
+            "count": count,
+        }
+        for (granularity, metric, start, dimension, utm_source, has_gclid), count in counts.items()
+    ])
+
+
+def session_sources(db: Session, session_ids: Iterable[str]) -> Dict[str, Tuple[Optional[str], bool]]:
+    """批量查询会话来源：session_id -> (utm_source, 是否有 gclid)"""
+    rows = (
+        db.query(SessionStats.session_id, SessionStats.utm_source, SessionStats.gclid)
+        .filter(SessionStats.session_id.in_(set(session_ids)))
+        .all()
+    )
+    return {row.session_id: (row.utm_source, bool(row.gclid)) for row in rows}
+
+
+def apply_session(db: Session, session_id: str, gclid: Optional[str], utm_source: Optional[str],
+                  created_at: datetime) -> None:
+    """登记新会话，不提交事务"""
+    db.add(SessionStats(
+        session_id=session_id,
+        gclid=gclid,
+        utm_source=utm_source,
+        session_start=created_at,
+    ))
+    counts = Counter()
+    count_buckets(counts, "sessions", created_at, None, utm_source, bool(gclid))
+    apply_bucket_counts(db, counts)
+
+
+def apply_events(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    把一批新写入的事件累加到会话汇总表和时间桶，不提交事务。
+    :param rows: 事件记录，需包含 session_id、event_type、created_at
+    """
+    if not rows:
+        return
+    
+    # 先查来源再 upsert，新出现的会话（无 token 记录）按无来源计
+    sources = session_sources(db, (row["session_id"] for row in rows))
+    counts = Counter()
+    stats: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        item = stats.get(row["session_id"])
+        if item is None:
+            item = stats[row["session_id"]] = {
+                "session_id": row["session_id"],
+                "session_start": row["created_at"],
+                "event_count": 0,
+                "conversion_count": 0,
+                "first_activity": row["created_at"],
+                "last_activity": row["created_at"],
+                **{column: 0 for column in EVENT_TYPE_COLUMNS.values()},
+            }
+        item["event_count"] += 1
+        column = EVENT_TYPE_COLUMNS.get(row["event_type"])
+        if column:
+            item[column] += 1
+        item["first_activity"] = min(item["first_activity"], row["created_at"])
+        item["last_activity"] = max(item["last_activity"], row["created_at"])
+        item["session_start"] = item["first_activity"]
+        utm_source, has_gclid = sources.get(row["session_id"], (None, False))
+        count_buckets(counts, "events", row["created_at"], row["event_type"], utm_source, has_gclid)
+
+    stmt = upsert(db, SessionStats)
+    excluded = stmt.excluded
+    counters = ["event_count", *EVENT_TYPE_COLUMNS.values()]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SessionStats.session_id],
+        set_={
+            **{column: getattr(SessionStats, column) + getattr(excluded, column) for column in counters},
+            "first_activity": _earliest(SessionStats.first_activity, excluded.first_activity),
+            "last_activity": _latest(SessionStats.last_activity, excluded.last_activity),
+        },
+    )
+    db.execute(stmt, list(stats.values()))
+    apply_bucket_counts(db, counts)
+
+
+def apply_conversions(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    把一批新写入的转化累加到会话汇总表和时间桶，不提交事务。
+    :param rows: 转化记录，需包含 session_id、target_url、created_at
+    """
+    if not rows:
+        return
+
+    sources = session_sources(db, (row["session_id"] for row in rows))
+    counts = Counter()
+    stats: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        utm_source, has_gclid = sources.get(row["session_id"], (None, False))
+        count_buckets(counts, "conversions", row["created_at"], row["target_url"], utm_source, has_gclid)
+        item = stats.setdefault(row["session_id"], {
+            "session_id": row["session_id"],
+            "session_start": row["created_at"],
+            "event_count": 0,
+            "conversion_count": 0,
+            **{column: 0 for column in EVENT_TYPE_COLUMNS.values()},
+        })
+        item["conversion_count"] += 1
+
+    stmt = upsert(db, SessionStats)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SessionStats.session_id],
+        set_={"conversion_count": SessionStats.conversion_count + stmt.excluded.conversion_count},
+    )
+    db.execute(stmt, list(stats.values()))
+    apply_bucket_counts(db, counts)
+
+
+def backfill(db: Session) -> int:
+    """
+    根据 tokens / events / conversions 全量重建会话汇总表和时间桶并提交。
+    在单个事务中执行，SQLite 下与并发写入串行化，不会重复累加。
+    :return: 重建的会话数
+    """
+    event_stats = (
+        select(
+            Event.session_id,
+            func.count(Event.id).label("event_count"),
+            *[
+                func.sum(case((EventType.name == event_type, 1), else_=0)).label(column)
+                for event_type, column in EVENT_TYPE_COLUMNS.items()
+            ],
+            func.min(Event.created_at).label("first_activity"),
+            func.max(Event.created_at).label("last_activity"),
+        )
+        .outerjoin(EventType, EventType.id == Event.event_code)
+        .group_by(Event.session_id)
+        .subquery()
+    )
+    conversion_stats = (
+        select(Conversion.session_id, func.count(Conversion.id).label("conversion_count"))
+        .group_by(Conversion.session_id)
+        .subquery()
+    )
+
+    columns = [
+        "session_id", "gclid", "utm_source", "session_start", "event_count",
+        *EVENT_TYPE_COLUMNS.values(), "conversion_count", "first_activity", "last_activity",
+    ]
+    source = (
+        select(
+            Token.session_id,
+            Token.gclid,
+            Token.utm_source,
+            Token.created_at,
+            func.coalesce(event_stats.c.event_count, 0),
+            *[func.coalesce(event_stats.c[column], 0) for column in EVENT_TYPE_COLUMNS.values()],
+            func.coalesce(conversion_stats.c.conversion_count, 0),
+            event_stats.c.first_activity,
+            event_stats.c.last_activity,
+        )
+        .outerjoin(event_stats, event_stats.c.session_id == Token.session_id)
+        .outerjoin(conversion_stats, conversion_stats.c.session_id == Token.session_id)
+    )
+
+    db.execute(delete(SessionStats))
+    db.execute(insert(SessionStats).from_select(columns, source))
+    db.execute(delete(MetricBucket))
+    apply_bucket_counts(db, _historical_bucket_counts(db))
+    db.commit()
+    return db.query(func.count(SessionStats.session_id)).scalar()
+
+
+def _historical_bucket_counts(db: Session) -> Counter:
+    """流式扫描历史数据计算时间桶，内存占用只与桶数量有关"""
+    counts = Counter()
+    sessions = db.execute(select(Token.created_at, Token.utm_source, Token.gclid).execution_options(yield_per=5000))
+    for created_at, utm_source, gclid in sessions:
+        count_buckets(counts, "sessions", created_at, None, utm_source, bool(gclid))
+
+    events = db.execute(
+        select(Event.created_at, EventType.name, SessionStats.utm_source, SessionStats.gclid)
+        .outerjoin(EventType, EventType.id == Event.event_code)
+        .outerjoin(SessionStats, SessionStats.session_id == Event.session_id)
+        .execution_options(yield_per=5000)
+    )
+    for created_at, event_type, utm_source, gclid in events:
+        count_buckets(counts, "events", created_at, event_type, utm_source, bool(gclid))
+
+    conversions = db.execute(
+        select(Conversion.created_at, Conversion.target_url, SessionStats.utm_source, SessionStats.gclid)
+        .outerjoin(SessionStats, SessionStats.session_id == Conversion.session_id)
+        .execution_options(yield_per=5000)
+    )
+    for created_at, target_url, utm_source, gclid in conversions:
+        count_buckets(counts, "conversions", created_at, target_url, utm_source, bool(gclid))
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会话汇总表维护")
+    parser.add_argument("command", choices=["backfill"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        count = backfill(db)
+        logger.info(f"Backfilled session stats and metric buckets for {count} sessions")
+    finally:
+        db.close()
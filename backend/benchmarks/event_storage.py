@@ -0,0 +1,179 @@
+"""
+事件存储格式对比：按旧格式（event_type 字符串 + 每条事件含 user_agent / client_ip / timestamp 的 meta JSON）
+生成数据，统计 VACUUM 后的文件大小和查询耗时；执行 app.event_store.migrate 转换为紧凑格式后再统计一次。
+
+查询：
+- session：按会话读取全部事件并还原 meta（管理后台会话详情）；
+- by_type：按事件类型计数。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.event_storage --sessions 2000 --events 30
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+USER_AGENTS = [
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+]
+# 事件类型占比与旧版 /api/track 写入的 meta
+EVENT_MIX = [("page_visit", 0.1), ("scroll", 0.6), ("click", 0.25), ("stock_prefill", 0.05)]
+
+LEGACY_SCHEMA = """
+CREATE TABLE events (
+    id INTEGER NOT NULL PRIMARY KEY,
+    session_id VARCHAR,
+    event_type VARCHAR,
+    meta TEXT,
+    created_at DATETIME
+);
+CREATE INDEX ix_events_session_id ON events (session_id);
+CREATE INDEX ix_events_id ON events (id);
+"""
+
+
+def legacy_meta(event_type: str, rng: random.Random) -> Dict[str, object]:
+    if event_type == "page_visit":
+        return {"gclid": "Cj0KCQjw" + "x" * 40, "utm_source": None}
+    if event_type == "scroll":
+        return {"scrollY": rng.randint(100, 4000)}
+    if event_type == "click":
+        return {"element": rng.choice(["search_button", "confirm_button"]), "search_query": "トヨタ自動車"}
+    return {"stock_code": "7203", "company_name": "トヨタ自動車", "source": "cache"}
+
+
+def build_legacy_db(path: str, sessions: int, events: int) -> None:
+    rng = random.Random(42)
+    types, weights = zip(*EVENT_MIX)
+    connection = sqlite3.connect(path)
+    connection.executescript(LEGACY_SCHEMA)
+    started = datetime(2025, 1, 1)
+    for s in range(sessions):
+        session_id = f"{s:08d}-0000-4000-8000-{rng.getrandbits(48):012x}"
+        user_agent = rng.choice(USER_AGENTS)
+        client_ip = f"203.0.{rng.randrange(256)}.{rng.randrange(256)}"
+        rows = []
+        for e in range(events):
+            created_at = started + timedelta(minutes=s, seconds=e * 5)
+            event_type = rng.choices(types, weights)[0]
+            meta = legacy_meta(event_type, rng)
+            meta.update({"user_agent": user_agent, "client_ip": client_ip, "timestamp": created_at.isoformat()})
+            rows.append((session_id, event_type, json.dumps(meta), created_at.isoformat(" ")))
+        connection.executemany("INSERT INTO events (session_id, event_type, meta, created_at) VALUES (?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+
+def vacuum_size(path: str) -> int:
+    connection = sqlite3.connect(path)
+    connection.execute("VACUUM")
+    connection.close()
+    return os.path.getsize(path)
+
+
+def per_query_ms(func: Callable[[str], object], session_ids, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(session_ids[i % len(session_ids)])
+    return (time.perf_counter() - started) / iterations * 1000
+
+
+def legacy_queries(connection: sqlite3.Connection):
+    def session(session_id):
+        return [
+            {"id": row[0], "event_type": row[1], "meta": json.loads(row[2]) if row[2] else {}, "created_at": row[3]}
+            for row in connection.execute(
+                "SELECT id, event_type, meta, created_at FROM events WHERE session_id = ? ORDER BY created_at", (session_id,)
+            )
+        ]
+
+    def by_type(_):
+        return connection.execute("SELECT event_type, count(*) FROM events GROUP BY event_type").fetchall()
+
+    return session, by_type
+
+
+def compact_queries(connection: sqlite3.Connection):
+    names = dict(connection.execute("SELECT id, name FROM event_types"))
+
+    def session(session_id):
+        device = connection.execute(
+            "SELECT user_agent, client_ip FROM session_devices WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        events = []
+        for row in connection.execute(
+            "SELECT id, event_code, scroll_y, element, meta, created_at FROM events WHERE session_id = ? ORDER BY created_at",
+            (session_id,)
+        ):
+            meta = json.loads(row[4]) if row[4] else {}
+            if row[2] is not None:
+                meta["scrollY"] = row[2]
+            if row[3] is not None:
+                meta["element"] = row[3]
+            if device:
+                meta["user_agent"], meta["client_ip"] = device
+            meta["timestamp"] = row[5]
+            events.append({"id": row[0], "event_type": names.get(row[1]), "meta": meta, "created_at": row[5]})
+        return events
+
+    def by_type(_):
+        rows = connection.execute("SELECT event_code, count(*) FROM events GROUP BY event_code").fetchall()
+        return [(names.get(code), count) for code, count in rows]
+
+    return session, by_type
+
+
+def measure(path: str, queries, iterations: int) -> Dict[str, float]:
+    connection = sqlite3.connect(path)
+    session_ids = [row[0] for row in connection.execute("SELECT DISTINCT session_id FROM events")]
+    random.Random(7).shuffle(session_ids)
+    session, by_type = queries(connection)
+    result = {
+        "session_ms": per_query_ms(session, session_ids, iterations),
+        "by_type_ms": per_query_ms(by_type, session_ids, max(1, iterations // 20)),
+    }
+    connection.close()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=30, help="每个会话的事件数")
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "events.sqlite")
+    build_legacy_db(path, args.sessions, args.events)
+    before = {"size": vacuum_size(path), **measure(path, legacy_queries, args.iterations)}
+
+    # 迁移使用应用自身的数据库配置，需在导入 app 之前设置
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("LOG_LEVEL", "warning")
+    from app.database import Base, engine
+    from app.event_store import migrate
+
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    migrated = migrate()
+    migrate_seconds = time.perf_counter() - started
+    engine.dispose()
+    after = {"size": vacuum_size(path), **measure(path, compact_queries, args.iterations)}
+
+    print(f"{args.sessions * args.events} events, {args.sessions} sessions; migrated {migrated} in {migrate_seconds:.1f}s")
+    print(f"{'format':>8} {'size MiB':>9} {'B/event':>8} {'session ms':>11} {'by_type ms':>11}")
+    for name, result in (("legacy", before), ("compact", after)):
+        print(f"{name:>8} {result['size'] / 2 ** 20:9.2f} {result['size'] / (args.sessions * args.events):8.0f} "
+              f"{result['session_ms']:11.3f} {result['by_type_ms']:11.2f}")
+
+
+if __name__ == "__main__":
+    main()
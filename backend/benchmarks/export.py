@@ -0,0 +1,88 @@
+"""
+流式导出基准：生成不同数量的事件，完整消费 /api/admin/export/events 使用的 stream_export，
+统计吞吐、输出大小和 Python 堆内存峰值（tracemalloc），验证内存不随行数增长。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.export --rows 10000 100000 300000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+
+def fill_events(engine, total: int, start: int) -> None:
+    """直接写入紧凑格式事件（每个会话 20 条），从第 start 条开始补齐到 total 条"""
+    from sqlalchemy import insert
+    from app.models import Event, SessionDevice, SessionStats
+    from app.event_store import event_type_codes
+
+    codes = event_type_codes(["page_visit", "scroll", "click"])
+    began = datetime(2025, 1, 1)
+    with engine.begin() as connection:
+        for offset in range(start, total, 10000):
+            count = min(10000, total - offset)
+            events, sessions = [], []
+            for i in range(offset, offset + count):
+                session_id = f"session-{i // 20:08d}"
+                if i % 20 == 0:
+                    sessions.append(session_id)
+                kind = ("page_visit", "scroll", "click")[min(i % 20, 2)]
+                events.append({
+                    "session_id": session_id,
+                    "event_code": codes[kind],
+                    "scroll_y": 600 if kind == "scroll" else None,
+                    "element": "search_button" if kind == "click" else None,
+                    "meta": '{"search_query": "7203"}' if kind == "click" else None,
+                    "created_at": began + timedelta(seconds=i),
+                })
+            connection.execute(insert(Event), events)
+            if sessions:
+                connection.execute(insert(SessionStats), [
+                    {"session_id": s, "utm_source": "google", "session_start": began, "event_count": 20} for s in sessions
+                ])
+                connection.execute(insert(SessionDevice), [
+                    {"session_id": s, "user_agent": "Mozilla/5.0", "client_ip": "203.0.113.1"} for s in sessions
+                ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    # 导出使用应用自身的数据库配置，需在导入 app 之前设置
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'export.sqlite')}"
+    os.environ.setdefault("LOG_LEVEL", "warning")
+    from app.config import settings
+    from app.database import Base, engine
+    from app.export import stream_export
+
+    Base.metadata.create_all(bind=engine)
+    print(f"{'rows':>9} {'format':>10} {'rows/s':>10} {'output MiB':>11} {'peak heap MiB':>14}")
+    filled = 0
+    for rows in sorted(args.rows):
+        fill_events(engine, rows, filled)
+        filled = rows
+        for fmt, compress in (("csv", False), ("ndjson", False), ("csv", True)):
+            def consume() -> int:
+                return sum(len(chunk) for chunk in stream_export(
+                    "events", fmt, compress, None, None, None, settings.EXPORT_YIELD_PER, settings.EXPORT_CHUNK_BYTES
+                ))
+
+            started = time.perf_counter()
+            size = consume()
+            elapsed = time.perf_counter() - started
+            # tracemalloc 会明显拖慢执行，单独跑一次统计内存峰值
+            tracemalloc.start()
+            consume()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            label = fmt + (".gz" if compress else "")
+            print(f"{rows:9d} {label:>10} {rows / elapsed:10.0f} {size / 2 ** 20:11.2f} {peak / 2 ** 20:14.2f}")
+
+
+if __name__ == "__main__":
+    main()
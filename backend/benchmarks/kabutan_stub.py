@@ -0,0 +1,137 @@
+"""
+kabutan 本地替身服务：返回 benchmarks/fixtures 中保存的股价页面，可配置延迟、错误率和慢速响应体，
+用于在不访问真实站点的情况下测试爬虫和 /api/stock。
+
+后端通过 CRAWLER_BASE_URL 指向替身服务：
+    python -m benchmarks.kabutan_stub --port 18080 --latency 0.2 --error-rate 0.05
+    CRAWLER_BASE_URL=http://127.0.0.1:18080 python -m app.main
+
+运行中可通过接口调整和查看：
+    POST /__config   {"latency": 2.0, "error_rate": 0.3, "slow_body": 1.0}
+    GET  /__stats    请求数、错误数
+    POST /__reset    清零计数
+"""
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+# 没有对应代码的样本时，用该样本替换代码后返回
+TEMPLATE_CODE = "7203"
+BODY_CHUNKS = 8
+
+config = {"latency": 0.0, "jitter": 0.2, "error_rate": 0.0, "slow_body": 0.0}
+stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+pages: Dict[str, str] = {}
+
+
+def load_pages() -> None:
+    for path in FIXTURES_DIR.glob("kabutan_*.html"):
+        code = path.stem.split("_")[1]
+        pages[code] = path.read_text(encoding="utf-8")
+
+
+def render_page(code: str) -> bytes:
+    page = pages.get(code)
+    if page is None:
+        page = pages[TEMPLATE_CODE].replace(TEMPLATE_CODE, code)
+    return page.encode("utf-8")
+
+
+async def kabuka(request: Request) -> Response:
+    stats["requests"] += 1
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    try:
+        latency = config["latency"] * random.uniform(1 - config["jitter"], 1 + config["jitter"])
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if random.random() < config["error_rate"]:
+            stats["errors"] += 1
+            return PlainTextResponse("Service Unavailable", status_code=503)
+        body = render_page(request.query_params.get("code", TEMPLATE_CODE))
+    finally:
+        stats["in_flight"] -= 1
+
+    if config["slow_body"] <= 0:
+        return Response(body, media_type="text/html; charset=utf-8")
+
+    # 慢速响应体：分块发送，总耗时约 slow_body 秒
+    async def chunks():
+        size = len(body) // BODY_CHUNKS + 1
+        for start in range(0, len(body), size):
+            yield body[start:start + size]
+            await asyncio.sleep(config["slow_body"] / BODY_CHUNKS)
+
+    return StreamingResponse(chunks(), media_type="text/html; charset=utf-8")
+
+
+async def update_config(request: Request) -> Response:
+    values = await request.json()
+    config.update({key: float(value) for key, value in values.items() if key in config})
+    return JSONResponse(config)
+
+
+async def get_stats(request: Request) -> Response:
+    return JSONResponse({**stats, "config": config})
+
+
+async def reset_stats(request: Request) -> Response:
+    stats.update(requests=0, errors=0, max_in_flight=stats["in_flight"])
+    return JSONResponse(stats)
+
+
+app = Starlette(
+    routes=[
+        Route("/stock/kabuka", kabuka),
+        Route("/__config", update_config, methods=["POST"]),
+        Route("/__stats", get_stats),
+        Route("/__reset", reset_stats, methods=["POST"]),
+    ],
+    on_startup=[load_pages],
+)
+
+
+def start_stub(port: int, latency: float = 0.0, error_rate: float = 0.0, slow_body: float = 0.0) -> subprocess.Popen:
+    """以子进程启动替身服务，等待可用后返回进程（用 server.stop_server 停止）"""
+    process = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.kabutan_stub", "--port", str(port),
+        "--latency", str(latency), "--error-rate", str(error_rate), "--slow-body", str(slow_body),
+    ])
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/__stats").status_code == 200:
+                return process
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("kabutan stub did not start in time")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.0, help="响应前的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟随机抖动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的比例")
+    parser.add_argument("--slow-body", type=float, default=0.0, help="响应体分块发送的总耗时（秒）")
+    args = parser.parse_args()
+
+    config.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, slow_body=args.slow_body)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
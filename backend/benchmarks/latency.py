@@ -0,0 +1,106 @@
+"""
+公开接口并发延迟基准：以混合负载（get_token / track / convert）请求服务，
+统计不同并发下各接口的 p50 / p99 延迟。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.latency --concurrency 10 50 100 --duration 10
+    # 对已运行的服务压测（例如对比不同版本）
+    python -m benchmarks.latency --url http://127.0.0.1:8000
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+from app.config import settings
+from .server import free_port, start_server, stop_server
+
+# 各接口请求占比
+WORKLOAD = [("get_token", 0.1), ("track", 0.8), ("convert", 0.1)]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def prepare(client: httpx.AsyncClient, username: str, password: str) -> None:
+    """登录后台并确保至少有一个转换链接"""
+    response = await client.post("/admin/login", data={"username": username, "password": password})
+    if "admin_token" not in client.cookies:
+        raise RuntimeError(f"Admin login failed: {response.status_code}")
+    links = (await client.get("/api/admin/links")).json()
+    if not any(link["is_active"] for link in links):
+        await client.post("/api/admin/links", json={"name": "bench", "target_url": "https://example.com", "weight": 1})
+
+
+async def run_level(base_url: str, concurrency: int, duration: float) -> Dict[str, List[float]]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies: Dict[str, List[float]] = {name: [] for name, _ in WORKLOAD}
+    errors = 0
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        token = (await client.get("/api/get_token", params={"gclid": "bench"})).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        names = [name for name, _ in WORKLOAD]
+        weights = [weight for _, weight in WORKLOAD]
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                name = random.choices(names, weights)[0]
+                started = time.perf_counter()
+                if name == "get_token":
+                    response = await client.get("/api/get_token", params={"gclid": "bench"})
+                elif name == "track":
+                    response = await client.post("/api/track", json={"event_type": "scroll", "meta": {}}, headers=headers)
+                else:
+                    response = await client.post("/api/convert", json={"input_value": "bench"}, headers=headers)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                if response.status_code == 200:
+                    latencies[name].append(elapsed_ms)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    if errors:
+        print(f"  {errors} requests failed")
+    return latencies
+
+
+async def run(base_url: str, levels: List[int], duration: float, username: str, password: str) -> None:
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        await prepare(client, username, password)
+
+    print(f"{'concurrency':>11} {'endpoint':>10} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for concurrency in levels:
+        latencies = await run_level(base_url, concurrency, duration)
+        for name, values in latencies.items():
+            if values:
+                print(f"{concurrency:>11} {name:>10} {len(values):>9} {percentile(values, 50):>9.1f} {percentile(values, 99):>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="已运行服务的地址，不指定时自动启动一个单 worker 服务")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--username", default=settings.ADMIN_USERNAME)
+    parser.add_argument("--password", default=settings.ADMIN_PASSWORD)
+    args = parser.parse_args()
+
+    if args.url:
+        asyncio.run(run(args.url, args.concurrency, args.duration, args.username, args.password))
+    else:
+        port = free_port()
+        with tempfile.TemporaryDirectory() as data_dir:
+            process = start_server(port, data_dir)
+            try:
+                asyncio.run(run(f"http://127.0.0.1:{port}", args.concurrency, args.duration, args.username, args.password))
+            finally:
+                stop_server(process)
@@ -0,0 +1,166 @@
+"""
+指标采集开销基准：
+- /api/track 吞吐与延迟：分别在 METRICS_ENABLED=true / false 的子进程中运行（中间件和 SQL 钩子都在导入时注册），
+  交替多轮取中位数以降低噪声；
+- MetricsMiddleware 单次调用开销：包裹一个空 ASGI 应用，对比有无中间件的每请求耗时；
+- SQL 钩子单条语句开销：内存 SQLite 上执行 SELECT 1，对比有无 instrument_engine 的耗时。
+整站吞吐在同配置下的波动就有 ±10% 左右，中间件和钩子的开销以后两项为准。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.metrics --requests 3000 --concurrency 20 --rounds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+async def measure_track(total: int, concurrency: int) -> dict:
+    """在当前进程中压测 /api/track，返回吞吐和延迟分位（毫秒）"""
+    import httpx
+    from app import main
+
+    latencies = []
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 12345))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/api/get_token", params={"gclid": "bench"})
+            headers = {"Authorization": f"Bearer {response.json()['token']}"}
+            body = {"event_type": "scroll", "meta": {"scrollY": 120}}
+
+            async def run(count: int, record: bool) -> None:
+                remaining = count
+
+                async def worker():
+                    nonlocal remaining
+                    while remaining > 0:
+                        remaining -= 1
+                        started = time.perf_counter()
+                        r = await client.post("/api/track", json=body, headers=headers)
+                        r.raise_for_status()
+                        if record:
+                            latencies.append((time.perf_counter() - started) * 1000)
+
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+            await run(min(500, total), False)  # 预热
+            started = time.perf_counter()
+            await run(total, True)
+            elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def run_child(enabled: bool, total: int, concurrency: int) -> dict:
+    env = dict(
+        os.environ,
+        METRICS_ENABLED="true" if enabled else "false",
+        DATABASE_URL=f"sqlite:///{tempfile.mkdtemp()}/bench.sqlite",
+        BOOTSTRAP_LOCK_FILE=os.path.join(tempfile.mkdtemp(), "bootstrap.lock"),
+        LOG_LEVEL="warning",
+        STOCK_REFRESH_ENABLED="false",
+        RETENTION_ENABLED="false",
+    )
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.metrics", "--child", "--requests", str(total), "--concurrency", str(concurrency)],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+async def measure_middleware(iterations: int) -> float:
+    """中间件每次调用的额外耗时（微秒）"""
+    from app.metrics import MetricsMiddleware
+
+    class Route:
+        path = "/api/track"
+
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def routed(scope, receive, send):
+        scope["route"] = Route
+        await endpoint(scope, receive, send)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def timed(app) -> float:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await app({"type": "http", "method": "POST", "path": "/api/track"}, receive, send)
+        return (time.perf_counter() - started) / iterations * 1e6
+
+    instrumented = MetricsMiddleware(routed)
+    await timed(instrumented)
+    return await timed(instrumented) - await timed(routed)
+
+
+def measure_sql_hooks(iterations: int) -> float:
+    """SQL 计时钩子每条语句的额外耗时（微秒），模拟请求内执行"""
+    from sqlalchemy import create_engine, text
+    from app.metrics import _RequestDbStats, _request_db_stats, instrument_engine
+
+    def timed(engine) -> float:
+        with engine.connect() as connection:
+            statement = text("SELECT 1")
+            started = time.perf_counter()
+            for _ in range(iterations):
+                connection.execute(statement)
+            return (time.perf_counter() - started) / iterations * 1e6
+
+    plain = create_engine("sqlite://")
+    instrumented = create_engine("sqlite://")
+    instrument_engine(instrumented)
+    token = _request_db_stats.set(_RequestDbStats())
+    try:
+        timed(plain), timed(instrumented)
+        return timed(instrumented) - timed(plain)
+    finally:
+        _request_db_stats.reset(token)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5, help="每种配置运行的轮数（交替进行）")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure_track(args.requests, args.concurrency))))
+        return
+
+    results = {True: [], False: []}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            results[enabled].append(run_child(enabled, args.requests, args.concurrency))
+
+    summary = {}
+    for enabled, runs in results.items():
+        summary[enabled] = {key: statistics.median(run[key] for run in runs) for key in ("rps", "p50", "p99")}
+        label = "metrics on" if enabled else "metrics off"
+        s = summary[enabled]
+        print(f"{label:>11}: {s['rps']:8.1f} req/s  p50 {s['p50']:.2f} ms  p99 {s['p99']:.2f} ms")
+    print(f"throughput change: {(summary[True]['rps'] / summary[False]['rps'] - 1) * 100:+.1f}%")
+    print(f"middleware overhead: {asyncio.run(measure_middleware(50000)):.2f} us/request")
+    print(f"SQL hook overhead: {measure_sql_hooks(50000):.2f} us/statement")
+
+
+if __name__ == "__main__":
+    main()
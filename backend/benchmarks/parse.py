@@ -0,0 +1,78 @@
+"""
+股价页面解析基准：对比 BeautifulSoup 整页解析（原实现）与 lxml 整页/片段解析，
+并校验解析结果与原实现一致（不一致时退出码为 1）。
+
+页面样本放在 benchmarks/fixtures/*.html，可用保存的 kabutan 页面替换或追加。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.parse --iterations 200
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+from app.crawler import _H2_PATTERN, _price_table_fragment, parse_price_page, parse_price_page_soup
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def per_parse_ms(func: Callable[[], object], iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1000
+
+
+def stream_stop_offset(text: str, max_rows: int) -> int:
+    """模拟 stream 模式按块读取，返回提前断开时已读取的字符数"""
+    for end in range(STREAM_CHUNK_SIZE, len(text) + STREAM_CHUNK_SIZE, STREAM_CHUNK_SIZE):
+        head = text[:end]
+        if _H2_PATTERN.search(head) and _price_table_fragment(head, max_rows) is not None:
+            return min(end, len(text))
+    return len(text)
+
+
+def check(name: str, expected, actual) -> bool:
+    if expected == actual:
+        return True
+    print(f"  MISMATCH {name}:\n    expected {expected!r}\n    actual   {actual!r}")
+    return False
+
+
+def main(iterations: int) -> int:
+    fixtures = sorted(FIXTURES_DIR.glob("*.html"))
+    if not fixtures:
+        print(f"no fixtures in {FIXTURES_DIR}")
+        return 1
+
+    ok = True
+    for path in fixtures:
+        text = path.read_text(encoding="utf-8")
+        expected = parse_price_page_soup(text)
+        print(f"{path.name}: {len(text) / 1024:.0f} KiB, {len(expected[2])} rows, {expected[0]} {expected[1]}")
+
+        ok &= check("lxml full", expected, parse_price_page(text, max_rows=None))
+        ok &= check("lxml fast", parse_price_page_soup(text, max_rows=1), parse_price_page(text, max_rows=1))
+        head = text[:stream_stop_offset(text, 1)]
+        ok &= check("lxml stream", parse_price_page_soup(text, max_rows=1), parse_price_page(head, max_rows=1))
+
+        soup_ms = per_parse_ms(lambda: parse_price_page_soup(text), iterations)
+        full_ms = per_parse_ms(lambda: parse_price_page(text, max_rows=None), iterations)
+        fast_ms = per_parse_ms(lambda: parse_price_page(text, max_rows=1), iterations)
+        print(f"  soup full : {soup_ms:8.3f} ms")
+        print(f"  lxml full : {full_ms:8.3f} ms  ({soup_ms / full_ms:6.1f}x)")
+        print(f"  lxml fast : {fast_ms:8.3f} ms  ({soup_ms / fast_ms:6.1f}x)")
+        print(f"  stream    : stops after {stream_stop_offset(text, 1) / len(text):.0%} of the page")
+
+    print("outputs match" if ok else "outputs differ")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    sys.exit(main(args.iterations))
@@ -0,0 +1,180 @@
+"""
+查询计划回归检查：在 SQLite 上对管理后台和公开接口的高频查询执行 EXPLAIN QUERY PLAN，
+断言使用了预期的索引、没有全表扫描（键集分页还要求不产生临时排序），不满足时退出码为 1。
+另外对比一次性读取大会话全部事件并解码 meta（旧实现）与按游标读取一页的耗时。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.query_plans
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+HEAVY_SESSION = "heavy-session"
+
+
+def populate(engine, sessions: int, events_per_session: int, heavy_events: int) -> None:
+    from sqlalchemy import insert
+    from app.models import Conversion, Event, SessionDevice, SessionStats, Token
+
+    began = datetime(2025, 1, 1)
+    session_ids = [f"session-{i:06d}" for i in range(sessions)] + [HEAVY_SESSION]
+    with engine.begin() as connection:
+        connection.execute(insert(Token), [
+            {"token": f"token-{s}", "session_id": s, "expires_at": began + timedelta(days=1), "created_at": began}
+            for s in session_ids
+        ])
+        connection.execute(insert(SessionStats), [
+            {"session_id": s, "utm_source": "google", "session_start": began + timedelta(minutes=i)}
+            for i, s in enumerate(session_ids)
+        ])
+        connection.execute(insert(SessionDevice), [
+            {"session_id": s, "user_agent": "Mozilla/5.0", "client_ip": "203.0.113.1"} for s in session_ids
+        ])
+        for i, session_id in enumerate(session_ids):
+            count = heavy_events if session_id == HEAVY_SESSION else events_per_session
+            connection.execute(insert(Event), [
+                {
+                    "session_id": session_id,
+                    "event_code": 1 + n % 3,
+                    "scroll_y": n * 10,
+                    "meta": json.dumps({"search_query": "7203"}),
+                    "created_at": began + timedelta(minutes=i, seconds=n),
+                }
+                for n in range(count)
+            ])
+            connection.execute(insert(Conversion), [
+                {"session_id": session_id, "input_value": "v", "target_url": "https://example.com", "created_at": began}
+            ])
+        connection.exec_driver_sql("ANALYZE")
+
+
+def hot_queries():
+    """(名称, 语句, 预期索引名（前缀）, 是否禁止临时排序)；与应用中的查询保持一致"""
+    from sqlalchemy import func, select
+    from app import rollup
+    from app.models import Conversion, Event, MetricBucket, SessionDevice, SessionStats, StockPrice, Token
+    from app.pagination import session_page_query
+
+    cursor = (datetime(2025, 1, 1), 100)
+    start = datetime(2025, 1, 1)
+    return [
+        ("token by value", select(Token.expires_at).where(Token.token == "token-x"), "ix_tokens_token", False),
+        ("token by session", select(Token).where(Token.session_id == "s").limit(1), "ix_tokens_session_id", False),
+        ("session stats", select(SessionStats).where(SessionStats.session_id == "s"), None, False),
+        ("session device", select(SessionDevice).where(SessionDevice.session_id == "s"), None, False),
+        ("events first page", session_page_query(Event, "s", None, 200), "ix_events_session_created", True),
+        ("events next page", session_page_query(Event, "s", cursor, 200), "ix_events_session_created", True),
+        ("conversions page", session_page_query(Conversion, "s", cursor, 200), "ix_conversions_session_created", True),
+        (
+            "analytics list",
+            select(SessionStats)
+            .where(SessionStats.session_start >= start, SessionStats.session_start < start + timedelta(days=1))
+            .order_by(SessionStats.session_start.desc(), SessionStats.session_id)
+            .limit(50),
+            "ix_session_stats_session_start",
+            False,
+        ),
+        (
+            "rollup session sources",
+            select(SessionStats.session_id, SessionStats.utm_source).where(SessionStats.session_id.in_(["a", "b"])),
+            None,
+            False,
+        ),
+        (
+            "metrics series",
+            select(MetricBucket.bucket_start, func.sum(MetricBucket.count))
+            .where(
+                MetricBucket.granularity == "hour",
+                MetricBucket.metric == "events",
+                MetricBucket.bucket_start >= rollup.bucket_start(start, "hour"),
+                MetricBucket.bucket_start < start + timedelta(days=1),
+            )
+            .group_by(MetricBucket.bucket_start)
+            .order_by(MetricBucket.bucket_start),
+            "sqlite_autoindex_metric_buckets",  # 唯一约束 uq_metric_buckets_key
+            False,
+        ),
+        (
+            "stock history",
+            select(StockPrice).where(StockPrice.code == "7203").order_by(StockPrice.trade_date.desc()).limit(30),
+            "sqlite_autoindex_stock_prices",  # 唯一约束 uq_stock_prices_code_date
+            False,
+        ),
+    ]
+
+
+def check_plan(plan: List[str], index: Optional[str], no_sort: bool) -> Optional[str]:
+    """返回失败原因，通过时返回 None"""
+    for line in plan:
+        if line.startswith("SCAN ") and " USING " not in line:
+            return "full table scan"
+        if no_sort and "TEMP B-TREE" in line:
+            return "temporary sort"
+    if index and not any(index in line for line in plan):
+        return f"index {index} not used"
+    if not any(" USING " in line for line in plan):
+        return "no index used"
+    return None
+
+
+def time_session_reads(engine, iterations: int) -> Tuple[float, float]:
+    """旧实现（读取全部事件并解码 meta）与第一页（不解码）的耗时（毫秒）"""
+    from sqlalchemy.orm import Session
+    from app.models import Event
+    from app.pagination import fetch_session_page
+
+    with Session(engine) as db:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            events = db.query(Event).filter(Event.session_id == HEAVY_SESSION).order_by(Event.created_at).all()
+            [json.loads(event.meta) for event in events]
+            db.expunge_all()
+        full = (time.perf_counter() - started) / iterations * 1000
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fetch_session_page(db, Event, HEAVY_SESSION, None, 200)
+            db.expunge_all()
+        page = (time.perf_counter() - started) / iterations * 1000
+    return full, page
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--events", type=int, default=20, help="普通会话的事件数")
+    parser.add_argument("--heavy-events", type=int, default=5000, help="大会话的事件数")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    # 使用应用自身的建表和索引逻辑，需在导入 app 之前设置数据库
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.sqlite')}"
+    os.environ.setdefault("LOG_LEVEL", "warning")
+    from app.bootstrap import bootstrap
+    from app.database import engine
+
+    bootstrap()
+    populate(engine, args.sessions, args.events, args.heavy_events)
+
+    failures = 0
+    with engine.connect() as connection:
+        for name, stmt, index, no_sort in hot_queries():
+            sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            plan = [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+            reason = check_plan(plan, index, no_sort)
+            failures += reason is not None
+            print(f"{'FAIL' if reason else 'ok':>4}  {name:<24} {' | '.join(plan)}" + (f"  <- {reason}" if reason else ""))
+
+    full, page = time_session_reads(engine, args.iterations)
+    print(f"\nsession with {args.heavy_events} events: full load + decode {full:.2f} ms, first page of 200 {page:.2f} ms")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
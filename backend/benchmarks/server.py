@@ -0,0 +1,46 @@
+"""以子进程方式启动后端服务，供需要真实 HTTP 服务的基准脚本使用"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, data_dir: str, workers: int = 1, **env_overrides: str) -> subprocess.Popen:
+    """启动 python -m app.main，使用 data_dir 下的临时数据库，等待服务可用后返回进程"""
+    env = dict(
+        os.environ,
+        BACKEND_WORKERS=str(workers),
+        BACKEND_HOST="127.0.0.1",
+        BACKEND_PORT=str(port),
+        DATABASE_URL=f"sqlite:///{data_dir}/bench.sqlite",
+        BOOTSTRAP_LOCK_FILE=f"{data_dir}/.bootstrap.lock",
+        LOG_LEVEL="warning",
+        **env_overrides,
+    )
+    env.pop("APP_BOOTSTRAPPED", None)
+    process = subprocess.Popen([sys.executable, "-m", "app.main"], env=env)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/google-tracking-settings").status_code == 200:
+                return process
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not start in time")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.terminate()
+    process.wait(timeout=30)
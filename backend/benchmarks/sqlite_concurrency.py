@@ -0,0 +1,122 @@
+"""
+SQLite 并发写入压力测试：模拟多个 worker 进程、每个进程多个线程同时写入事件并读取汇总，
+分别在 default（SQLite 默认）与 performance（WAL 等调优）两种存储配置下统计吞吐和锁错误。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.sqlite_concurrency --processes 4 --threads 4 --duration 5
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+os.environ.setdefault("LOG_LEVEL", "warning")
+
+from sqlalchemy import func, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, create_db_engine
+from app.models import Event
+
+
+def run_process(database_url: str, profile: str, threads: int, duration: float, batch_size: int, queue) -> None:
+    engine = create_db_engine(database_url, profile)
+    Session = sessionmaker(bind=engine)
+    deadline = time.monotonic() + duration
+    result = {"writes": 0, "reads": 0, "locked": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def writer():
+        rows = [
+            {"session_id": f"s{os.getpid()}", "event_code": 1, "scroll_y": 120, "created_at": datetime.utcnow()}
+            for _ in range(batch_size)
+        ]
+        while time.monotonic() < deadline:
+            db = Session()
+            try:
+                db.execute(insert(Event), rows)
+                db.commit()
+                key = "writes"
+            except OperationalError as e:
+                db.rollback()
+                key = "locked" if "locked" in str(e) else "errors"
+            finally:
+                db.close()
+            with lock:
+                result[key] += 1
+
+    def reader():
+        while time.monotonic() < deadline:
+            db = Session()
+            try:
+                db.query(Event.event_code, func.count(Event.id)).group_by(Event.event_code).all()
+                key = "reads"
+            except OperationalError as e:
+                key = "locked" if "locked" in str(e) else "errors"
+            finally:
+                db.close()
+            with lock:
+                result[key] += 1
+
+    workers = [threading.Thread(target=writer) for _ in range(threads)]
+    workers.append(threading.Thread(target=reader))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    engine.dispose()
+    queue.put(result)
+
+
+def measure(profile: str, processes: int, threads: int, duration: float, batch_size: int, base_dir: str = None) -> dict:
+    # 数据目录应与生产数据库在同类磁盘上，tmpfs 上 fsync 几乎没有开销
+    with tempfile.TemporaryDirectory(dir=base_dir) as data_dir:
+        database_url = f"sqlite:///{data_dir}/stress.sqlite"
+        engine = create_db_engine(database_url, profile)
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+
+        ctx = multiprocessing.get_context("spawn")
+        queue = ctx.Queue()
+        children = [
+            ctx.Process(target=run_process, args=(database_url, profile, threads, duration, batch_size, queue))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        results = [queue.get() for _ in children]
+        for child in children:
+            child.join()
+
+    total = {key: sum(result[key] for result in results) for key in results[0]}
+    total["commits_per_sec"] = total["writes"] / duration
+    total["events_per_sec"] = total["writes"] * batch_size / duration
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="每个进程的写入线程数")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--batch-size", type=int, default=1, help="每次提交写入的事件数")
+    parser.add_argument("--dir", default=None, help="临时数据库所在目录，默认系统临时目录")
+    args = parser.parse_args()
+
+    failed = False
+    for profile in ("default", "performance"):
+        result = measure(profile, args.processes, args.threads, args.duration, args.batch_size, args.dir)
+        print(
+            f"{profile:>11}: {result['commits_per_sec']:8.1f} commits/s  {result['events_per_sec']:9.1f} events/s  "
+            f"reads={result['reads']}  locked={result['locked']}  errors={result['errors']}",
+            flush=True
+        )
+        if profile == "performance" and (result["locked"] or result["errors"]):
+            failed = True
+
+    # performance 配置下不允许出现锁错误
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,121 @@
+"""
+/api/stock 基准：后端的爬虫指向本地 kabutan 替身服务，统计以下场景的吞吐、p50 / p99 延迟、
+上游请求数和各数据来源的响应数：
+- cold：每个请求都是从未查询过的代码（缓存和本地存储都未命中）；
+- warm：少量代码预热后重复请求；
+- degraded：上游变慢、部分请求返回 503、响应体缓慢，验证延迟预算、熔断和降级。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.stock --requests 500 --concurrency 20 --latency 0.2
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+from .kabutan_stub import start_stub
+from .latency import percentile
+from .server import free_port, start_server, stop_server
+
+WARM_CODES = 20
+DEGRADED_CODES = 50
+
+
+async def run_scenario(base_url: str, stub_url: str, name: str, stub_config: Dict[str, float],
+                       codes: List[str], concurrency: int, warm: bool = False) -> Dict[str, object]:
+    async with httpx.AsyncClient(timeout=60) as stub:
+        await stub.post(f"{stub_url}/__config", json=stub_config)
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            if warm:
+                for code in set(codes):
+                    await client.get("/api/stock", params={"code": code})
+
+            await stub.post(f"{stub_url}/__reset")
+            latencies: List[float] = []
+            sources: Counter = Counter()
+            queue = list(codes)
+
+            async def worker():
+                while queue:
+                    code = queue.pop()
+                    started = time.perf_counter()
+                    response = await client.get("/api/stock", params={"code": code})
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    sources[response.json().get("source") if response.status_code == 200 else response.status_code] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        upstream = (await stub.get(f"{stub_url}/__stats")).json()
+
+    return {
+        "scenario": name,
+        "rps": len(codes) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "upstream": upstream["requests"],
+        "upstream_errors": upstream["errors"],
+        "fallback": sources["fallback"] / len(codes),
+        "sources": dict(sources),
+    }
+
+
+async def main_async(base_url: str, stub_url: str, total: int, concurrency: int, latency: float,
+                     degraded: Dict[str, float]) -> None:
+    normal = {"latency": latency, "error_rate": 0.0, "slow_body": 0.0}
+    scenarios = [
+        ("cold", normal, [str(1000 + i) for i in range(total)], False),
+        ("warm", normal, [str(2000 + i % WARM_CODES) for i in range(total)], True),
+        ("degraded", degraded, [str(3000 + random.randrange(DEGRADED_CODES)) for _ in range(total)], False),
+    ]
+    results = [
+        await run_scenario(base_url, stub_url, name, config, codes, concurrency, warm)
+        for name, config, codes, warm in scenarios
+    ]
+
+    print(f"{'scenario':>9} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'upstream':>9} {'errors':>7} {'fallback':>9}  sources")
+    for r in results:
+        print(f"{r['scenario']:>9} {r['rps']:9.1f} {r['p50']:9.1f} {r['p99']:9.1f} {r['upstream']:9d} "
+              f"{r['upstream_errors']:7d} {r['fallback']:9.1%}  {r['sources']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="正常场景的上游延迟（秒）")
+    parser.add_argument("--degraded-latency", type=float, default=2.0)
+    parser.add_argument("--degraded-error-rate", type=float, default=0.3)
+    parser.add_argument("--degraded-slow-body", type=float, default=0.5)
+    parser.add_argument("--refresher", action="store_true", help="开启热门代码后台刷新（默认关闭，便于统计上游请求数）")
+    args = parser.parse_args()
+
+    degraded_config = {
+        "latency": args.degraded_latency,
+        "error_rate": args.degraded_error_rate,
+        "slow_body": args.degraded_slow_body,
+    }
+    stub_port, backend_port = free_port(), free_port()
+    stub_process = start_stub(stub_port)
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    server = start_server(
+        backend_port,
+        tempfile.mkdtemp(),
+        CRAWLER_BASE_URL=stub_url,
+        STOCK_REFRESH_ENABLED="true" if args.refresher else "false",
+    )
+    try:
+        asyncio.run(main_async(
+            f"http://127.0.0.1:{backend_port}", stub_url, args.requests, args.concurrency, args.latency, degraded_config
+        ))
+    finally:
+        stop_server(server)
+        stop_server(stub_process)
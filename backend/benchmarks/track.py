@@ -0,0 +1,62 @@
+"""
+/api/track 吞吐基准：对比 strict（每次查库校验 token）与 cached（缓存校验结果）两种模式。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.track --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+# 使用临时数据库，避免污染 data/db.sqlite
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.sqlite")
+os.environ.setdefault("LOG_LEVEL", "warning")
+
+import httpx
+
+from app import main
+
+
+async def run_mode(client: httpx.AsyncClient, mode: str, total: int, concurrency: int) -> float:
+    main.settings.TOKEN_VERIFY_MODE = mode
+    main.known_tokens.clear()
+
+    response = await client.get("/api/get_token", params={"gclid": "bench"})
+    headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    body = {"event_type": "scroll", "meta": {"scrollY": 120}}
+
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            r = await client.post("/api/track", json=body, headers=headers)
+            r.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return total / (time.perf_counter() - started)
+
+
+async def main_async(total: int, concurrency: int) -> None:
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 12345))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            # 预热
+            await run_mode(client, "cached", min(200, total), concurrency)
+            results = {mode: await run_mode(client, mode, total, concurrency) for mode in ("strict", "cached")}
+
+    for mode, rps in results.items():
+        print(f"{mode:>7}: {rps:8.1f} req/s")
+    print(f"speedup: {results['cached'] / results['strict']:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.requests, args.concurrency))
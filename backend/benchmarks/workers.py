@@ -0,0 +1,70 @@
+"""
+多 worker 吞吐扩展基准：分别以 1..N 个 worker 启动服务（python -m app.main），
+用多个压测进程持续请求 /api/track，统计各配置下的 req/s。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.workers --workers 1 2 4 --duration 10 --clients 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import tempfile
+import time
+
+import httpx
+
+from .server import free_port, start_server, stop_server
+
+
+async def load(base_url: str, duration: float, concurrency: int) -> int:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        response = await client.get("/api/get_token", params={"gclid": "bench"})
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+        body = {"event_type": "scroll", "meta": {"scrollY": 120}}
+        deadline = time.monotonic() + duration
+        done = 0
+
+        async def worker():
+            nonlocal done
+            while time.monotonic() < deadline:
+                r = await client.post("/api/track", json=body, headers=headers)
+                if r.status_code == 200:
+                    done += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return done
+
+
+def run_client(args) -> int:
+    return asyncio.run(load(*args))
+
+
+def measure(workers: int, duration: float, clients: int, concurrency: int) -> float:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as data_dir:
+        process = start_server(port, data_dir, workers=workers)
+        try:
+            with multiprocessing.Pool(clients) as pool:
+                counts = pool.map(run_client, [(f"http://127.0.0.1:{port}", duration, concurrency)] * clients)
+        finally:
+            stop_server(process)
+    return sum(counts) / duration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--clients", type=int, default=4, help="压测进程数")
+    parser.add_argument("--concurrency", type=int, default=16, help="每个压测进程的并发连接数")
+    args = parser.parse_args()
+
+    results = {}
+    for workers in args.workers:
+        results[workers] = measure(workers, args.duration, args.clients, args.concurrency)
+        print(f"workers={workers:<3} {results[workers]:8.1f} req/s", flush=True)
+
+    baseline = results[args.workers[0]]
+    for workers, rps in results.items():
+        print(f"workers={workers:<3} scaling {rps / baseline:.2f}x")
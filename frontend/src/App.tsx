@@ -1,13 +1,13 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './assets/css/style.css';
 import { 
-  getGoogleTrackingConfig, 
   loadGoogleTracking, 
   trackConversion, 
   trackGA4Event,
   trackPageView 
 } from './utils/googleTracking';
 import { getImage } from './utils/imageLoader';
+import { EventBuffer } from './utils/eventBuffer';
 
 interface TokenResponse {
   token: string;
@@ -20,6 +20,17 @@ interface GoogleTrackingConfig {
   google_ads_conversion_label: string;
 }
 
+interface StockResponse {
+  success: boolean;
+  data?: { companyName?: string };
+  source?: string;
+}
+
+interface BootstrapResponse extends TokenResponse {
+  tracking_settings: GoogleTrackingConfig;
+  stock: StockResponse | null;
+}
+
 function StockDataReport() {
   const [token, setToken] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
@@ -42,30 +53,82 @@ function StockDataReport() {
     };
   };
 
+  // 事件缓冲：批量上报，页面隐藏时通过 sendBeacon 发送
+  const eventBufferRef = useRef<EventBuffer | null>(null);
+  if (!eventBufferRef.current) {
+    eventBufferRef.current = new EventBuffer({ endpoint: `${API_BASE_URL}/api/track/batch` });
+  }
+
+  useEffect(() => {
+    const eventBuffer = eventBufferRef.current!;
+    eventBuffer.start();
+    return () => eventBuffer.stop();
+  }, []);
+
   // 追踪事件
-  const trackEvent = async (eventType: string, meta: any = {}) => {
-    if (!token) return;
-    
+  const trackEvent = (eventType: string, meta: any = {}) => {
+    eventBufferRef.current?.track(eventType, meta);
+  };
+
+  // 初始化 Google 跟踪
+  const initializeGoogleTracking = async (config: GoogleTrackingConfig) => {
     try {
-      await fetch(`${API_BASE_URL}/api/track`, {
-        method: 'POST',
-        headers: {
-          'Authorization': `Bearer ${token}`,
-          'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-          event_type: eventType,
-          meta
-        })
-      });
+      if (config.ga4_measurement_id || config.google_ads_conversion_id) {
+        await loadGoogleTracking(config);
+        trackPageView(config);
+        console.log('Google Tracking initialized with config:', config);
+      } else {
+        console.log('Google Tracking not configured');
+      }
+    } catch (error) {
+      console.error('Failed to initialize Google Tracking:', error);
+    }
+  };
+
+  // 初始化数据中没有缓存的行情时，单独请求 /api/stock
+  const fetchStockData = async (code: string): Promise<StockResponse | null> => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/stock?code=${encodeURIComponent(code)}`);
+      
+      if (!response.ok) {
+        console.warn('Failed to fetch stock data for prefill');
+        return null;
+      }
+      
+      return await response.json();
     } catch (error) {
-      console.error('Failed to track event:', error);
+      console.error('Error prefilling stock name:', error);
+      // 静默失败，不影响用户体验
+      return null;
     }
   };
 
-  // 初始化获取 token
+  // 根据 URL 参数 code 预填充股票名称
+  const applyStockPrefill = (code: string, stockData: StockResponse | null, config: GoogleTrackingConfig) => {
+    if (!stockData?.success || !stockData.data?.companyName) return;
+    
+    setSearchInput(stockData.data.companyName);
+    
+    // 追踪预填充事件
+    trackEvent('stock_prefill', {
+      stock_code: code,
+      company_name: stockData.data.companyName,
+      source: stockData.source || 'unknown'
+    });
+    
+    if (config.ga4_measurement_id || config.google_ads_conversion_id) {
+      trackGA4Event('stock_prefill', {
+        event_category: 'engagement',
+        event_label: 'url_parameter_prefill',
+        stock_code: code,
+        company_name: stockData.data.companyName
+      });
+    }
+  };
+
+  // 初始化：一次请求获取 token、跟踪设置和股票预填充数据，页面访问由服务端记录
   useEffect(() => {
-    const initializeToken = async () => {
+    const initialize = async () => {
       const { gclid, utm_source, code } = getUrlParams();
       
       if (!gclid && !utm_source) {
@@ -74,102 +137,41 @@ function StockDataReport() {
         return;
       }
 
+      let payload: BootstrapResponse;
       try {
         const params = new URLSearchParams();
         if (gclid) params.append('gclid', gclid);
         if (utm_source) params.append('utm_source', utm_source);
+        if (code) params.append('code', code);
 
-        const response = await fetch(`${API_BASE_URL}/api/get_token?${params}`);
+        const response = await fetch(`${API_BASE_URL}/api/bootstrap?${params}`);
         
         if (!response.ok) {
           throw new Error('アクセストークンの取得に失敗しました');
         }
 
-        const data: TokenResponse = await response.json();
-        setToken(data.token);
-        
-        // 追踪页面访问
-        setTimeout(() => {
-          trackEvent('page_visit', { gclid, utm_source });
-        }, 100);
-        
+        payload = await response.json();
+        setToken(payload.token);
+        eventBufferRef.current?.setToken(payload.token);
       } catch (error) {
         setError('アクセストークンの取得に失敗しました');
         console.error('Failed to get token:', error);
-      } finally {
         setLoading(false);
+        return;
       }
-    };
-
-    initializeToken();
-  }, []);
-
-  // 根据 URL 参数 code 预填充股票名称
-  useEffect(() => {
-    const prefillStockName = async () => {
-      if (loading || !token) return;
       
-      const { code } = getUrlParams();
-      if (!code) return;
+      setLoading(false);
       
-      try {
-        const response = await fetch(`${API_BASE_URL}/api/stock?code=${code}`);
-        
-        if (!response.ok) {
-          console.warn('Failed to fetch stock data for prefill');
-          return;
-        }
-        
-        const stockData = await response.json();
-        
-        if (stockData.success && stockData.data && stockData.data.companyName) {
-          setSearchInput(stockData.data.companyName);
-          
-          // 追踪预填充事件
-          await trackEvent('stock_prefill', {
-            stock_code: code,
-            company_name: stockData.data.companyName,
-            source: stockData.source || 'unknown'
-          });
-          
-          if (googleConfig) {
-            trackGA4Event('stock_prefill', {
-              event_category: 'engagement',
-              event_label: 'url_parameter_prefill',
-              stock_code: code,
-              company_name: stockData.data.companyName
-            });
-          }
-        }
-      } catch (error) {
-        console.error('Error prefilling stock name:', error);
-        // 静默失败，不影响用户体验
-      }
-    };
-    
-    prefillStockName();
-  }, [loading, token, googleConfig]);
-
-  // 初始化 Google 跟踪
-  useEffect(() => {
-    const initializeGoogleTracking = async () => {
-      try {
-        const config = await getGoogleTrackingConfig();
-        setGoogleConfig(config);
-        
-        if (config.ga4_measurement_id || config.google_ads_conversion_id) {
-          await loadGoogleTracking(config);
-          trackPageView(config);
-          console.log('Google Tracking initialized with config:', config);
-        } else {
-          console.log('Google Tracking not configured');
-        }
-      } catch (error) {
-        console.error('Failed to initialize Google Tracking:', error);
+      const config = payload.tracking_settings;
+      setGoogleConfig(config);
+      initializeGoogleTracking(config);
+      
+      if (code) {
+        applyStockPrefill(code, payload.stock ?? await fetchStockData(code), config);
       }
     };
 
-    initializeGoogleTracking();
+    initialize();
   }, []);
 
   // 监听滚动事件
@@ -202,7 +204,7 @@ function StockDataReport() {
       return;
     }
 
-    await trackEvent('click', {
+    trackEvent('click', {
       element: 'search_button',
       search_query: searchQuery
     });
@@ -227,7 +229,7 @@ function StockDataReport() {
 
   // 处理转化
   const handleConversion = async () => {
-    await trackEvent('click', { 
+    trackEvent('click', { 
       element: 'confirm_button',
       search_query: searchInput
     });
@@ -263,6 +265,7 @@ function StockDataReport() {
         });
       }
       
+      eventBufferRef.current?.flushWithBeacon();
       window.location.href = data.redirect_url;
 
     } catch (error) {
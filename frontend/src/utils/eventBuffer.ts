@@ -0,0 +1,124 @@
+// 事件批量上报工具：缓冲事件，按时间间隔、批量大小或页面隐藏时统一发送到 /api/track/batch
+
+interface BufferedEvent {
+  event_type: string;
+  meta: Record<string, any>;
+}
+
+interface EventBufferOptions {
+  endpoint: string;
+  flushInterval?: number;
+  maxBatchSize?: number;
+  maxBufferSize?: number;
+}
+
+export class EventBuffer {
+  private endpoint: string;
+  private flushInterval: number;
+  private maxBatchSize: number;
+  private maxBufferSize: number;
+  private token: string | null = null;
+  private events: BufferedEvent[] = [];
+  private timer: ReturnType<typeof setInterval> | null = null;
+
+  constructor(options: EventBufferOptions) {
+    this.endpoint = options.endpoint;
+    this.flushInterval = options.flushInterval ?? 5000;
+    this.maxBatchSize = options.maxBatchSize ?? 50;
+    this.maxBufferSize = options.maxBufferSize ?? 500;
+  }
+
+  // 拿到 token 之前产生的事件会先缓存，设置 token 后一起发送
+  setToken(token: string) {
+    this.token = token;
+    if (this.events.length > 0) {
+      this.flush();
+    }
+  }
+
+  track(eventType: string, meta: Record<string, any> = {}) {
+    if (this.events.length >= this.maxBufferSize) {
+      this.events.shift();
+    }
+    this.events.push({ event_type: eventType, meta });
+
+    if (this.events.length >= this.maxBatchSize) {
+      this.flush();
+    }
+  }
+
+  // 普通发送使用 fetch，失败时把事件放回缓冲区等待下次发送
+  async flush() {
+    if (!this.token || this.events.length === 0) return;
+
+    const batch = this.events.splice(0, this.maxBatchSize);
+    try {
+      const response = await fetch(this.endpoint, {
+        method: 'POST',
+        keepalive: true,
+        headers: {
+          'Authorization': `Bearer ${this.token}`,
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(batch)
+      });
+      if (response.status === 503) {
+        this.requeue(batch);
+      }
+    } catch (error) {
+      console.error('Failed to track events:', error);
+      this.requeue(batch);
+    }
+  }
+
+  // 页面隐藏/卸载时使用 sendBeacon，token 放在请求体中
+  flushWithBeacon() {
+    if (!this.token) return;
+
+    while (this.events.length > 0) {
+      const batch = this.events.splice(0, this.maxBatchSize);
+      const body = JSON.stringify({ token: this.token, events: batch });
+      const sent = typeof navigator.sendBeacon === 'function'
+        && navigator.sendBeacon(this.endpoint, new Blob([body], { type: 'text/plain' }));
+
+      if (!sent) {
+        fetch(this.endpoint, {
+          method: 'POST',
+          keepalive: true,
+          headers: { 'Content-Type': 'text/plain' },
+          body
+        }).catch((error) => console.error('Failed to track events:', error));
+      }
+    }
+  }
+
+  start() {
+    if (this.timer) return;
+    this.timer = setInterval(() => this.flush(), this.flushInterval);
+    document.addEventListener('visibilitychange', this.handleVisibilityChange);
+    window.addEventListener('pagehide', this.handlePageHide);
+  }
+
+  stop() {
+    if (this.timer) {
+      clearInterval(this.timer);
+      this.timer = null;
+    }
+    document.removeEventListener('visibilitychange', this.handleVisibilityChange);
+    window.removeEventListener('pagehide', this.handlePageHide);
+  }
+
+  private requeue(batch: BufferedEvent[]) {
+    this.events = batch.concat(this.events).slice(0, this.maxBufferSize);
+  }
+
+  private handleVisibilityChange = () => {
+    if (document.visibilityState === 'hidden') {
+      this.flushWithBeacon();
+    }
+  };
+
+  private handlePageHide = () => {
+    this.flushWithBeacon();
+  };
+}